@@ -0,0 +1,120 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from deadline import check_deadline, phase_timeout
+from metrics import ADMISSION_REJECTED, ADMISSION_WAITING, observe_phase
+
+# Cap on WinRM sessions in flight in this process (keep at or below the gunicorn thread count).
+ADMISSION_MAX_SESSIONS = int(os.environ.get("ADMISSION_MAX_SESSIONS", "24"))
+# Mutating sessions (proxy/timezone changes) allowed at once per target.
+ADMISSION_MAX_PER_TARGET = int(os.environ.get("ADMISSION_MAX_PER_TARGET", "1"))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "64"))
+# How long a request may wait for a slot; well under the gunicorn worker timeout.
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+
+SERVER_BUSY = "SERVER_BUSY"
+TARGET_BUSY = "TARGET_BUSY"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, error_code: str, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.error_code = error_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded admission for WinRM work: at most max_sessions in flight, at most
+    max_per_target mutating sessions per target, and at most queue_size callers
+    waiting. Waiters give up after queue_timeout; both overflow and timeout are
+    raised as AdmissionRejected with a Retry-After estimate.
+    """
+
+    def __init__(self, max_sessions: int = ADMISSION_MAX_SESSIONS, max_per_target: int = ADMISSION_MAX_PER_TARGET,
+                 queue_size: int = ADMISSION_QUEUE_SIZE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        self.max_sessions = max_sessions
+        self.max_per_target = max_per_target
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._per_target: dict[str, int] = {}
+        self._waiting = 0
+        # Moving average of how long a session holds its slot, for Retry-After.
+        self._hold_seconds = 1.0
+        self._changed = threading.Condition()
+
+    @contextmanager
+    def admit(self, target: str, mutate: bool = True) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            with self._changed:
+                if not self._has_slot(target, mutate):
+                    self._wait(target, mutate, started)
+                self._in_flight += 1
+                if mutate:
+                    self._per_target[target] = self._per_target.get(target, 0) + 1
+        except AdmissionRejected as exc:
+            observe_phase("admission_wait", time.monotonic() - started, exc.error_code)
+            raise
+        observe_phase("admission_wait", time.monotonic() - started)
+
+        admitted = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._in_flight -= 1
+                if mutate:
+                    remaining = self._per_target[target] - 1
+                    if remaining:
+                        self._per_target[target] = remaining
+                    else:
+                        del self._per_target[target]
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * (time.monotonic() - admitted)
+                self._changed.notify_all()
+
+    def _has_slot(self, target: str, mutate: bool) -> bool:
+        if self._in_flight >= self.max_sessions:
+            return False
+        return not mutate or self._per_target.get(target, 0) < self.max_per_target
+
+    def _wait(self, target: str, mutate: bool, started: float) -> None:
+        # Caller holds the condition.
+        if self._waiting >= self.queue_size:
+            raise self._reject(SERVER_BUSY, f"{self._waiting} requests already queued", target, mutate)
+
+        self._waiting += 1
+        ADMISSION_WAITING.inc()
+        try:
+            # Never queue past the request deadline; running out of it is a TIMEOUT, not a 429
+            deadline = started + phase_timeout("admission_wait", self.queue_timeout)
+            while not self._has_slot(target, mutate):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    check_deadline("admission_wait")
+                    target_busy = self._in_flight < self.max_sessions
+                    code = TARGET_BUSY if target_busy else SERVER_BUSY
+                    detail = (f"Another configuration of this server is still running after {self.queue_timeout:g}s"
+                              if target_busy else f"No WinRM session slot freed up within {self.queue_timeout:g}s")
+                    raise self._reject(code, detail, target, mutate)
+                self._changed.wait(remaining)
+        finally:
+            self._waiting -= 1
+            ADMISSION_WAITING.dec()
+
+    def _reject(self, code: str, detail: str, target: str, mutate: bool) -> AdmissionRejected:
+        ADMISSION_REJECTED.labels(code).inc()
+        if code == TARGET_BUSY:
+            retry_after = self._hold_seconds
+        else:
+            retry_after = self._hold_seconds * (self._waiting + 1) / max(1, self.max_sessions)
+        return AdmissionRejected(code, detail, max(1, math.ceil(retry_after)))
+
+
+ADMISSION = AdmissionController()
@@ -1,371 +1,534 @@
-from flask import Flask, request, jsonify
-from pypsrp.wsman import WSMan
-from pypsrp.powershell import PowerShell, RunspacePool
+from flask import Flask, Response, g, request, jsonify
+from pypsrp.complex_objects import PSInvocationState
+from pypsrp.powershell import PowerShell
 import json
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from contextvars import copy_context
 from datetime import datetime
 
 from winrm_diagnostics import (
+    SCAN_CONCURRENCY,
+    TCP_TIMEOUT_SECONDS,
+    auth_check,
     classify_connection_error,
+    run_port_stage,
     run_preflight_check,
     build_error_response,
+    scan_winrm_ports,
 )
+from winrm_pool import (
+    POOL_CACHE,
+    TRANSPORTS,
+    WINRM_USERNAME,
+    credential_fingerprint,
+    invoke_pipeline,
+    stop_pipeline,
+)
+from deadline import TIMEOUT, Deadline, current_deadline, deadline_scope, remaining_budget, requested_deadline
+from admission import ADMISSION, SERVER_BUSY, TARGET_BUSY, AdmissionRejected
+from circuit_breaker import CIRCUIT_BREAKER, CircuitOpenError
+from drift import DRIFT_DRIFTED, DRIFT_ENABLED, DRIFT_OK, DRIFT_SCHEDULER
+from jobs import JOB_STORE, JobStoreFull
+from singleflight import LEADER, SINGLE_FLIGHT
+from log_pipeline import begin_request_logging, configure_logging
+from metrics import render_metrics, request_finished, request_started, timed_phase
+from timings import SpanRecorder, current_recorder, record_remote_spans, recording
+from remote_scripts import (
+    EXTEND_RDP,
+    FUSED,
+    GET_TIMEZONE,
+    PROXY_IPINFO,
+    PUBLIC_IP,
+    PUBLIC_IP_URL,
+    TIMEZONE_SYNC,
+    VERIFY,
+)
+from proxy_probe import PROXY_PROBE_ENABLED, PROXY_PROBER, PROXY_SCAN_CONCURRENCY, ProxyUnreachable, proxy_check
+from result_store import (
+    HISTORY_DEFAULT_LIMIT,
+    RESULT_EXECUTE,
+    RESULT_EXTEND_RDP,
+    RESULT_KINDS,
+    RESULT_PREFLIGHT,
+    RESULT_STORE,
+    RESULT_STORE_ENABLED,
+    RESULT_VERIFY,
+)
+from geoip import GEOIP_RESOLVER
+from timezones import country_to_timezone, iana_to_windows_timezone
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Structured JSON logs, written by a background thread (see log_pipeline.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Endpoints answering synchronously from a WinRM session: their whole request runs
+# under one deadline ("deadline" in the body, seconds). Jobs and batch items get
+# their own when they start (see submit_execute_job and run_batch_item).
+DEADLINE_ENDPOINTS = {"preflight_check", "execute_script", "configure", "verify"}
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.endpoint or "unknown"
+    g.metrics_started = request_started(g.metrics_endpoint)
+    begin_request_logging(g.metrics_endpoint)
+    # Under asgi.py the prefetched probes already ran, and were timed, on the event loop
+    if current_recorder.get() is None:
+        current_recorder.set(SpanRecorder())
+
+
+@app.before_request
+def start_request_deadline():
+    if request.endpoint in DEADLINE_ENDPOINTS:
+        data = request.get_json(silent=True)
+        seconds = requested_deadline(data.get('deadline') if isinstance(data, dict) else None)
+        g.deadline_token = current_deadline.set(Deadline(seconds))
+
+
+def wants_timings(data=None):
+    """
+    Per-request opt-in for the timings breakdown: "includeTimings": true in the
+    JSON body (or a batch item), or ?timings=1.
+    """
+    if data is None:
+        data = request.get_json(silent=True)
+    if isinstance(data, dict) and is_truthy(data.get('includeTimings')):
+        return True
+    return is_truthy(request.args.get('timings'))
+
+
+@app.after_request
+def attach_timings(response):
+    """
+    Log the span breakdown of requests that touched WinRM, and add it to the JSON
+    body as "timings" when the client opted in.
+    """
+    recorder = current_recorder.get()
+    if recorder is None or not recorder.spans:
+        return response
+    timings = recorder.to_dict()
+    logger.info("Timings for %s", request.endpoint, extra={"timings": timings})
+    if wants_timings() and response.is_json and not response.is_streamed:
+        payload = response.get_json()
+        if isinstance(payload, dict):
+            payload["timings"] = timings
+            response.set_data(app.json.dumps(payload))
+    return response
+
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        request_finished(g.metrics_endpoint, started, response.status_code)
+    return response
+
+
+@app.teardown_request
+def abort_request_metrics(exc):
+    # Only still set if after_request never ran (unhandled exception)
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        request_finished(g.metrics_endpoint, started, 500)
+
+
+@app.teardown_request
+def end_request_timings(exc):
+    # Worker threads are reused, so the next request must start its own recorder
+    current_recorder.set(None)
+
+
+@app.teardown_request
+def end_request_deadline(exc):
+    # Worker threads are reused, so the deadline must not outlive its request
+    token = g.pop("deadline_token", None)
+    if token is not None:
+        current_deadline.reset(token)
+
+
+def failure_status(error_info, default=500):
+    """
+    HTTP status for a failed request: 504 when it ran out of deadline.
+    """
+    return 504 if error_info.get("error_code") == TIMEOUT else default
+
 # Simplified configuration - no API keys needed
 
-def iana_to_windows_timezone(iana_timezone):
-    """
-    Convert IANA timezone name to Windows timezone ID
-    Returns Windows timezone ID or None if not found
-    """
-    # Comprehensive mapping of IANA timezone names to Windows timezone IDs
-    timezone_mapping = {
-        # Americas
-        "America/New_York": "Eastern Standard Time",
-        "America/Chicago": "Central Standard Time",
-        "America/Denver": "Mountain Standard Time",
-        "America/Phoenix": "US Mountain Standard Time",
-        "America/Los_Angeles": "Pacific Standard Time",
-        "America/Anchorage": "Alaskan Standard Time",
-        "America/Honolulu": "Hawaiian Standard Time",
-        "America/Toronto": "Eastern Standard Time",
-        "America/Vancouver": "Pacific Standard Time",
-        "America/Mexico_City": "Central Standard Time (Mexico)",
-        "America/Sao_Paulo": "E. South America Standard Time",
-        "America/Buenos_Aires": "Argentina Standard Time",
-        "America/Lima": "SA Pacific Standard Time",
-        "America/Bogota": "SA Pacific Standard Time",
-        "America/Santiago": "Pacific SA Standard Time",
-        "America/Caracas": "Venezuela Standard Time",
-        
-        # Europe
-        "Europe/London": "GMT Standard Time",
-        "Europe/Paris": "W. Europe Standard Time",
-        "Europe/Berlin": "W. Europe Standard Time",
-        "Europe/Rome": "W. Europe Standard Time",
-        "Europe/Madrid": "W. Europe Standard Time",
-        "Europe/Amsterdam": "W. Europe Standard Time",
-        "Europe/Brussels": "W. Europe Standard Time",
-        "Europe/Vienna": "W. Europe Standard Time",
-        "Europe/Prague": "Central Europe Standard Time",
-        "Europe/Warsaw": "Central European Standard Time",
-        "Europe/Budapest": "Central Europe Standard Time",
-        "Europe/Athens": "GTB Standard Time",
-        "Europe/Helsinki": "FLE Standard Time",
-        "Europe/Stockholm": "W. Europe Standard Time",
-        "Europe/Oslo": "W. Europe Standard Time",
-        "Europe/Copenhagen": "W. Europe Standard Time",
-        "Europe/Dublin": "GMT Standard Time",
-        "Europe/Lisbon": "GMT Standard Time",
-        "Europe/Moscow": "Russian Standard Time",
-        "Europe/Kiev": "FLE Standard Time",
-        "Europe/Istanbul": "Turkey Standard Time",
-        
-        # Asia
-        "Asia/Dubai": "Arabian Standard Time",
-        "Asia/Karachi": "Pakistan Standard Time",
-        "Asia/Kolkata": "India Standard Time",
-        "Asia/Dhaka": "Bangladesh Standard Time",
-        "Asia/Bangkok": "SE Asia Standard Time",
-        "Asia/Jakarta": "SE Asia Standard Time",
-        "Asia/Manila": "Singapore Standard Time",
-        "Asia/Hong_Kong": "China Standard Time",
-        "Asia/Shanghai": "China Standard Time",
-        "Asia/Tokyo": "Tokyo Standard Time",
-        "Asia/Seoul": "Korea Standard Time",
-        "Asia/Singapore": "Singapore Standard Time",
-        "Asia/Kuala_Lumpur": "Singapore Standard Time",
-        "Asia/Taipei": "Taipei Standard Time",
-        "Asia/Jerusalem": "Israel Standard Time",
-        "Asia/Riyadh": "Arab Standard Time",
-        "Asia/Tehran": "Iran Standard Time",
-        
-        # Australia/Oceania
-        "Australia/Sydney": "AUS Eastern Standard Time",
-        "Australia/Melbourne": "AUS Eastern Standard Time",
-        "Australia/Brisbane": "E. Australia Standard Time",
-        "Australia/Perth": "W. Australia Standard Time",
-        "Australia/Adelaide": "Cen. Australia Standard Time",
-        "Pacific/Auckland": "New Zealand Standard Time",
-        
-        # Africa
-        "Africa/Cairo": "Egypt Standard Time",
-        "Africa/Johannesburg": "South Africa Standard Time",
-        "Africa/Lagos": "W. Central Africa Standard Time",
-        "Africa/Nairobi": "E. Africa Standard Time",
-        
-        # UTC
-        "UTC": "UTC",
-        "Etc/UTC": "UTC",
-        "Etc/GMT": "UTC"
-    }
-    
-    return timezone_mapping.get(iana_timezone)
+# Run proxy + geo + timezone sync as one remote invocation instead of up to four
+FUSED_EXECUTION = os.environ.get("WINRM_FUSED_EXECUTION", "1") != "0"
+
+# "local": the host only fetches its public IP and org/country/timezone come from
+# the GeoIP database (see geoip.py); "ipinfo": the host queries ipinfo.io itself
+GEOIP_MODE = os.environ.get("GEOIP_MODE", "ipinfo")
+
+
+# How long one poll of a streamed pipeline waits for output (WS-Man OperationTimeout)
+INVOKE_POLL_SECONDS = 10
+EXTEND_RDP_TIMEOUT_SECONDS = float(os.environ.get("EXTEND_RDP_TIMEOUT_SECONDS", "900"))
+# Cap for the host's own web requests (-TimeoutSec), shortened to the request deadline
+REMOTE_WEB_TIMEOUT_SECONDS = int(os.environ.get("REMOTE_WEB_TIMEOUT_SECONDS", "15"))
+# Deadline left over after the host's web request, for the rest of its script and the reply
+REMOTE_WEB_HEADROOM_SECONDS = 2
 
 
-def country_to_timezone(country_code):
+def remote_web_timeout():
     """
-    Map country code to most common Windows timezone ID for that country
-    Returns Windows timezone ID or None if not found
+    -TimeoutSec for Invoke-WebRequest on the host: what the deadline leaves, minus headroom.
     """
-    # Country code to most common timezone mapping
-    country_timezone_mapping = {
-        "US": "Eastern Standard Time",  # Most populous timezone
-        "CA": "Eastern Standard Time",
-        "MX": "Central Standard Time (Mexico)",
-        "BR": "E. South America Standard Time",
-        "AR": "Argentina Standard Time",
-        "CL": "Pacific SA Standard Time",
-        "CO": "SA Pacific Standard Time",
-        "PE": "SA Pacific Standard Time",
-        "VE": "Venezuela Standard Time",
-        
-        "GB": "GMT Standard Time",
-        "IE": "GMT Standard Time",
-        "PT": "GMT Standard Time",
-        "FR": "W. Europe Standard Time",
-        "DE": "W. Europe Standard Time",
-        "IT": "W. Europe Standard Time",
-        "ES": "W. Europe Standard Time",
-        "NL": "W. Europe Standard Time",
-        "BE": "W. Europe Standard Time",
-        "AT": "W. Europe Standard Time",
-        "CH": "W. Europe Standard Time",
-        "SE": "W. Europe Standard Time",
-        "NO": "W. Europe Standard Time",
-        "DK": "W. Europe Standard Time",
-        "FI": "FLE Standard Time",
-        "PL": "Central European Standard Time",
-        "CZ": "Central Europe Standard Time",
-        "HU": "Central Europe Standard Time",
-        "GR": "GTB Standard Time",
-        "TR": "Turkey Standard Time",
-        "RU": "Russian Standard Time",
-        "UA": "FLE Standard Time",
-        
-        "IN": "India Standard Time",
-        "PK": "Pakistan Standard Time",
-        "BD": "Bangladesh Standard Time",
-        "TH": "SE Asia Standard Time",
-        "ID": "SE Asia Standard Time",
-        "PH": "Singapore Standard Time",
-        "SG": "Singapore Standard Time",
-        "MY": "Singapore Standard Time",
-        "CN": "China Standard Time",
-        "HK": "China Standard Time",
-        "TW": "Taipei Standard Time",
-        "JP": "Tokyo Standard Time",
-        "KR": "Korea Standard Time",
-        "VN": "SE Asia Standard Time",
-        "IL": "Israel Standard Time",
-        "SA": "Arab Standard Time",
-        "AE": "Arabian Standard Time",
-        "IR": "Iran Standard Time",
-        
-        "AU": "AUS Eastern Standard Time",
-        "NZ": "New Zealand Standard Time",
-        
-        "EG": "Egypt Standard Time",
-        "ZA": "South Africa Standard Time",
-        "NG": "W. Central Africa Standard Time",
-        "KE": "E. Africa Standard Time",
-    }
-    
-    return country_timezone_mapping.get(country_code.upper() if country_code else None)
-
-
-def get_timezone_utc_offset_minutes(iana_timezone):
-    """
-    Get UTC offset in minutes for a given IANA timezone
-    This is a simplified approximation - for production, use a proper timezone library
-    Returns offset in minutes (positive for ahead of UTC, negative for behind)
-    """
-    # Common UTC offsets for major timezones (approximate, not accounting for DST)
-    # This is a simplified mapping - in production, use pytz or similar
-    offset_mapping = {
-        "America/New_York": -300,  # UTC-5
-        "America/Chicago": -360,    # UTC-6
-        "America/Denver": -420,     # UTC-7
-        "America/Los_Angeles": -480, # UTC-8
-        "America/Anchorage": -540,  # UTC-9
-        "America/Honolulu": -600,   # UTC-10
-        "Europe/London": 0,         # UTC+0
-        "Europe/Paris": 60,         # UTC+1
-        "Europe/Berlin": 60,        # UTC+1
-        "Europe/Moscow": 180,       # UTC+3
-        "Asia/Dubai": 240,          # UTC+4
-        "Asia/Karachi": 300,        # UTC+5
-        "Asia/Kolkata": 330,        # UTC+5:30
-        "Asia/Dhaka": 360,          # UTC+6
-        "Asia/Bangkok": 420,        # UTC+7
-        "Asia/Hong_Kong": 480,      # UTC+8
-        "Asia/Tokyo": 540,          # UTC+9
-        "Asia/Seoul": 540,          # UTC+9
-        "Australia/Sydney": 600,    # UTC+10
-        "Pacific/Auckland": 720,    # UTC+12
+    budget = remaining_budget("remote_web")
+    if budget is None:
+        return REMOTE_WEB_TIMEOUT_SECONDS
+    return max(1, min(REMOTE_WEB_TIMEOUT_SECONDS, int(budget - REMOTE_WEB_HEADROOM_SECONDS)))
+
+
+def invoke(ps, step):
+    """
+    ps.invoke() timed as the "invoke_<step>" phase, bounded by the request deadline.
+    """
+    with timed_phase(f"invoke_{step}"):
+        return invoke_pipeline(ps, f"invoke_{step}")
+
+
+class RemoteScriptTimeout(Exception):
+    pass
+
+
+def describe_stream_record(stream, record):
+    """
+    NDJSON event for one record of a pipeline's host/progress/warning/error streams.
+    """
+    if stream == "progress":
+        return {"event": "progress", "activity": record.activity, "status": record.description,
+                "percent": record.percent_complete}
+    if stream == "information":
+        # Write-Host arrives as a HostInformationMessage whose string form is the text
+        return {"event": "output", "stream": "host", "text": str(record.message_data)}
+    if stream == "warning":
+        return {"event": "output", "stream": "warning", "text": record.message}
+    return {"event": "output", "stream": "error", "text": str(record)}
+
+
+def stream_invoke(ps, step, timeout):
+    """
+    ps.invoke() timed as the "invoke_<step>" phase, but yielding the host, progress,
+    warning and error records as the host produces them. Each poll waits up to
+    INVOKE_POLL_SECONDS for output; one that comes back empty yields a heartbeat.
+    The pipeline is stopped if it runs past timeout (RemoteScriptTimeout) or if
+    the caller closes the generator. The output is left on ps.output.
+    """
+    streams = ("information", "progress", "warning", "error")
+    seen = dict.fromkeys(streams, 0)
+    started = time.monotonic()
+
+    def drain():
+        events = []
+        for stream in streams:
+            records = getattr(ps.streams, stream)
+            events.extend(describe_stream_record(stream, record) for record in records[seen[stream]:])
+            seen[stream] = len(records)
+        return events
+
+    with timed_phase(f"invoke_{step}"):
+        ps.begin_invoke()
+        try:
+            while ps.state == PSInvocationState.RUNNING:
+                if time.monotonic() - started > timeout:
+                    raise RemoteScriptTimeout(f"Remote script still running after {timeout:g}s, stopped")
+                ps.poll_invoke(timeout=INVOKE_POLL_SECONDS)
+                events = drain()
+                if events:
+                    yield from events
+                elif ps.state == PSInvocationState.RUNNING:
+                    yield {"event": "heartbeat", "elapsed_ms": round((time.monotonic() - started) * 1000)}
+        except BaseException:
+            stop_pipeline(ps)
+            raise
+    yield from drain()
+
+
+def run_fused_script(pool, target_ip, proxy_ip_port, browser_timezone=None):
+    """
+    Set proxy, fetch ipinfo and resolve/compare/set/verify the timezone in one round trip.
+    Returns the same probe dict as run_stepwise_script, or None if ipinfo was unreachable.
+    """
+    ps = PowerShell(pool)
+    ps.add_cmdlet(FUSED)
+    ps.add_parameter("ProxyServer", proxy_ip_port)
+    ps.add_parameter("TargetIp", target_ip)
+    ps.add_parameter("BrowserTimezone", browser_timezone or "")
+    ps.add_parameter("WebTimeoutSec", remote_web_timeout())
+    output = invoke(ps, "fused")
+
+    if not output:
+        return None
+    data = json.loads(output[-1])
+    record_remote_spans("invoke_fused", data.get("timings"))
+    log_proxy_write(target_ip, proxy_ip_port, data)
+    if not data.get("ip"):
+        if data.get("ipinfo_error"):
+            logger.warning("ipinfo.io lookup failed on %s: %s", target_ip, data['ipinfo_error'])
+        return None
+
+    if data.get("sync_status"):
+        logger.info("Timezone sync on %s: %s", target_ip, data['sync_status'])
+    return build_probe(data["ip"], data.get("org"), data.get("country"), data.get("ipinfo_timezone"), data)
+
+
+def log_proxy_write(target_ip, proxy_ip_port, data):
+    if data.get("proxy_changed") is False:
+        logger.info("Proxy on %s already set to %s, registry left untouched", target_ip, proxy_ip_port)
+
+
+def build_probe(public_ip, org, country, ipinfo_timezone, sync=None):
+    """
+    Shape geo data plus a Sync-DashTimezone result into the probe dict.
+    """
+    sync = sync or {}
+    return {
+        "public_ip": public_ip.strip(),
+        "isp": (org or "").strip(),
+        "country": (country or "").strip(),
+        "ipinfo_timezone": ipinfo_timezone,
+        "timezone": {
+            "current": sync.get("current"),
+            "target": sync.get("target"),
+            "new": sync.get("new"),
+            "changed": bool(sync.get("changed")),
+            "sync_status": sync.get("sync_status", "Not attempted"),
+        },
     }
-    
-    return offset_mapping.get(iana_timezone, 0)
 
 
-def execute_powershell_script(target_ip, password, proxy_ip_port, browser_timezone=None, utc_offset=None):
+def run_local_geo_script(pool, target_ip, proxy_ip_port, browser_timezone=None, fallback=run_fused_script):
     """
-    Execute the PowerShell script to configure proxy, get public IP information, and sync timezone.
-    Timezone is primarily determined from ipinfo.io API response, with fallback to country-based
-    timezone or browser timezone if ipinfo timezone is unavailable.
+    Set proxy and fetch only the bare public IP through it, resolve org/country/timezone
+    from the local GeoIP database, then sync the timezone in a second call. IPs missing
+    from the database fall back to the ipinfo.io-based script.
     """
-    try:
-        logger.info(f"Connecting to {target_ip} with proxy {proxy_ip_port}")
-        if browser_timezone:
-            logger.info(f"Browser timezone: {browser_timezone}, UTC offset: {utc_offset}")
-        
-        # Connect to remote Windows machine
-        wsman = WSMan(
-            target_ip,
-            username="Administrator",
-            password=password,
-            ssl=False,
-            auth="basic",
-            encryption="never"
-        )
+    ps = PowerShell(pool)
+    ps.add_cmdlet(PUBLIC_IP)
+    ps.add_parameter("ProxyServer", proxy_ip_port)
+    ps.add_parameter("PublicIpUrl", PUBLIC_IP_URL)
+    ps.add_parameter("WebTimeoutSec", remote_web_timeout())
+    output = invoke(ps, "public_ip")
 
-        # Open a single runspace pool
-        pool = RunspacePool(wsman)
-        pool.open()
-        ps = PowerShell(pool)
-
-        # Step 1: Set proxy and get public IP, ISP, country, and timezone
-        ps.add_script(f'''
-# Set system-wide and current user proxy
-Set-ItemProperty -Path "HKLM:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings" ProxyEnable -Value 1
-Set-ItemProperty -Path "HKLM:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings" ProxyServer -Value "{proxy_ip_port}"
-Set-ItemProperty -Path "HKCU:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings" ProxyEnable -Value 1
-Set-ItemProperty -Path "HKCU:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings" ProxyServer -Value "{proxy_ip_port}"
-
-# Get public IP, ISP, country, and timezone
-$response = Invoke-WebRequest -Uri "https://ipinfo.io/json" -UseBasicParsing
-$data = $response.Content | ConvertFrom-Json
-$data.ip
-$data.org
-$data.country
-$data.timezone
-''')
-
-        output = ps.invoke()
-        
-        if not output or len(output) < 3:
-            pool.close()
-            return {
-                "status": "Connection Failed",
-                "target_ip": target_ip,
-                "proxy": proxy_ip_port,
-                "timestamp": datetime.now().isoformat()
-            }
+    if not output:
+        return None
+    data = json.loads(output[-1])
+    record_remote_spans("invoke_public_ip", data.get("timings"))
+    log_proxy_write(target_ip, proxy_ip_port, data)
+    public_ip = (data.get("ip") or "").strip()
+    if not public_ip:
+        if data.get("error"):
+            logger.warning("Public IP lookup failed on %s: %s", target_ip, data['error'])
+        return None
 
-        public_ip = output[0].strip()
-        isp = output[1].strip()
-        country = output[2].strip()
-        # Get timezone from ipinfo.io (4th output, may be None if not available)
-        ipinfo_timezone = output[3].strip() if len(output) >= 4 and output[3] else None
-        if ipinfo_timezone:
-            logger.info(f"ipinfo.io timezone: {ipinfo_timezone}")
-        else:
-            logger.info("ipinfo.io timezone not available")
+    if public_ip == target_ip:
+        return build_probe(public_ip, None, None, None)
 
-        # Initialize timezone variables
-        current_timezone = None
-        target_timezone = None
-        new_timezone = None
-        timezone_changed = False
-        timezone_sync_status = "Not attempted"
+    with timed_phase("geoip_lookup"):
+        geo = GEOIP_RESOLVER.lookup(public_ip)
+    if geo is None:
+        logger.info("No local GeoIP record for %s, falling back to ipinfo.io", public_ip)
+        return fallback(pool, target_ip, proxy_ip_port, browser_timezone)
 
-        # Step 2: Timezone synchronization (only if proxy is active)
-        if public_ip != target_ip:
-            try:
-                # Get current system timezone
-                ps2 = PowerShell(pool)
-                ps2.add_script('Get-TimeZone | Select-Object -ExpandProperty Id')
-                tz_output = ps2.invoke()
-                if tz_output:
-                    current_timezone = tz_output[0].strip()
-                    logger.info(f"Current system timezone: {current_timezone}")
-
-                # Determine target timezone - use ipinfo timezone as primary source
-                if ipinfo_timezone:
-                    # Convert IANA timezone from ipinfo to Windows timezone
-                    target_timezone = iana_to_windows_timezone(ipinfo_timezone)
-                    if target_timezone:
-                        timezone_sync_status = f"Using ipinfo timezone: {ipinfo_timezone}"
-                        logger.info(f"ipinfo timezone: {ipinfo_timezone} -> Windows timezone: {target_timezone}")
-                    else:
-                        # Fallback to country-based timezone if IANA conversion fails
-                        target_timezone = country_to_timezone(country)
-                        if target_timezone:
-                            timezone_sync_status = f"ipinfo timezone not mapped, using country default: {country}"
-                            logger.info(f"ipinfo timezone {ipinfo_timezone} not in mapping, using country {country} -> {target_timezone}")
-                        else:
-                            timezone_sync_status = f"Could not determine timezone from ipinfo ({ipinfo_timezone}) or country ({country})"
-                            logger.warning(f"Could not map timezone: ipinfo={ipinfo_timezone}, country={country}")
+    ps = PowerShell(pool)
+    ps.add_cmdlet(TIMEZONE_SYNC)
+    ps.add_parameter("IpinfoTimezone", geo["timezone"] or "")
+    ps.add_parameter("Country", geo["country"] or "")
+    ps.add_parameter("BrowserTimezone", browser_timezone or "")
+    output = invoke(ps, "timezone_sync")
+
+    sync = json.loads(output[-1]) if output else {"sync_status": "Timezone sync returned no output"}
+    record_remote_spans("invoke_timezone_sync", sync.get("timings"))
+    logger.info("Timezone sync on %s: %s", target_ip, sync.get('sync_status'))
+    return build_probe(public_ip, geo["org"], geo["country"], geo["timezone"], sync)
+
+
+def run_stepwise_script(pool, target_ip, proxy_ip_port, browser_timezone=None):
+    """
+    Set proxy and fetch ipinfo, then sync the timezone with separate Get/Set/verify calls.
+    Returns a probe dict, or None if the ipinfo lookup produced no output.
+    """
+    ps = PowerShell(pool)
+
+    # Step 1: Set proxy (values already in place are not rewritten) and get public IP, ISP, country, and timezone
+    ps.add_cmdlet(PROXY_IPINFO)
+    ps.add_parameter("ProxyServer", proxy_ip_port)
+    ps.add_parameter("WebTimeoutSec", remote_web_timeout())
+
+    output = invoke(ps, "proxy_ipinfo")
+
+    if not output or len(output) < 3:
+        return None
+
+    public_ip = output[0].strip()
+    isp = output[1].strip()
+    country = output[2].strip()
+    # Get timezone from ipinfo.io (4th output, may be None if not available)
+    ipinfo_timezone = output[3].strip() if len(output) >= 4 and output[3] else None
+    if ipinfo_timezone:
+        logger.info("ipinfo.io timezone: %s", ipinfo_timezone)
+    else:
+        logger.info("ipinfo.io timezone not available")
+
+    # Initialize timezone variables
+    current_timezone = None
+    target_timezone = None
+    new_timezone = None
+    timezone_changed = False
+    timezone_sync_status = "Not attempted"
+
+    # Step 2: Timezone synchronization (only if proxy is active)
+    if public_ip != target_ip:
+        try:
+            # Get current system timezone
+            ps2 = PowerShell(pool)
+            ps2.add_cmdlet(GET_TIMEZONE)
+            tz_output = invoke(ps2, "get_timezone")
+            if tz_output:
+                current_timezone = tz_output[0].strip()
+                logger.info("Current system timezone: %s", current_timezone)
+
+            # Determine target timezone - use ipinfo timezone as primary source
+            if ipinfo_timezone:
+                # Convert IANA timezone from ipinfo to Windows timezone
+                target_timezone = iana_to_windows_timezone(ipinfo_timezone)
+                if target_timezone:
+                    timezone_sync_status = f"Using ipinfo timezone: {ipinfo_timezone}"
+                    logger.info("ipinfo timezone: %s -> Windows timezone: %s", ipinfo_timezone, target_timezone)
                 else:
-                    # Fallback to country-based timezone if ipinfo doesn't provide timezone
+                    # Fallback to country-based timezone if IANA conversion fails
                     target_timezone = country_to_timezone(country)
                     if target_timezone:
-                        timezone_sync_status = f"ipinfo timezone not available, using country default: {country}"
-                        logger.info(f"ipinfo timezone not available, using country {country} -> {target_timezone}")
+                        timezone_sync_status = f"ipinfo timezone not mapped, using country default: {country}"
+                        logger.info("ipinfo timezone %s not in mapping, using country %s -> %s", ipinfo_timezone, country, target_timezone)
                     else:
-                        # Last resort: use browser timezone if provided
-                        if browser_timezone:
-                            target_timezone = iana_to_windows_timezone(browser_timezone)
-                            if target_timezone:
-                                timezone_sync_status = f"Using browser timezone as fallback: {browser_timezone}"
-                                logger.info(f"Using browser timezone fallback: {browser_timezone} -> {target_timezone}")
-                            else:
-                                timezone_sync_status = "Could not determine timezone from any source"
-                                logger.warning("Could not determine timezone from ipinfo, country, or browser")
-                        else:
-                            timezone_sync_status = "Could not determine timezone (ipinfo unavailable, no browser timezone)"
-                            logger.warning("Could not determine timezone: ipinfo unavailable and no browser timezone provided")
-                
-                # Set timezone if different from current
-                if target_timezone and current_timezone != target_timezone:
-                    logger.info(f"Changing timezone from {current_timezone} to {target_timezone}")
-                    ps3 = PowerShell(pool)
-                    ps3.add_script(f'Set-TimeZone -Id "{target_timezone}"')
-                    ps3.invoke()
-                    
-                    # Verify timezone was set
-                    ps4 = PowerShell(pool)
-                    ps4.add_script('Get-TimeZone | Select-Object -ExpandProperty Id')
-                    verify_output = ps4.invoke()
-                    if verify_output:
-                        new_timezone = verify_output[0].strip()
-                        timezone_changed = (new_timezone == target_timezone)
-                        if timezone_changed:
-                            timezone_sync_status = "Timezone changed successfully"
-                        else:
-                            timezone_sync_status = f"Timezone change attempted (current: {new_timezone})"
+                        timezone_sync_status = f"Could not determine timezone from ipinfo ({ipinfo_timezone}) or country ({country})"
+                        logger.warning("Could not map timezone: ipinfo=%s, country=%s", ipinfo_timezone, country)
+            else:
+                # Fallback to country-based timezone if ipinfo doesn't provide timezone
+                target_timezone = country_to_timezone(country)
+                if target_timezone:
+                    timezone_sync_status = f"ipinfo timezone not available, using country default: {country}"
+                    logger.info("ipinfo timezone not available, using country %s -> %s", country, target_timezone)
                 else:
-                    new_timezone = current_timezone
-                    if current_timezone == target_timezone:
-                        timezone_sync_status = "Timezone already correct"
+                    # Last resort: use browser timezone if provided
+                    if browser_timezone:
+                        target_timezone = iana_to_windows_timezone(browser_timezone)
+                        if target_timezone:
+                            timezone_sync_status = f"Using browser timezone as fallback: {browser_timezone}"
+                            logger.info("Using browser timezone fallback: %s -> %s", browser_timezone, target_timezone)
+                        else:
+                            timezone_sync_status = "Could not determine timezone from any source"
+                            logger.warning("Could not determine timezone from ipinfo, country, or browser")
                     else:
-                        timezone_sync_status = "Timezone change skipped (no target timezone)"
-                        
-            except Exception as tz_error:
-                logger.warning(f"Timezone synchronization error: {str(tz_error)}")
-                timezone_sync_status = f"Timezone sync error: {str(tz_error)}"
+                        timezone_sync_status = "Could not determine timezone (ipinfo unavailable, no browser timezone)"
+                        logger.warning("Could not determine timezone: ipinfo unavailable and no browser timezone provided")
+        
+            # Set timezone if different from current
+            if target_timezone and current_timezone != target_timezone:
+                logger.info("Changing timezone from %s to %s", current_timezone, target_timezone)
+                ps3 = PowerShell(pool)
+                ps3.add_cmdlet("Set-TimeZone")
+                ps3.add_parameter("Id", target_timezone)
+                invoke(ps3, "set_timezone")
+            
+                # Verify timezone was set
+                ps4 = PowerShell(pool)
+                ps4.add_cmdlet(GET_TIMEZONE)
+                verify_output = invoke(ps4, "verify_timezone")
+                if verify_output:
+                    new_timezone = verify_output[0].strip()
+                    timezone_changed = (new_timezone == target_timezone)
+                    if timezone_changed:
+                        timezone_sync_status = "Timezone changed successfully"
+                    else:
+                        timezone_sync_status = f"Timezone change attempted (current: {new_timezone})"
+            else:
+                new_timezone = current_timezone
+                if current_timezone == target_timezone:
+                    timezone_sync_status = "Timezone already correct"
+                else:
+                    timezone_sync_status = "Timezone change skipped (no target timezone)"
+                
+        except Exception as tz_error:
+            logger.warning("Timezone synchronization error: %s", tz_error)
+            timezone_sync_status = f"Timezone sync error: {str(tz_error)}"
+
+    return {
+        "public_ip": public_ip,
+        "isp": isp,
+        "country": country,
+        "ipinfo_timezone": ipinfo_timezone,
+        "timezone": {
+            "current": current_timezone,
+            "target": target_timezone,
+            "new": new_timezone,
+            "changed": timezone_changed,
+            "sync_status": timezone_sync_status,
+        },
+    }
 
-        pool.close()
+
+def execute_powershell_script(target_ip, password, proxy_ip_port, browser_timezone=None, utc_offset=None,
+                              fused=FUSED_EXECUTION, on_phase=None, pool=None, geo_mode=GEOIP_MODE):
+    """
+    Execute the PowerShell script to configure proxy, get public IP information, and sync timezone.
+    Timezone is primarily determined from ipinfo.io API response, with fallback to country-based
+    timezone or browser timezone if ipinfo timezone is unavailable.
+    on_phase, if given, is called with the name of each phase as it starts.
+    pool, if given, is an already-open RunspacePool to run on instead of leasing one.
+    geo_mode "local" resolves geo data from the GeoIP database instead of ipinfo.io.
+    Without a pool, the session waits for an admission slot (AdmissionRejected when none frees up).
+    """
+    report_phase = on_phase or (lambda phase: None)
+    guarded = pool is None
+    try:
+        # Fail fast on a dead proxy, or if this host recently proved unreachable
+        # (callers passing an open pool have already been through both)
+        if guarded:
+            if PROXY_PROBE_ENABLED:
+                report_phase("checking_proxy")
+                PROXY_PROBER.guard(proxy_ip_port)
+            CIRCUIT_BREAKER.guard(target_ip)
+
+        logger.info("Connecting to %s with proxy %s", target_ip, proxy_ip_port)
+        if browser_timezone:
+            logger.info("Browser timezone: %s, UTC offset: %s", browser_timezone, utc_offset)
+
+        # Reuse a cached runspace pool (opened by preflight) or open a new one
+        report_phase("connecting")
+        admission = nullcontext() if pool is not None else ADMISSION.admit(target_ip)
+        lease = nullcontext(pool) if pool is not None else POOL_CACHE.lease_target(target_ip, password)
+        with admission, lease as pool:
+            report_phase("configuring")
+            run_script = run_fused_script if fused else run_stepwise_script
+            if geo_mode == "local" and GEOIP_RESOLVER.available:
+                probe = run_local_geo_script(pool, target_ip, proxy_ip_port, browser_timezone, fallback=run_script)
+            else:
+                probe = run_script(pool, target_ip, proxy_ip_port, browser_timezone)
+
+        CIRCUIT_BREAKER.record(target_ip, None)
 
         # Build result
-        if public_ip == target_ip:
+        public_ip = probe["public_ip"] if probe is not None else None
+        if probe is None:
+            result = {
+                "status": "Connection Failed",
+                "target_ip": target_ip,
+                "proxy": proxy_ip_port,
+                "timestamp": datetime.now().isoformat()
+            }
+        elif public_ip == target_ip:
             result = {
                 "status": "Proxy inactive",
                 "target_ip": target_ip,
@@ -374,31 +537,304 @@ $data.timezone
                 "timestamp": datetime.now().isoformat()
             }
         else:
+            if DRIFT_ENABLED:
+                DRIFT_SCHEDULER.track(target_ip, password, proxy_ip_port, public_ip, probe["timezone"].get("new"))
             result = {
                 "status": "Proxy Active",
                 "public_ip": public_ip,
-                "isp": isp,
-                "country": country,
+                "isp": probe["isp"],
+                "country": probe["country"],
                 "target_ip": target_ip,
                 "proxy": proxy_ip_port,
                 "timestamp": datetime.now().isoformat(),
                 "timezone": {
-                    "current": current_timezone,
-                    "target": target_timezone,
-                    "new": new_timezone,
-                    "changed": timezone_changed,
-                    "sync_status": timezone_sync_status,
-                    "ipinfo_timezone": ipinfo_timezone,
+                    **probe["timezone"],
+                    "ipinfo_timezone": probe["ipinfo_timezone"],
                     "browser_timezone": browser_timezone
                 }
             }
 
+        store_result(RESULT_EXECUTE, target_ip, result["status"], result)
         return result
 
+    except CircuitOpenError:
+        raise
+    except AdmissionRejected:
+        if guarded:
+            # Never reached the host: free the half-open probe guard() may have claimed
+            CIRCUIT_BREAKER.release(target_ip)
+        raise
+    except ProxyUnreachable as e:
+        # Says nothing about the host, so the circuit is left as it is
+        logger.warning("Not configuring %s: %s", target_ip, e.detail)
+        error_info = classify_connection_error(e, target_ip)
+        store_result(RESULT_EXECUTE, target_ip, "error", {"proxy": proxy_ip_port, **error_info},
+                     error_info["error_code"])
+        raise
     except Exception as e:
-        logger.error(f"Error executing PowerShell script: {str(e)}")
+        logger.error("Error executing PowerShell script: %s", e)
+        error_info = classify_connection_error(e, target_ip)
+        CIRCUIT_BREAKER.record(target_ip, error_info)
+        store_result(RESULT_EXECUTE, target_ip, "error", {"proxy": proxy_ip_port, **error_info},
+                     error_info["error_code"])
         raise
 
+
+def store_result(kind, target_ip, status, payload, error_code=None):
+    """
+    Persist an outcome to the result store (queued; written off the request thread).
+    """
+    if RESULT_STORE_ENABLED:
+        RESULT_STORE.record(kind, target_ip, status, payload, error_code)
+
+
+def store_preflight(target_ip, result):
+    store_result(RESULT_PREFLIGHT, target_ip, "passed" if result.get("success") else "failed", result,
+                 result.get("error_code"))
+
+
+def verify_proxy_state(target_ip, password, proxy, expected_public_ip=None, expected_timezone=None):
+    """
+    Read the proxy registry values, public IP and timezone of a server in one read-only
+    round trip and compare them with the desired state. Returns {"drift": [...], "observed": {...}}.
+    """
+    try:
+        CIRCUIT_BREAKER.guard(target_ip)
+        with ADMISSION.admit(target_ip, mutate=False), \
+                POOL_CACHE.lease_target(target_ip, password) as pool:
+            ps = PowerShell(pool)
+            ps.add_cmdlet(VERIFY)
+            ps.add_parameter("PublicIpUrl", PUBLIC_IP_URL)
+            ps.add_parameter("WebTimeoutSec", remote_web_timeout())
+            output = invoke(ps, "verify")
+    except CircuitOpenError:
+        raise
+    except AdmissionRejected:
+        CIRCUIT_BREAKER.release(target_ip)
+        raise
+    except Exception as e:
+        error_info = classify_connection_error(e, target_ip)
+        CIRCUIT_BREAKER.record(target_ip, error_info)
+        store_result(RESULT_VERIFY, target_ip, "error", {"proxy": proxy, **error_info},
+                     error_info["error_code"])
+        raise
+    CIRCUIT_BREAKER.record(target_ip, None)
+
+    observed = json.loads(output[-1])
+    record_remote_spans("invoke_verify", observed.pop("timings", None))
+    drift = find_drift(target_ip, proxy, expected_public_ip, expected_timezone, observed)
+    if drift:
+        logger.warning("Drift on %s: %s", target_ip, ", ".join(item["check"] for item in drift))
+    outcome = {"drift": drift, "observed": observed}
+    store_result(RESULT_VERIFY, target_ip, DRIFT_DRIFTED if drift else DRIFT_OK, {"proxy": proxy, **outcome})
+    return outcome
+
+
+def verify_drift(server):
+    """
+    Drift check for DRIFT_SCHEDULER: verify a configured server against what it was set to.
+    """
+    return verify_proxy_state(server.target, server.password, server.proxy, server.expected_public_ip,
+                              server.expected_timezone)
+
+
+def find_drift(target_ip, proxy, expected_public_ip, expected_timezone, observed):
+    drift = []
+    for entry in observed.get("registry") or []:
+        actual = {"proxy_enable": entry.get("proxy_enable"), "proxy_server": entry.get("proxy_server")}
+        if actual != {"proxy_enable": 1, "proxy_server": proxy}:
+            drift.append({
+                "check": "proxy_registry",
+                "path": entry.get("path"),
+                "expected": {"proxy_enable": 1, "proxy_server": proxy},
+                "actual": actual,
+            })
+
+    public_ip = observed.get("public_ip")
+    if not public_ip:
+        detail = observed.get("public_ip_error") or "No public IP returned"
+        drift.append({"check": "public_ip", "expected": expected_public_ip, "actual": None,
+                      "detail": f"Public IP lookup through the proxy failed: {detail}"})
+    elif public_ip == target_ip:
+        drift.append({"check": "public_ip", "expected": expected_public_ip, "actual": public_ip,
+                      "detail": "Traffic exits via the server IP (proxy not in use)"})
+    elif expected_public_ip and public_ip != expected_public_ip:
+        drift.append({"check": "public_ip", "expected": expected_public_ip, "actual": public_ip,
+                      "detail": "Proxy exit IP changed"})
+
+    if expected_timezone and observed.get("timezone") != expected_timezone:
+        drift.append({"check": "timezone", "expected": expected_timezone, "actual": observed.get("timezone")})
+    return drift
+
+
+DRIFT_SCHEDULER.verify = verify_drift
+
+
+# Most proxyIpPort candidates accepted in one execute
+PROXY_CANDIDATES_MAX = int(os.environ.get("PROXY_CANDIDATES_MAX", "10"))
+# Results that blame the proxy rather than the host: the next candidate is tried
+PROXY_FALLBACK_STATUSES = ("Proxy inactive", "Connection Failed")
+
+
+def flight_key(kind, target_ip, password, *extra):
+    return (kind, target_ip, credential_fingerprint(WINRM_USERNAME, password), *extra)
+
+
+def execute_coalesced(target_ip, password, proxy_ip_port, browser_timezone=None, utc_offset=None, on_phase=None):
+    """
+    execute_powershell_script shared between identical concurrent requests (same target,
+    proxy and credentials), so a double-click runs the remote script once. Results other
+    than "Connection Failed" are replayed for SINGLEFLIGHT_REPLAY_SECONDS.
+    """
+    key = flight_key("execute", target_ip, password, proxy_ip_port, browser_timezone)
+    result, outcome = SINGLE_FLIGHT.do(
+        key,
+        lambda: execute_powershell_script(target_ip, password, proxy_ip_port, browser_timezone, utc_offset,
+                                          on_phase=on_phase),
+        replayable=lambda result: result["status"] != "Connection Failed",
+    )
+    if outcome != LEADER:
+        logger.info("Execute for %s via %s: %s result of an identical request", target_ip, proxy_ip_port, outcome)
+    return result
+
+
+def verify_coalesced(target_ip, password, proxy, expected_public_ip=None, expected_timezone=None):
+    """
+    verify_proxy_state shared between identical concurrent requests, so several tabs
+    polling one server cost one round trip per SINGLEFLIGHT_REPLAY_SECONDS.
+    """
+    result, outcome = SINGLE_FLIGHT.do(
+        flight_key("verify", target_ip, password, proxy, expected_public_ip, expected_timezone),
+        lambda: verify_proxy_state(target_ip, password, proxy, expected_public_ip, expected_timezone),
+    )
+    if outcome != LEADER:
+        logger.info("Verify for %s: %s result of an identical request", target_ip, outcome)
+    return result
+
+
+def proxy_candidates(value):
+    """
+    proxyIpPort as sent by the client: a string, or a list of candidates (deduplicated;
+    a single candidate is returned as a string). None if the value is unusable.
+    """
+    if isinstance(value, str):
+        return value or None
+    if not isinstance(value, list):
+        return None
+    candidates = list(dict.fromkeys(proxy for proxy in value if isinstance(proxy, str) and proxy))
+    if not candidates or len(candidates) > PROXY_CANDIDATES_MAX:
+        return None
+    return candidates if len(candidates) > 1 else candidates[0]
+
+
+def rank_candidates(candidates, on_phase=None):
+    report_phase = on_phase or (lambda phase: None)
+    report_phase("ranking_proxies")
+    with timed_phase("proxy_ranking"):
+        return PROXY_PROBER.rank(candidates)
+
+
+def execute_ranked(target_ip, password, candidates, browser_timezone=None, utc_offset=None, on_phase=None,
+                   ranking=None, pool=None):
+    """
+    Probe candidate proxies in parallel and apply the fastest healthy one. A result that
+    blames the proxy (see PROXY_FALLBACK_STATUSES) moves on to the next candidate. The
+    ranking and every attempt are returned under "proxy_selection".
+    ranking, if given, is a rank_candidates result already taken for candidates; pool,
+    if given, is an open RunspacePool every attempt runs on (see execute_powershell_script).
+    """
+    if ranking is None:
+        ranking = rank_candidates(candidates, on_phase)
+    selection = {"ranking": ranking, "attempts": [], "selected": None}
+
+    result = None
+    for row in ranking:
+        if not row["ok"]:
+            break
+        try:
+            if pool is None:
+                result = execute_coalesced(target_ip, password, row["proxy"], browser_timezone, utc_offset, on_phase)
+            else:
+                result = execute_powershell_script(target_ip, password, row["proxy"], browser_timezone, utc_offset,
+                                                   on_phase=on_phase, pool=pool)
+        except ProxyUnreachable as e:
+            # Cached probe expired between ranking and the execute's own check
+            selection["attempts"].append({"proxy": row["proxy"], "status": "error", "error_code": e.error_code})
+            continue
+        selection["attempts"].append({"proxy": row["proxy"], "status": result["status"]})
+        if result["status"] not in PROXY_FALLBACK_STATUSES:
+            selection["selected"] = row["proxy"]
+            break
+        logger.info("Proxy %s on %s: %s, trying the next candidate", row["proxy"], target_ip, result["status"])
+
+    if result is None:
+        raise ProxyUnreachable(", ".join(candidates), no_usable_candidate(candidates, ranking))
+    return {**result, "proxy_selection": selection}
+
+
+def no_usable_candidate(candidates, ranking):
+    unreachable = "; ".join(f"{row['proxy']}: {row['message']}" for row in ranking if not row["ok"])
+    return f"None of the {len(candidates)} candidate proxies is usable ({unreachable})"
+
+
+def execute_requested(target_ip, password, proxy_ip_port, browser_timezone=None, utc_offset=None, on_phase=None):
+    """
+    execute_coalesced for one proxy, execute_ranked for a list of candidates.
+    """
+    if isinstance(proxy_ip_port, list):
+        return execute_ranked(target_ip, password, proxy_ip_port, browser_timezone, utc_offset, on_phase)
+    return execute_coalesced(target_ip, password, proxy_ip_port, browser_timezone, utc_offset, on_phase)
+
+
+def selection_fields(result):
+    selection = result.get("proxy_selection")
+    return {"proxySelection": selection} if selection else {}
+
+
+def run_stored_preflight(target_ip, password):
+    """
+    run_preflight_check, with the outcome persisted unless the circuit answered for the host.
+    """
+    result = run_preflight_check(target_ip, password)
+    if not result.get("circuit_open"):
+        store_preflight(target_ip, result)
+    return result
+
+
+def preflight_coalesced(target_ip, password):
+    """
+    run_preflight_check shared between identical concurrent requests; successful
+    results are replayed for SINGLEFLIGHT_REPLAY_SECONDS.
+    """
+    result, outcome = SINGLE_FLIGHT.do(
+        flight_key("preflight", target_ip, password),
+        lambda: run_stored_preflight(target_ip, password),
+        replayable=lambda result: result.get("success"),
+    )
+    if outcome != LEADER:
+        logger.info("Preflight for %s: %s result of an identical request", target_ip, outcome)
+    return result
+
+
+def circuit_open_response(payload):
+    """
+    503 for a target whose circuit is open, with the cached error and a Retry-After hint.
+    """
+    response = jsonify(payload)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(payload["retry_after"])
+    return response
+
+
+def server_busy_response(payload):
+    """
+    429 when admission control turned the request away, with a Retry-After hint.
+    """
+    response = jsonify(payload)
+    response.status_code = 429
+    response.headers['Retry-After'] = str(payload["retry_after"])
+    return response
+
 @app.route('/api/preflight-check', methods=['POST'])
 def preflight_check():
     """
@@ -421,19 +857,103 @@ def preflight_check():
                 **build_error_response("UNKNOWN_ERROR", "Missing required fields: serverIp, password"),
             }), 400
 
-        logger.info(f"Preflight check for {target_ip}")
-        result = run_preflight_check(target_ip, password)
-        status_code = 200 if result.get("success") else 422
+        logger.info("Preflight check for %s", target_ip)
+        result = preflight_coalesced(target_ip, password)
+        if result.get("circuit_open"):
+            return circuit_open_response(result)
+        status_code = 200 if result.get("success") else failure_status(result, 422)
         return jsonify(result), status_code
 
+    except AdmissionRejected as e:
+        logger.warning("Preflight for %s not admitted: %s, retry after %ss", target_ip, e.error_code, e.retry_after)
+        return server_busy_response({"success": False, "checks": [], **classify_connection_error(e, target_ip)})
     except Exception as e:
-        logger.error(f"Preflight error: {str(e)}")
+        logger.error("Preflight error: %s", e)
         payload = request.get_json(silent=True) or {}
         error_info = classify_connection_error(e, payload.get('serverIp'))
         return jsonify({
             "success": False,
             **error_info,
-        }), 500
+        }), failure_status(error_info)
+
+SCAN_MAX_HOSTS = int(os.environ.get("SCAN_MAX_HOSTS", "1000"))
+
+
+@app.route('/api/preflight-scan', methods=['POST'])
+def preflight_scan():
+    """
+    Fleet reachability sweep: probe both WinRM ports on many hosts concurrently.
+    Accepts {"servers": ["1.2.3.4", ...]} (or objects with serverIp) and an optional "timeout".
+    """
+    data = request.get_json(silent=True)
+    servers = data.get('servers') if isinstance(data, dict) else data
+
+    if not isinstance(servers, list) or not servers:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Expected a non-empty 'servers' list"),
+        }), 400
+
+    hosts = [item.get('serverIp') if isinstance(item, dict) else item for item in servers]
+    hosts = list(dict.fromkeys(host for host in hosts if isinstance(host, str) and host))
+    if not hosts or len(hosts) > SCAN_MAX_HOSTS:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", f"Provide between 1 and {SCAN_MAX_HOSTS} server IPs"),
+        }), 400
+
+    try:
+        timeout = min(float(data.get('timeout', TCP_TIMEOUT_SECONDS)), TCP_TIMEOUT_SECONDS)
+    except (AttributeError, TypeError, ValueError):
+        timeout = TCP_TIMEOUT_SECONDS
+
+    logger.info("Preflight scan of %s hosts", len(hosts))
+    rows = scan_winrm_ports(hosts, concurrency=SCAN_CONCURRENCY, timeout=timeout)
+    reachable = sum(1 for row in rows if row["reachable"])
+    return jsonify({
+        "success": True,
+        "total": len(rows),
+        "reachable": reachable,
+        "unreachable": len(rows) - reachable,
+        "hosts": rows,
+    })
+
+@app.route('/api/proxy-probe', methods=['POST'])
+def proxy_probe():
+    """
+    Reachability and latency of many proxies, probed concurrently from the API server
+    (TCP connect, then a CONNECT handshake). Accepts {"proxies": ["1.2.3.4:8080", ...]}
+    (or objects with proxyIpPort); cached results are reused unless "refresh" is set.
+    """
+    data = request.get_json(silent=True)
+    proxies = data.get('proxies') if isinstance(data, dict) else data
+
+    if not isinstance(proxies, list) or not proxies:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Expected a non-empty 'proxies' list"),
+        }), 400
+
+    proxies = [item.get('proxyIpPort') if isinstance(item, dict) else item for item in proxies]
+    proxies = list(dict.fromkeys(proxy for proxy in proxies if isinstance(proxy, str) and proxy))
+    if not proxies or len(proxies) > SCAN_MAX_HOSTS:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", f"Provide between 1 and {SCAN_MAX_HOSTS} proxies"),
+        }), 400
+
+    refresh = is_truthy(data.get('refresh')) if isinstance(data, dict) else False
+    logger.info("Proxy probe of %s proxies", len(proxies))
+    rows = PROXY_PROBER.scan(proxies, concurrency=PROXY_SCAN_CONCURRENCY, refresh=refresh)
+    reachable = sum(1 for row in rows if row["ok"])
+    return jsonify({
+        "success": True,
+        "total": len(rows),
+        "reachable": reachable,
+        "unreachable": len(rows) - reachable,
+        "proxies": rows,
+    })
+
 
 @app.route('/api/execute-script', methods=['POST'])
 def execute_script():
@@ -442,12 +962,6 @@ def execute_script():
     Simplified version without API validation for initial setup
     """
     try:
-        # Debug logging to track requests
-        logger.info("=== NEW REQUEST RECEIVED ===")
-        logger.info(f"Request method: {request.method}")
-        logger.info(f"Request headers: {dict(request.headers)}")
-        logger.info("=== NO API VALIDATION - DIRECT PROCESSING ===")
-
         # Get JSON data from request
         data = request.get_json()
         
@@ -460,7 +974,8 @@ def execute_script():
         # Extract required fields
         target_ip = data.get('serverIp')
         password = data.get('password')
-        proxy_ip_port = data.get('proxyIpPort')
+        # One "ip:port", or a list of candidates to rank by latency
+        proxy_ip_port = proxy_candidates(data.get('proxyIpPort'))
         
         # Extract optional timezone fields
         browser_timezone = data.get('browserTimezone')
@@ -471,36 +986,710 @@ def execute_script():
             return jsonify({
                 "success": False,
                 "error": "Missing required fields: serverIp, password, proxyIpPort"
+                         f" (a string or up to {PROXY_CANDIDATES_MAX} candidates)"
             }), 400
 
-        logger.info(f"Received request for target_ip: {target_ip}, proxy: {proxy_ip_port}")
+        logger.info("Received request for target_ip: %s, proxy: %s", target_ip, proxy_ip_port)
         if browser_timezone:
-            logger.info(f"Browser timezone: {browser_timezone}, UTC offset: {utc_offset}")
+            logger.info("Browser timezone: %s, UTC offset: %s", browser_timezone, utc_offset)
+
+        if is_truthy(data.get('async', request.args.get('async'))):
+            return submit_execute_job(target_ip, password, proxy_ip_port, browser_timezone, utc_offset,
+                                      include_timings=wants_timings(data),
+                                      deadline=requested_deadline(data.get('deadline')))
 
-        # Execute the PowerShell script with timezone parameters
-        result = execute_powershell_script(target_ip, password, proxy_ip_port, browser_timezone, utc_offset)
+        # Execute the PowerShell script with timezone parameters (identical in-flight requests share one run)
+        result = execute_requested(target_ip, password, proxy_ip_port, browser_timezone, utc_offset)
 
         # Format the result for the Chrome extension
         formatted_result = format_result_for_extension(result)
 
         return jsonify({
             "success": True,
-            "result": formatted_result
+            "result": formatted_result,
+            **selection_fields(result),
         })
 
+    except CircuitOpenError as e:
+        logger.info("Circuit open for %s: %s, retry after %ss", target_ip, e.error_info.get('error_code'), e.retry_after)
+        return circuit_open_response({"success": False, **e.error_info})
+    except AdmissionRejected as e:
+        logger.warning("Execute for %s not admitted: %s, retry after %ss", target_ip, e.error_code, e.retry_after)
+        return server_busy_response({"success": False, **classify_connection_error(e, target_ip)})
+    except ProxyUnreachable as e:
+        return jsonify({"success": False, **classify_connection_error(e, target_ip)}), 422
     except Exception as e:
-        logger.error(f"API error: {str(e)}")
+        logger.error("API error: %s", e)
         payload = request.get_json(silent=True) or {}
         error_info = classify_connection_error(e, payload.get('serverIp'))
         return jsonify({
             "success": False,
             **error_info,
-        }), 500
+        }), failure_status(error_info)
+
+JOB_SSE_KEEPALIVE_SECONDS = 15
+
+
+def is_truthy(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def submit_execute_job(target_ip, password, proxy_ip_port, browser_timezone=None, utc_offset=None,
+                       include_timings=False, deadline=None):
+    """
+    Queue execute_powershell_script on the job executor and return 202 with the job id.
+    The HTTP worker is released immediately; progress is read from /api/jobs/<id>.
+    The job's deadline (seconds) starts when it starts running.
+    """
+    deadline = requested_deadline(deadline)
+
+    def run_job(report_phase):
+        with recording() as recorder, deadline_scope(deadline):
+            try:
+                result = execute_requested(target_ip, password, proxy_ip_port, browser_timezone, utc_offset,
+                                           on_phase=report_phase)
+                response = {
+                    "success": True,
+                    "result": format_result_for_extension(result),
+                    **selection_fields(result),
+                }
+            except Exception as e:
+                logger.error("Job error for %s: %s", target_ip, e)
+                response = {
+                    "success": False,
+                    **classify_connection_error(e, target_ip),
+                }
+        timings = recorder.to_dict()
+        logger.info("Timings for job on %s", target_ip, extra={"timings": timings})
+        if include_timings:
+            response["timings"] = timings
+        return response
+
+    try:
+        job = JOB_STORE.submit("execute-script", run_job, target=target_ip)
+    except JobStoreFull as e:
+        logger.warning("Rejecting async job for %s: %s", target_ip, e)
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Too many jobs in progress, retry shortly"),
+        }), 503
+
+    return jsonify({
+        "success": True,
+        "jobId": job.id,
+        "status": job.status,
+        "statusUrl": f"/api/jobs/{job.id}",
+        "eventsUrl": f"/api/jobs/{job.id}/events",
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll an async job. The final execute-script payload is under "response" once finished.
+    """
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found or expired"
+        }), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+
+@app.route('/api/drift', methods=['GET'])
+def list_drift():
+    """
+    Drift state of every server configured through this worker. ?status=drifted|error|ok|pending filters.
+    """
+    status = request.args.get('status')
+    return jsonify({
+        "success": True,
+        "summary": DRIFT_SCHEDULER.summary(),
+        "servers": DRIFT_SCHEDULER.snapshot(status),
+    })
+
+
+@app.route('/api/drift/<server_ip>', methods=['GET'])
+def get_drift(server_ip):
+    server = DRIFT_SCHEDULER.get(server_ip)
+    if server is None:
+        return jsonify({
+            "success": False,
+            "error": "Server is not tracked for drift"
+        }), 404
+    return jsonify({"success": True, **server})
+
+
+@app.route('/api/drift/<server_ip>/check', methods=['POST'])
+def check_drift(server_ip):
+    """
+    Re-verify a tracked server now instead of at its next scheduled check.
+    """
+    if not DRIFT_SCHEDULER.check_now(server_ip):
+        return jsonify({
+            "success": False,
+            "error": "Server is not tracked for drift"
+        }), 404
+    return jsonify({"success": True, "statusUrl": f"/api/drift/{server_ip}"}), 202
+
+
+@app.route('/api/verify', methods=['POST'])
+def verify():
+    """
+    Read-only check of a server's proxy registry values, public IP and timezone against
+    a desired state, in one WinRM round trip. Nothing on the server is changed.
+    proxyIpPort, expectedPublicIp and expectedTimezone (Windows zone id) default to
+    what the server was last configured to when it is tracked for drift.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({
+            "success": False,
+            "error": "No JSON data provided"
+        }), 400
+
+    target_ip = data.get('serverIp')
+    password = data.get('password')
+    proxy_ip_port = data.get('proxyIpPort')
+    tracked = DRIFT_SCHEDULER.get(target_ip) if target_ip else None
+    if tracked is not None and proxy_ip_port in (None, tracked["proxy"]):
+        proxy_ip_port = tracked["proxy"]
+        expected = tracked["expected"]
+    else:
+        expected = {}
+    expected_public_ip = data.get('expectedPublicIp', expected.get("public_ip"))
+    expected_timezone = data.get('expectedTimezone', expected.get("timezone"))
+
+    if not all([target_ip, password, proxy_ip_port]):
+        return jsonify({
+            "success": False,
+            "error": "Missing required fields: serverIp, password, proxyIpPort"
+        }), 400
+
+    try:
+        outcome = verify_coalesced(target_ip, password, proxy_ip_port, expected_public_ip, expected_timezone)
+    except CircuitOpenError as e:
+        logger.info("Circuit open for %s: %s, retry after %ss", target_ip, e.error_info.get('error_code'), e.retry_after)
+        return circuit_open_response({"success": False, **e.error_info})
+    except AdmissionRejected as e:
+        logger.warning("Verify for %s not admitted: %s, retry after %ss", target_ip, e.error_code, e.retry_after)
+        return server_busy_response({"success": False, **classify_connection_error(e, target_ip)})
+    except Exception as e:
+        logger.error("Verify error for %s: %s", target_ip, e)
+        error_info = classify_connection_error(e, target_ip)
+        return jsonify({
+            "success": False,
+            **error_info,
+        }), failure_status(error_info)
+
+    return jsonify({
+        "success": True,
+        "serverIp": target_ip,
+        "status": DRIFT_DRIFTED if outcome["drift"] else DRIFT_OK,
+        "expected": {
+            "proxy": proxy_ip_port,
+            "public_ip": expected_public_ip,
+            "timezone": expected_timezone,
+        },
+        **outcome,
+    })
+
+
+@app.route('/api/servers/<server_ip>/status', methods=['GET'])
+def server_status(server_ip):
+    """
+    Last known state of a server from the result store: the latest execute result
+    (proxy status), preflight and drift verification, without opening a WinRM session.
+    """
+    latest = RESULT_STORE.latest(server_ip)
+    if not any(latest.values()):
+        return jsonify({
+            "success": False,
+            "error": "No results recorded for this server"
+        }), 404
+    execute = latest[RESULT_EXECUTE]
+    return jsonify({
+        "success": True,
+        "serverIp": server_ip,
+        "proxyStatus": execute["status"] if execute else None,
+        "execute": execute,
+        "preflight": latest[RESULT_PREFLIGHT],
+        "verify": latest[RESULT_VERIFY],
+        "extendRdp": latest[RESULT_EXTEND_RDP],
+    })
+
+
+@app.route('/api/servers/<server_ip>/history', methods=['GET'])
+def server_history(server_ip):
+    """
+    Stored results for a server, newest first. ?kind=execute|preflight|verify|extend_rdp, ?since= and
+    ?until= (epoch seconds; pass the last recordedAt as until for the next page), ?limit=.
+    """
+    kind = request.args.get('kind')
+    if kind is not None and kind not in RESULT_KINDS:
+        return jsonify({
+            "success": False,
+            "error": f"kind must be one of: {', '.join(RESULT_KINDS)}"
+        }), 400
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+        until = float(request.args['until']) if 'until' in request.args else None
+        limit = int(request.args.get('limit', HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "since and until must be epoch seconds, limit an integer"
+        }), 400
+    results = RESULT_STORE.history(server_ip, kind, since, until, limit)
+    return jsonify({"success": True, "serverIp": server_ip, "count": len(results), "results": results})
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    Server-sent events stream of a job's phase transitions, ending with a "done" event.
+    """
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found or expired"
+        }), 404
+
+    def generate():
+        seen = 0
+        while True:
+            events = JOB_STORE.wait_for_events(job, seen, timeout=JOB_SSE_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                yield f"event: phase\ndata: {json.dumps(event)}\n\n"
+            seen += len(events)
+            if job.finished and seen >= len(job.events):
+                yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+
+    return Response(generate(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+
+# Bounded fan-out for /api/execute-batch. The executor is created lazily so it
+# is not shared across gunicorn's preload fork.
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "200"))
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+        return _batch_executor
+
+
+def execute_batch_item(index, item, browser_timezone=None, utc_offset=None, include_timings=False, deadline=None):
+    """
+    Run execute_powershell_script for one batch item and return its NDJSON record,
+    with that item's span breakdown under "timings" if requested. The item's deadline
+    ("deadline" on the item, else the batch's) starts when the item starts running.
+    """
+    with recording() as recorder, deadline_scope(requested_deadline(item.get('deadline', deadline))):
+        record = run_batch_item(index, item, browser_timezone, utc_offset)
+    if recorder.spans:
+        logger.info("Timings for batch item %s (%s)", index, record['serverIp'], extra={"timings": recorder.to_dict()})
+    if include_timings or is_truthy(item.get('includeTimings')):
+        record["timings"] = recorder.to_dict()
+    return record
+
+
+def run_batch_item(index, item, browser_timezone=None, utc_offset=None):
+    """
+    Errors are classified per item so one bad host never fails the whole batch.
+    """
+    target_ip = item.get('serverIp')
+    password = item.get('password')
+    proxy_ip_port = proxy_candidates(item.get('proxyIpPort'))
+    record = {"index": index, "serverIp": target_ip, "proxyIpPort": item.get('proxyIpPort')}
+
+    if not all([target_ip, password, proxy_ip_port]):
+        return {
+            **record,
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Missing required fields: serverIp, password, proxyIpPort"),
+        }
+
+    try:
+        result = execute_requested(
+            target_ip,
+            password,
+            proxy_ip_port,
+            item.get('browserTimezone', browser_timezone),
+            item.get('utcOffset', utc_offset),
+        )
+        return {
+            **record,
+            "success": True,
+            "status": result["status"],
+            "result": format_result_for_extension(result),
+            **selection_fields(result),
+        }
+    except Exception as e:
+        logger.error("Batch item %s (%s) failed: %s", index, target_ip, e)
+        return {
+            **record,
+            "success": False,
+            **classify_connection_error(e, target_ip),
+        }
+
+
+@app.route('/api/execute-batch', methods=['POST'])
+def execute_batch():
+    """
+    Configure many servers concurrently. Accepts {"servers": [{serverIp, password, proxyIpPort}, ...]}
+    and streams one NDJSON line per server as soon as it finishes, then a summary line.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('servers') if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Expected a non-empty 'servers' list"),
+        }), 400
+
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", f"Batch exceeds the limit of {BATCH_MAX_ITEMS} servers"),
+        }), 400
+
+    browser_timezone = data.get('browserTimezone') if isinstance(data, dict) else None
+    utc_offset = data.get('utcOffset') if isinstance(data, dict) else None
+    include_timings = wants_timings(data)
+    deadline = data.get('deadline') if isinstance(data, dict) else None
+    logger.info("Batch execute for %s servers", len(items))
+
+    executor = get_batch_executor()
+    futures = [
+        executor.submit(copy_context().run, execute_batch_item, index, item if isinstance(item, dict) else {},
+                        browser_timezone, utc_offset, include_timings, deadline)
+        for index, item in enumerate(items)
+    ]
+
+    def generate():
+        succeeded = 0
+        try:
+            for future in as_completed(futures):
+                record = future.result()
+                succeeded += 1 if record["success"] else 0
+                yield json.dumps(record) + "\n"
+            yield json.dumps({"done": True, "total": len(futures), "succeeded": succeeded}) + "\n"
+        finally:
+            # Client went away: drop anything that has not started yet
+            for future in futures:
+                future.cancel()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def extend_rdp_events(target_ip, password):
+    """
+    Run extend_rdp.ps1 (license check, slmgr re-arm, RDP service restart) on the same
+    WinRM path as execute_powershell_script, yielding NDJSON events as it goes:
+    "phase", then the script's "output"/"progress" records and "heartbeat"s while
+    slmgr runs, then one final "result" or "error" event.
+    """
+    try:
+        CIRCUIT_BREAKER.guard(target_ip)
+        # Restarts TermService, so one run per server at a time, like a configure.
+        # Nothing is yielded before admission, so the view can still answer 503 or 429.
+        with ADMISSION.admit(target_ip):
+            yield {"event": "phase", "phase": "connecting"}
+            with POOL_CACHE.lease_target(target_ip, password) as pool:
+                yield {"event": "phase", "phase": "running"}
+                ps = PowerShell(pool)
+                ps.add_cmdlet(EXTEND_RDP)
+                yield from stream_invoke(ps, "extend_rdp", EXTEND_RDP_TIMEOUT_SECONDS)
+                output = list(ps.output)
+    except CircuitOpenError as e:
+        yield {"event": "error", "success": False, **classify_connection_error(e, target_ip)}
+        return
+    except AdmissionRejected as e:
+        # Never reached the host: give back a half-open probe claimed by guard()
+        CIRCUIT_BREAKER.release(target_ip)
+        yield {"event": "error", "success": False, **classify_connection_error(e, target_ip)}
+        return
+    except RemoteScriptTimeout as e:
+        error_info = build_error_response(TIMEOUT, str(e), target_ip)
+        CIRCUIT_BREAKER.record(target_ip, error_info)
+        store_result(RESULT_EXTEND_RDP, target_ip, "error", error_info, error_info["error_code"])
+        yield {"event": "error", "success": False, **error_info}
+        return
+    except Exception as e:
+        logger.error("Extend RDP error for %s: %s", target_ip, e)
+        error_info = classify_connection_error(e, target_ip)
+        CIRCUIT_BREAKER.record(target_ip, error_info)
+        store_result(RESULT_EXTEND_RDP, target_ip, "error", error_info, error_info["error_code"])
+        yield {"event": "error", "success": False, **error_info}
+        return
+    CIRCUIT_BREAKER.record(target_ip, None)
+
+    try:
+        result = json.loads(output[-1]) if output else None
+    except (TypeError, ValueError):
+        result = None
+    if not isinstance(result, dict) or result.get("Status") != "Success":
+        detail = result.get("Message") if isinstance(result, dict) else "extend_rdp.ps1 returned no result"
+        error_info = build_error_response("EXECUTION_FAILED", detail or "extend_rdp.ps1 failed", target_ip)
+        store_result(RESULT_EXTEND_RDP, target_ip, "failed", {"result": result, **error_info},
+                     error_info["error_code"])
+        yield {"event": "error", "success": False, "result": result, **error_info}
+        return
+
+    logger.info("Extend RDP on %s: %s", target_ip, result.get("Action"))
+    store_result(RESULT_EXTEND_RDP, target_ip, "succeeded", result)
+    yield {"event": "result", "success": True, "result": result}
+
+
+@app.route('/api/extend-rdp', methods=['POST'])
+def extend_rdp():
+    """
+    Run extend_rdp.ps1 on one server, streaming its progress as NDJSON while it runs.
+    Accepts {serverIp, password}; the last line is the "result" or "error" event.
+    """
+    data = request.get_json(silent=True) or {}
+    target_ip = data.get('serverIp')
+    password = data.get('password')
+
+    if not all([target_ip, password]):
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Missing required fields: serverIp, password"),
+        }), 400
+
+    logger.info("Extend RDP request for %s", target_ip)
+    events = extend_rdp_events(target_ip, password)
+    # The generator's circuit guard and admission run before its first event, so an open
+    # circuit or a busy server still gets a plain 503 or 429 rather than a streamed error
+    first = next(events)
+    if first["event"] == "error":
+        payload = {key: value for key, value in first.items() if key != "event"}
+        if payload.get("error_code") in (SERVER_BUSY, TARGET_BUSY):
+            return server_busy_response(payload)
+        if payload.get("circuit_open"):
+            return circuit_open_response(payload)
+        return jsonify(payload), failure_status(payload)
+
+    def generate():
+        try:
+            yield json.dumps({"serverIp": target_ip, **first}, default=str) + "\n"
+            for event in events:
+                yield json.dumps({"serverIp": target_ip, **event}, default=str) + "\n"
+        finally:
+            # Client went away: stop the remote pipeline and release the session
+            events.close()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/api/extend-rdp-batch', methods=['POST'])
+def extend_rdp_batch():
+    """
+    Run extend_rdp.ps1 on many servers, at most BATCH_MAX_WORKERS at once. Accepts
+    {"servers": [{serverIp, password}, ...]} and streams every server's events as NDJSON
+    (tagged with index and serverIp) as they happen, then a summary line.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('servers') if isinstance(data, dict) else data
+
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Expected a non-empty 'servers' list"),
+        }), 400
+
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", f"Batch exceeds the limit of {BATCH_MAX_ITEMS} servers"),
+        }), 400
+
+    logger.info("Batch extend RDP for %s servers", len(items))
+    events = queue.Queue()
+    finished = object()
+    cancelled = threading.Event()
+
+    def run_item(index, item):
+        target_ip = item.get('serverIp')
+        tag = {"index": index, "serverIp": target_ip}
+        if not all([target_ip, item.get('password')]):
+            events.put({**tag, "event": "error", "success": False,
+                        **build_error_response("UNKNOWN_ERROR", "Missing required fields: serverIp, password")})
+            events.put(finished)
+            return
+        item_events = extend_rdp_events(target_ip, item['password'])
+        try:
+            for event in item_events:
+                if cancelled.is_set():
+                    break
+                events.put({**tag, **event})
+        finally:
+            # Stops the remote pipeline if the client went away mid-run
+            item_events.close()
+            events.put(finished)
+
+    executor = get_batch_executor()
+    futures = [
+        executor.submit(copy_context().run, run_item, index, item if isinstance(item, dict) else {})
+        for index, item in enumerate(items)
+    ]
+
+    def generate():
+        remaining = len(futures)
+        succeeded = 0
+        try:
+            while remaining:
+                event = events.get()
+                if event is finished:
+                    remaining -= 1
+                    continue
+                succeeded += 1 if event["event"] == "result" else 0
+                yield json.dumps(event, default=str) + "\n"
+            yield json.dumps({"done": True, "total": len(futures), "succeeded": succeeded}) + "\n"
+        finally:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/api/configure', methods=['POST'])
+def configure():
+    """
+    Preflight + execute in one request: port checks, then one WinRM session that both
+    authenticates and runs the proxy/timezone script. Returns the checks and the result.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "No JSON data provided"),
+        }), 400
+
+    target_ip = data.get('serverIp')
+    password = data.get('password')
+    proxy_ip_port = proxy_candidates(data.get('proxyIpPort'))
+    browser_timezone = data.get('browserTimezone')
+    utc_offset = data.get('utcOffset')
+
+    if not all([target_ip, password, proxy_ip_port]):
+        return jsonify({
+            "success": False,
+            **build_error_response("UNKNOWN_ERROR", "Missing required fields: serverIp, password, proxyIpPort"),
+        }), 400
+
+    logger.info("Configure request for %s, proxy: %s", target_ip, proxy_ip_port)
+
+    # Checked first, so a dead proxy never reaches the host (or claims its half-open circuit probe)
+    ranking = None
+    if isinstance(proxy_ip_port, list):
+        ranking = rank_candidates(proxy_ip_port)
+        probes = ranking
+        usable = any(row["ok"] for row in ranking)
+        detail = no_usable_candidate(proxy_ip_port, ranking)
+    else:
+        probes = [PROXY_PROBER.probe(proxy_ip_port)] if PROXY_PROBE_ENABLED else []
+        usable = all(probe["ok"] for probe in probes)
+        detail = f"Proxy {proxy_ip_port}: {probes[0]['message']}" if not usable else None
+    if not usable:
+        checks = [proxy_check(probe) for probe in probes]
+        error = build_error_response("PROXY_UNREACHABLE", detail, target_ip)
+        store_result(RESULT_EXECUTE, target_ip, "error", {"proxy": proxy_ip_port, **error}, error["error_code"])
+        return jsonify({"success": False, "checks": checks, **error}), 422
+
+    cached_error = CIRCUIT_BREAKER.check(target_ip)
+    if cached_error is not None:
+        return circuit_open_response({"success": False, "checks": [], **cached_error})
+
+    checks = []
+    authenticated = False
+    try:
+        checks, error = run_port_stage(target_ip)
+        if error is not None:
+            CIRCUIT_BREAKER.record(target_ip, error)
+            store_preflight(target_ip, {"success": False, "checks": checks, **error})
+            return jsonify({"success": False, "checks": checks, **error}), 422
+        checks.extend(proxy_check(probe) for probe in probes)
+
+        # Opening the pool is the credential check; the script then runs on the same session
+        with ADMISSION.admit(target_ip), POOL_CACHE.lease_target(target_ip, password) as pool:
+            authenticated = True
+            transport = "HTTPS" if TRANSPORTS.use_ssl(target_ip) else "HTTP"
+            checks.append(auth_check(True, f"Authenticated successfully over {transport}"))
+            store_preflight(target_ip, {"success": True, "checks": list(checks)})
+            if ranking is not None:
+                result = execute_ranked(target_ip, password, proxy_ip_port, browser_timezone, utc_offset,
+                                        ranking=ranking, pool=pool)
+            else:
+                result = execute_powershell_script(target_ip, password, proxy_ip_port, browser_timezone, utc_offset,
+                                                   pool=pool)
+
+        return jsonify({
+            "success": True,
+            "checks": checks,
+            "result": format_result_for_extension(result),
+            **selection_fields(result),
+        })
+
+    except AdmissionRejected as e:
+        logger.warning("Configure for %s not admitted: %s, retry after %ss", target_ip, e.error_code, e.retry_after)
+        CIRCUIT_BREAKER.release(target_ip)
+        return server_busy_response({"success": False, "checks": checks, **classify_connection_error(e, target_ip)})
+    except Exception as e:
+        logger.error("Configure error for %s: %s", target_ip, e)
+        error_info = classify_connection_error(e, target_ip)
+        if not authenticated:
+            # Failures after authentication are recorded by execute_powershell_script
+            CIRCUIT_BREAKER.record(target_ip, error_info)
+            checks.append(auth_check(False, str(e)))
+            store_preflight(target_ip, {"success": False, "checks": checks, **error_info})
+            return jsonify({"success": False, "checks": checks, **error_info}), failure_status(error_info, 422)
+        return jsonify({"success": False, "checks": checks, **error_info}), failure_status(error_info)
+
+def format_proxy_selection(selection):
+    attempts = {attempt["proxy"]: attempt["status"] for attempt in selection["attempts"]}
+    lines = ["Proxy Ranking (fastest healthy first):"]
+    for row in selection["ranking"]:
+        if row.get("skipped"):
+            measured = "not probed (not IP:Port)"
+        elif row["ok"]:
+            measured = f"{row['rtt_ms']} ms"
+        else:
+            measured = f"unreachable ({row['message']})"
+        line = f"{row['rank']}. {row['proxy']} - {measured}"
+        if row["proxy"] == selection["selected"]:
+            line += " ✓ applied"
+        elif row["proxy"] in attempts:
+            line += f" - tried: {attempts[row['proxy']]}"
+        lines.append(line)
+    return "\n".join(lines)
+
 
 def format_result_for_extension(result):
     """
     Format the result to match what the Chrome extension expects
     """
+    if result.get("proxy_selection"):
+        result = dict(result)
+        selection = result.pop("proxy_selection")
+        return f"{format_result_for_extension(result)}\n\n{format_proxy_selection(selection)}"
+
     if result["status"] == "Proxy Active":
         output = f"""Public IP: {result['public_ip']}
 ISP: {result['isp']}
@@ -546,7 +1735,7 @@ def test_endpoint():
     try:
         logger.info("=== TEST ENDPOINT CALLED ===")
         data = request.get_json()
-        logger.info(f"Test data received: {data}")
+        logger.info("Test data received", extra={"data": data})
         
         return jsonify({
             "success": True,
@@ -555,7 +1744,7 @@ def test_endpoint():
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
-        logger.error(f"Test endpoint error: {str(e)}")
+        logger.error("Test endpoint error: %s", e)
         return jsonify({
             "success": False,
             "error": str(e)
@@ -573,6 +1762,15 @@ def health_check():
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics, aggregated across gunicorn workers when PROMETHEUS_MULTIPROC_DIR is set
+    """
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 @app.route('/', methods=['GET'])
 def root():
     """
@@ -583,8 +1781,23 @@ def root():
         "version": "1.0",
         "endpoints": {
             "POST /api/preflight-check": "Pre-flight WinRM port and credential check",
+            "POST /api/preflight-scan": "Concurrent WinRM port sweep across many servers",
+            "POST /api/proxy-probe": "Concurrent proxy reachability and CONNECT latency check",
             "POST /api/execute-script": "Execute PowerShell script with proxy configuration",
-            "GET /api/health": "Health check endpoint"
+            "POST /api/configure": "Preflight checks and proxy configuration over one WinRM session",
+            "POST /api/verify": "Read-only proxy registry, public IP and timezone check against a desired state",
+            "POST /api/execute-batch": "Configure many servers concurrently, results streamed as NDJSON",
+            "GET /api/jobs/<id>": "Poll an async execute-script job (POST with \"async\": true)",
+            "GET /api/jobs/<id>/events": "Server-sent events stream of a job's phase transitions",
+            "GET /api/drift": "Drift state of configured servers (proxy registry, public IP, timezone)",
+            "GET /api/drift/<serverIp>": "Drift state of one configured server",
+            "POST /api/drift/<serverIp>/check": "Re-verify a configured server now",
+            "POST /api/extend-rdp": "Run the RDP license check/re-arm script, progress streamed as NDJSON",
+            "POST /api/extend-rdp-batch": "Run the RDP license script on many servers, progress streamed as NDJSON",
+            "GET /api/servers/<serverIp>/status": "Last stored proxy status, preflight and drift check of a server",
+            "GET /api/servers/<serverIp>/history": "Stored execute, preflight and verify results of a server",
+            "GET /api/health": "Health check endpoint",
+            "GET /metrics": "Prometheus metrics (per-phase latency histograms, in-flight gauges)"
         },
         "timestamp": datetime.now().isoformat()
     })
@@ -594,4 +1807,4 @@ if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
     
     # For production, use a WSGI server like gunicorn:
-    # gunicorn -w 4 -b 0.0.0.0:5000 app:app
\ No newline at end of file
+    # gunicorn -c gunicorn.conf.py app:app
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""
+ASGI serving mode: SERVER_MODE=asgi in gunicorn.conf.py (uvicorn workers), or
+`uvicorn asgi:app` directly.
+
+The event loop owns the HTTP connections, and for /api/preflight-check and
+/api/configure it runs the WinRM port probes with asyncio before the view starts
+(for /api/execute-script and /api/configure, the proxy probe too).
+The Flask view itself, with its blocking pypsrp calls, runs through asgiref's
+WSGI adapter on a dedicated I/O executor of ASGI_WINRM_THREADS threads. One process then holds hundreds of
+WinRM sessions in flight instead of one per gunicorn thread. Every route is
+served by app.py, so responses, hooks and metrics are the same in both modes.
+"""
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+ASGI_WINRM_THREADS = int(os.environ.get("ASGI_WINRM_THREADS", "256"))
+# Size the admission cap to the executor unless set explicitly; the rest of the
+# threads stay free for routes that never open a session. Must precede the app import.
+os.environ.setdefault("ADMISSION_MAX_SESSIONS", str(max(1, ASGI_WINRM_THREADS - 16)))
+
+from app import app as flask_app  # noqa: E402
+from circuit_breaker import CIRCUIT_BREAKER  # noqa: E402
+from metrics import current_endpoint  # noqa: E402
+from proxy_probe import PROXY_PROBE_ENABLED, PROXY_PROBER  # noqa: E402
+from timings import SpanRecorder, current_recorder  # noqa: E402
+from winrm_diagnostics import prefetched_port_results, probe_winrm_ports_async  # noqa: E402
+
+# Routes whose TCP port stage runs on the event loop ahead of the view, by Flask endpoint
+PORT_PROBE_ROUTES = {
+    "/api/preflight-check": "preflight_check",
+    "/api/configure": "configure",
+}
+# Routes whose proxy probe runs on the event loop, leaving the result in PROXY_PROBER's cache for the view
+PROXY_PROBE_ROUTES = {
+    "/api/execute-script": "execute_script",
+    "/api/configure": "configure",
+}
+
+WINRM_EXECUTOR = ThreadPoolExecutor(max_workers=ASGI_WINRM_THREADS, thread_name_prefix="winrm-io")
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# WinRMWsgiInstance leans on WsgiToAsgiInstance internals that are not asgiref's
+# public API (as of 3.7.2, pinned in requirements.txt; re-check on upgrade):
+#  - run_wsgi_app(body), which __call__ awaits once the request body is spooled,
+#    is overridden: asgiref's version runs the app via sync_to_async, on one
+#    thread shared by every request, and ignores client disconnects.
+#  - sync_send, the AsyncToSync(send) wrapper __call__ sets up, is how serve()
+#    sends from the executor thread.
+#  - response_start / response_started, the http.response.start message that
+#    start_response stores and the flag guarding it, are sent and set by serve()
+#    the same way asgiref's run_wsgi_app does.
+class WinRMWsgiInstance(WsgiToAsgiInstance):
+    """
+    asgiref's per-request WSGI adapter, with three changes: the app runs on
+    WINRM_EXECUTOR (asgiref's sync_to_async would put every request on one shared
+    thread), a streamed response stops once the client disconnects, and the
+    response iterable is closed so a view's generator cleanup runs.
+    """
+
+    async def __call__(self, scope, receive, send):
+        self.receive = receive
+        self.disconnected = threading.Event()
+        try:
+            await super().__call__(scope, self.receive_request, send)
+        except ClientDisconnected:
+            pass
+
+    async def receive_request(self):
+        message = await self.receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        return message
+
+    async def watch_disconnect(self):
+        while (await self.receive())["type"] != "http.disconnect":
+            pass
+        self.disconnected.set()
+
+    async def run_wsgi_app(self, body):
+        loop = asyncio.get_running_loop()
+        watcher = asyncio.ensure_future(self.watch_disconnect())
+        try:
+            await loop.run_in_executor(WINRM_EXECUTOR, copy_context().run, self.serve, body)
+        finally:
+            watcher.cancel()
+
+    def send_checked(self, message):
+        # Called from the executor thread; stops streamed responses once the client is gone.
+        if self.disconnected.is_set():
+            raise ClientDisconnected()
+        self.sync_send(message)
+
+    def serve(self, body):
+        chunks = self.wsgi_application(self.build_environ(self.scope, body), self.start_response)
+        try:
+            for chunk in chunks:
+                if not self.response_started:
+                    self.response_started = True
+                    self.send_checked(self.response_start)
+                if chunk:
+                    self.send_checked({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not self.response_started:
+                self.response_started = True
+                self.send_checked(self.response_start)
+            self.send_checked({"type": "http.response.body"})
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+
+class FlaskOnExecutor(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await WinRMWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+wsgi_app = FlaskOnExecutor(flask_app)
+
+
+async def skip_probe():
+    return None
+
+
+async def prefetch_probes(path, body):
+    try:
+        data = json.loads(body)
+        target_ip, proxy = data.get("serverIp"), data.get("proxyIpPort")
+    except (ValueError, AttributeError):
+        return
+    # An open circuit fails fast in the view without touching the ports
+    probe_ports = (path in PORT_PROBE_ROUTES and isinstance(target_ip, str) and target_ip
+                   and not CIRCUIT_BREAKER.is_open(target_ip))
+    # proxyIpPort may be a list of candidates for execute-script to rank
+    proxies = [proxy] if isinstance(proxy, str) else proxy if isinstance(proxy, list) else []
+    proxies = [item for item in proxies if isinstance(item, str) and item]
+    probe_proxy = path in PROXY_PROBE_ROUTES and PROXY_PROBE_ENABLED and proxies
+    if not (probe_ports or probe_proxy):
+        return
+    # Label and time the probes as part of the request the view is about to serve
+    current_endpoint.set(PORT_PROBE_ROUTES.get(path) or PROXY_PROBE_ROUTES[path])
+    current_recorder.set(SpanRecorder())
+    port_results, _ = await asyncio.gather(
+        probe_winrm_ports_async(target_ip) if probe_ports else skip_probe(),
+        PROXY_PROBER.scan_async(proxies) if probe_proxy else skip_probe(),
+    )
+    if probe_ports:
+        prefetched_port_results.set((target_ip, port_results))
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        body.extend(message.get("body", b""))
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def serve_http(scope, receive, send):
+    """
+    Prefetch middleware: for the probe routes, read the body and run the probes on
+    the event loop, then hand the buffered body (and later messages, for disconnect
+    detection) to the WSGI adapter.
+    """
+    if scope["method"] != "POST" or (scope["path"] not in PORT_PROBE_ROUTES and scope["path"] not in PROXY_PROBE_ROUTES):
+        await wsgi_app(scope, receive, send)
+        return
+
+    try:
+        body = await read_body(receive)
+    except ClientDisconnected:
+        return
+    await prefetch_probes(scope["path"], body)
+    buffered = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def replay():
+        return buffered.pop() if buffered else await receive()
+
+    await wsgi_app(scope, replay, send)
+
+
+async def serve_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            WINRM_EXECUTOR.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http":
+        await serve_http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await serve_lifespan(receive, send)
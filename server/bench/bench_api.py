@@ -0,0 +1,217 @@
+"""
+Load benchmark for /api/preflight-check and /api/execute-script against the
+fake WinRM endpoint in bench/fake_winrm.py.
+
+Starts the fake WS-Man listener on 0.0.0.0:5985 and, unless --api-url is
+given, the API itself under gunicorn (gunicorn.conf.py) on a local port. Each
+concurrency level runs for --duration seconds with that many client threads,
+spread over --hosts fake targets (127.0.0.2, 127.0.0.3, ...), and reports
+req/s, p50/p95/p99 and worker saturation (request-handling thread time from
+/metrics divided by wall time x worker threads).
+
+Usage (from server/):
+    python bench/bench_api.py [--endpoint execute-script] [--levels 1,4,16,64] [--server-mode asgi]
+        [--latency 0.02] [--auth-fail-hosts 1] [--hang-hosts 1] [--json out.json]
+        [--max-p99-ms 2000]
+
+--max-p99-ms makes the run exit non-zero when any level's p99 exceeds it, so a
+CI job can gate on latency regressions.
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, os.pardir)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_winrm import FakeWinRM, HostProfile, start_fake_winrm  # noqa: E402
+
+BENCH_PASSWORD = "bench-password"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_api(port: int, workers: int, threads: int, server_mode: str = "wsgi") -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        SERVER_MODE=server_mode,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join("/tmp", f"dashrdp-bench-prometheus-{port}"),
+        # Replayed results would be measured instead of WinRM round trips
+        SINGLEFLIGHT_REPLAY_SECONDS=os.environ.get("SINGLEFLIGHT_REPLAY_SECONDS", "0"),
+        # The bench payload's proxy is a TEST-NET address, so the proxy probe would reject every request
+        PROXY_PROBE_ENABLED=os.environ.get("PROXY_PROBE_ENABLED", "0"),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("API did not start within 30s")
+
+
+def scrape_metrics(api_url: str) -> dict[str, float]:
+    text = requests.get(f"{api_url}/metrics", timeout=5).text
+    values = {}
+    for name in ("dashrdp_worker_busy_seconds_total", "dashrdp_worker_threads"):
+        match = re.search(rf"^{name} ([0-9.e+-]+)$", text, re.MULTILINE)
+        values[name] = float(match.group(1)) if match else 0.0
+    return values
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_payloads(endpoint: str, targets: list) -> list:
+    payloads = []
+    for target in targets:
+        payload = {"serverIp": target, "password": BENCH_PASSWORD}
+        if endpoint != "preflight-check":
+            payload.update({"proxyIpPort": "198.51.100.7:3128", "browserTimezone": "Europe/Berlin"})
+        payloads.append(payload)
+    return payloads
+
+
+def run_level(api_url: str, endpoint: str, payloads: list, concurrency: int, duration: float) -> dict:
+    latencies: list = []
+    statuses: Counter = Counter()
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(worker_index: int) -> None:
+        session = requests.Session()
+        sent = worker_index
+        while time.monotonic() < stop_at:
+            payload = payloads[sent % len(payloads)]
+            sent += concurrency
+            started = time.perf_counter()
+            try:
+                status = session.post(f"{api_url}/api/{endpoint}", json=payload, timeout=60).status_code
+            except requests.RequestException as exc:
+                status = type(exc).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+
+    before = scrape_metrics(api_url)
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    wall = time.perf_counter() - wall_started
+    after = scrape_metrics(api_url)
+
+    busy = after["dashrdp_worker_busy_seconds_total"] - before["dashrdp_worker_busy_seconds_total"]
+    threads = after["dashrdp_worker_threads"] or 1
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "req_per_s": len(latencies) / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "saturation": busy / (wall * threads),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoint", choices=("preflight-check", "execute-script", "configure"), default="execute-script")
+    parser.add_argument("--levels", default="1,4,16,32,64", help="comma-separated client concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--hosts", type=int, default=16, help="number of healthy fake targets")
+    parser.add_argument("--auth-fail-hosts", type=int, default=0)
+    parser.add_argument("--hang-hosts", type=int, default=0, help="targets that hang past the WinRM read timeout")
+    parser.add_argument("--hang-seconds", type=float, default=35.0)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake per-message WS-Man latency (s)")
+    parser.add_argument("--script-latency", type=float, default=0.15, help="fake per-pipeline remote work (s)")
+    parser.add_argument("--winrm-port", type=int, default=5985)
+    parser.add_argument("--api-url", help="benchmark an already-running API instead of starting gunicorn")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--server-mode", choices=("wsgi", "asgi"), default="wsgi",
+                        help="asgi: uvicorn workers serving asgi.py (size with ASGI_WINRM_THREADS)")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="exit 1 if any level's p99 exceeds this")
+    args = parser.parse_args()
+
+    healthy = [f"127.0.0.{2 + i}" for i in range(args.hosts)]
+    auth_fail = [f"127.0.1.{2 + i}" for i in range(args.auth_fail_hosts)]
+    hanging = [f"127.0.2.{2 + i}" for i in range(args.hang_hosts)]
+    profiles = {target: HostProfile(latency=args.latency, auth_fail=True) for target in auth_fail}
+    profiles.update({target: HostProfile(latency=args.latency, hang_seconds=args.hang_seconds) for target in hanging})
+    fake = FakeWinRM(HostProfile(latency=args.latency, script_latency=args.script_latency,
+                                 password=BENCH_PASSWORD), profiles)
+    fake_server = start_fake_winrm(fake, "0.0.0.0", args.winrm_port)
+
+    api_process = None
+    api_url = args.api_url
+    if api_url is None:
+        port = free_port()
+        api_process = start_api(port, args.workers, args.threads, args.server_mode)
+        api_url = f"http://127.0.0.1:{port}"
+
+    payloads = build_payloads(args.endpoint, healthy + auth_fail + hanging)
+    results = []
+    try:
+        print(f"{'conc':>5} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sat':>6}  statuses")
+        for level in (int(value) for value in args.levels.split(",")):
+            row = run_level(api_url, args.endpoint, payloads, level, args.duration)
+            results.append(row)
+            print(f"{row['concurrency']:>5} {row['requests']:>7} {row['req_per_s']:>8.1f} {row['p50_ms']:>8.1f} "
+                  f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['saturation']:>6.2f}  {row['statuses']}")
+    finally:
+        if api_process is not None:
+            api_process.terminate()
+            try:
+                api_process.wait(10)
+            except subprocess.TimeoutExpired:
+                api_process.kill()
+        fake_server.shutdown()
+
+    print(f"fake WinRM: {json.dumps(fake.stats)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump({"endpoint": args.endpoint, "args": vars(args), "levels": results}, handle, indent=2)
+
+    if args.max_p99_ms is not None:
+        worst = max(row["p99_ms"] for row in results)
+        if worst > args.max_p99_ms:
+            print(f"p99 {worst:.1f}ms exceeds --max-p99-ms {args.max_p99_ms}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
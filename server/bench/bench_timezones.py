@@ -0,0 +1,48 @@
+"""
+Micro-benchmark for the timezone index lookups.
+
+Compares the memoized index lookups against the previous approach of building
+the mapping dict literal inside every call.
+
+Usage (from server/):
+    python bench/bench_timezones.py [--number 200000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import timezones  # noqa: E402
+
+SAMPLE_ZONES = ["America/New_York", "Europe/Berlin", "Asia/Calcutta", "Europe/Kyiv", "Pacific/Auckland", "Mars/Olympus"]
+SAMPLE_COUNTRIES = ["US", "de", "IN", "NP", None, "ZZ"]
+
+
+# Stand-in for the old code path: a function whose body rebuilds a 70-entry dict literal per call.
+_LITERAL_ENTRIES = ", ".join(f"{zone!r}: {windows_id!r}" for zone, windows_id in
+                             list(timezones.IANA_TO_WINDOWS_TIMEZONE.items())[:70])
+_namespace = {}
+exec(f"def per_call_literal(name):\n    return {{{_LITERAL_ENTRIES}}}.get(name)\n", _namespace)
+per_call_literal = _namespace["per_call_literal"]
+
+
+def bench(label, fn, args, number):
+    per_round = timeit.timeit(lambda: [fn(arg) for arg in args], number=number)
+    print(f"{label:<40} {per_round / (number * len(args)) * 1e9:8.1f} ns/lookup")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    bench("per-call dict literal (previous)", per_call_literal, SAMPLE_ZONES, args.number // 10)
+    bench("iana_to_windows_timezone (memoized)", timezones.iana_to_windows_timezone, SAMPLE_ZONES, args.number)
+    bench("country_to_timezone (memoized)", timezones.country_to_timezone, SAMPLE_COUNTRIES, args.number)
+    bench("load_timezone_index (import-time cost)", lambda _: timezones.load_timezone_index(), [None], 200)
+
+
+if __name__ == "__main__":
+    main()
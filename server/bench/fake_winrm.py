@@ -0,0 +1,519 @@
+"""
+Stand-in WS-Man endpoint that speaks enough PSRP for pypsrp's RunspacePool and
+PowerShell: shell Create/Delete, Command/Send/Receive/Signal, the runspace
+pool handshake and GetAvailableRunspaces. A Receive with nothing ready within
+the client's OperationTimeout gets WinRM's TimedOut fault. Scripts are not executed; each
+pipeline gets a canned answer chosen from the script text and parameters, so
+the API's real code paths (pool cache, fused/stepwise/local-geo scripts,
+preflight credential check) run unchanged against it.
+
+Behaviour is chosen per target by the Host header, so one listener on
+0.0.0.0:5985 can play many hosts at 127.0.0.2, 127.0.0.3, ... (all of
+127.0.0.0/8 is loopback on Linux).
+
+Usage (from server/):
+    python bench/fake_winrm.py [--port 5985] [--latency 0.02] [--profiles profiles.json]
+    python bench/fake_winrm.py --port 5986 --certfile cert.pem --keyfile key.pem   # HTTPS listener
+
+profiles.json maps target IPs to HostProfile fields, e.g.
+    {"127.0.0.3": {"auth_fail": true}, "127.0.0.4": {"hang_seconds": 40}}
+"""
+import argparse
+import base64
+import json
+import os
+import ssl
+import struct
+import sys
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pypsrp.complex_objects import PSInvocationState, RunspacePoolState  # noqa: E402
+from pypsrp.messages import (  # noqa: E402
+    Destination,
+    InformationRecord,
+    MessageType,
+    PipelineState,
+    RunspaceAvailability,
+    RunspacePoolStateMessage,
+    SessionCapability,
+)
+from pypsrp.powershell import Fragment  # noqa: E402
+from pypsrp.serializer import Serializer  # noqa: E402
+from pypsrp.wsman import NAMESPACES, WSManAction  # noqa: E402
+
+for _prefix, _uri in NAMESPACES.items():
+    if _prefix != "xml":
+        ET.register_namespace(_prefix, _uri)
+
+RSP = NAMESPACES["rsp"]
+COMMAND_DONE = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done"
+# WSManFault code of an OperationTimeout that passed; pypsrp polls again on it
+OPERATION_TIMED_OUT = 2150858793
+
+
+class OperationTimedOut(Exception):
+    pass
+
+
+@dataclass
+class HostProfile:
+    latency: float = 0.0           # added to every WS-Man message
+    script_latency: float = 0.0    # added once per pipeline (remote work, e.g. ipinfo)
+    password: Optional[str] = None  # None accepts any password
+    auth_fail: bool = False        # 401 on every request
+    hang_seconds: float = 0.0      # sleep this long before answering the first request of a shell
+    public_ip: Optional[str] = None  # None: a different IP (proxy active); "target": same IP (proxy inactive)
+    org: str = "AS64500 Bench Transit"
+    country: str = "DE"
+    timezone: str = "Europe/Berlin"
+    windows_timezone: str = "W. Europe Standard Time"
+    current_timezone: str = "UTC"
+    hostname: str = "BENCH-HOST"
+    license_days: int = 30         # extend_rdp.ps1: 0 takes the re-arm path
+    step_latency: float = 0.0      # between streamed Write-Host lines (extend_rdp.ps1)
+
+
+@dataclass
+class Pipeline:
+    id: str
+    output: list = field(default_factory=list)  # (ready_at, fragment), in order
+
+
+class Defragmenter:
+    """
+    Reassembles client fragments into raw (message_type, rpid, pid, xml)
+    tuples. pypsrp's own Fragmenter also deserializes every message, which it
+    cannot do for the client-side ones (InitRunspacePool's HostInfo).
+    """
+
+    def __init__(self):
+        self.buffers: dict[int, bytes] = {}
+
+    def feed(self, data: bytes) -> list:
+        messages = []
+        while data:
+            frag, data = Fragment.unpack(data)
+            buffered = self.buffers.pop(frag.object_id, b"") + frag.data
+            if not frag.end:
+                self.buffers[frag.object_id] = buffered
+                continue
+            message_type = struct.unpack("<I", buffered[4:8])[0]
+            rpid = str(uuid.UUID(bytes_le=buffered[8:24]))
+            pid = str(uuid.UUID(bytes_le=buffered[24:40]))
+            body = buffered[40:]
+            if body.startswith(b"\xef\xbb\xbf"):
+                body = body[3:]
+            messages.append((message_type, rpid, pid, body))
+        return messages
+
+
+@dataclass
+class Shell:
+    id: str
+    rpid: str
+    target: str
+    defragmenter: Defragmenter = field(default_factory=Defragmenter)
+    pending: bytes = b""
+    pipelines: dict = field(default_factory=dict)
+    object_counter: int = 1
+
+
+class FakeWinRM:
+    def __init__(self, default_profile: Optional[HostProfile] = None, profiles: Optional[dict] = None):
+        self.default_profile = default_profile or HostProfile()
+        self.profiles: dict[str, HostProfile] = dict(profiles or {})
+        self.serializer = Serializer()
+        self.shells: dict[str, Shell] = {}
+        self.timezones: dict[str, str] = {}
+        self.proxies: dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "shells_opened": 0, "pipelines": 0, "auth_failures": 0,
+                      "library_definitions": 0}
+
+    def profile_for(self, target: str) -> HostProfile:
+        return self.profiles.get(target, self.default_profile)
+
+    # --- PSRP framing -------------------------------------------------------
+
+    def pack(self, shell: Shell, message_type: int, payload: ET.Element, pid: Optional[str] = None) -> bytes:
+        data = struct.pack("<I", Destination.CLIENT) + struct.pack("<I", message_type)
+        data += uuid.UUID(shell.rpid).bytes_le
+        data += (uuid.UUID(pid) if pid else uuid.UUID(int=0)).bytes_le
+        data += ET.tostring(payload, encoding="utf-8", method="xml")
+        fragment = Fragment(shell.object_counter, 0, data, start=True, end=True).pack()
+        shell.object_counter += 1
+        return fragment
+
+    def pack_object(self, shell: Shell, obj: Any, pid: Optional[str] = None) -> bytes:
+        return self.pack(shell, obj.MESSAGE_TYPE, self.serializer.serialize(obj), pid)
+
+    # --- canned script results ----------------------------------------------
+
+    def parse_pipeline(self, xml: bytes) -> tuple[str, dict[str, str]]:
+        """
+        Pull the script text (or command name) and named parameters out of a CREATE_PIPELINE message.
+        """
+        root = ET.fromstring(xml)
+        script = ""
+        params = {}
+        for element in root.iter():
+            name = element.attrib.get("N")
+            if name == "Cmd" and not script:
+                script = self.serializer._deserialize_string(element.text or "")
+            elif name == "Args":
+                for arg in element.iter("Obj"):
+                    key = arg.find("MS/*[@N='N']")
+                    value = arg.find("MS/*[@N='V']")
+                    if key is not None and key.tag == "S":
+                        params[key.text] = self.serializer._deserialize_string(value.text or "") \
+                            if value is not None and value.tag == "S" else None
+        return script, params
+
+    def run_pipeline(self, shell: Shell, script: str, params: dict[str, str]) -> list:
+        profile = self.profile_for(shell.target)
+        public_ip = shell.target if profile.public_ip == "target" else (profile.public_ip or "203.0.113.10")
+        current = self.timezones.get(shell.target, profile.current_timezone)
+
+        def sync(target_tz: str) -> dict[str, Any]:
+            changed = current != target_tz
+            self.timezones[shell.target] = target_tz
+            return {
+                "current": current,
+                "target": target_tz,
+                "new": target_tz,
+                "changed": changed,
+                "sync_status": "Timezone changed successfully" if changed else "Timezone already correct",
+                "timings": {"get_timezone": 4.0, "set_timezone": 25.0, "verify_timezone": 4.0},
+            }
+
+        proxy_changed = None
+        if "ProxyServer" in params:
+            proxy_changed = self.proxies.get(shell.target) != params["ProxyServer"]
+            self.proxies[shell.target] = params["ProxyServer"]
+
+        if "function global:" in script:
+            # The script library, defined once per runspace
+            with self.lock:
+                self.stats["library_definitions"] += 1
+            return []
+        if script == "Get-DashHostname":
+            return [profile.hostname]
+        if script == "Invoke-DashExtendRdp":
+            return self.extend_rdp(profile)
+        if script == "Invoke-DashProxyIpinfo":
+            return [public_ip, profile.org, profile.country, profile.timezone]
+        if script == "Set-TimeZone":
+            self.timezones[shell.target] = params["Id"]
+            return []
+        if script == "Get-DashTimezoneId":
+            return [current]
+        if "PublicIpUrl" in params and "ProxyServer" not in params:
+            proxy = self.proxies.get(shell.target)
+            registry = [{"path": path, "proxy_enable": 1 if proxy else 0, "proxy_server": proxy}
+                        for path in ("HKLM:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings",
+                                     "HKCU:\\Software\\Microsoft\\Windows\\CurrentVersion\\Internet Settings")]
+            return [json.dumps({"registry": registry, "public_ip": public_ip if proxy else shell.target,
+                                "public_ip_error": None, "timezone": current,
+                                "timings": {"read_registry": 3.0, "public_ip": 80.0, "get_timezone": 4.0}})]
+        if "PublicIpUrl" in params:
+            return [json.dumps({"proxy_changed": proxy_changed, "ip": public_ip, "error": None,
+                                "timings": {"set_proxy": 6.0, "public_ip": 80.0}})]
+        if "IpinfoTimezone" in params:
+            return [json.dumps(sync(profile.windows_timezone))]
+        if "TargetIp" in params:
+            result = {"proxy_changed": proxy_changed, "ip": public_ip, "org": profile.org, "country": profile.country,
+                      "ipinfo_timezone": profile.timezone, "ipinfo_error": None}
+            timings = {"set_proxy": 6.0, "ipinfo": 150.0}
+            if public_ip != shell.target:
+                tz = sync(profile.windows_timezone)
+                timings.update(tz.pop("timings"))
+                result.update(tz)
+            result["timings"] = timings
+            return [json.dumps(result)]
+        return []
+
+    def extend_rdp(self, profile: HostProfile) -> list:
+        """
+        extend_rdp.ps1: Write-Host lines (as InformationRecords, streamed step_latency
+        apart) followed by the JSON result.
+        """
+        lines = ["Starting RDP license management process...", "Step 1: Checking current license status..."]
+        if profile.license_days > 0:
+            lines += [f"Current license days remaining: {profile.license_days}",
+                      f"License is still valid with {profile.license_days} days remaining.",
+                      "No rearm needed at this time."]
+            result = {"Status": "Success", "Message": "License is still valid, no action needed",
+                      "RemainingDays": profile.license_days, "Action": "No action needed"}
+        else:
+            lines += ["License is EXPIRED!", "Step 2: Re-arming Windows license...", "License re-armed successfully",
+                      "Step 3: Stopping Remote Desktop Services...", "Step 4: Starting Remote Desktop Services...",
+                      "Step 5: Restarting RDP connections...", "Step 6: Verifying service status...",
+                      "Service Status: Running", "Step 7: Checking updated license information..."]
+            result = {"Status": "Success", "Message": "RDP license re-armed and service restarted successfully",
+                      "ServiceStatus": "Running", "PreviousRemainingDays": 0, "Action": "Rearm executed"}
+        result["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        records = [InformationRecord(message_data=line, source="Write-Host",
+                                     tags=["PSHOST"], user="BENCH\\Administrator", computer=profile.hostname,
+                                     pid=4242, native_thread_id=1, managed_thread_id=1)
+                   for line in lines]
+        return records + [json.dumps(result)]
+
+    # --- WS-Man actions -----------------------------------------------------
+
+    def handle(self, target: str, action: str, header: ET.Element, body: ET.Element) -> ET.Element:
+        selector = header.find("wsman:SelectorSet/wsman:Selector[@Name='ShellId']", NAMESPACES)
+        shell_id = selector.text if selector is not None else None
+        response = ET.Element("{%s}Body" % NAMESPACES["s"])
+
+        if action == WSManAction.CREATE:
+            creation = body.find("rsp:Shell/pwsh:creationXml", NAMESPACES)
+            defragmenter = Defragmenter()
+            messages = defragmenter.feed(base64.b64decode(creation.text))
+            rpid = messages[0][1]
+            shell = Shell(id=rpid.upper(), rpid=rpid, target=target, defragmenter=defragmenter)
+            capability = SessionCapability("2.3", "2.0", "1.1.0.1")
+            shell.pending = self.pack_object(shell, capability) + \
+                self.pack_object(shell, RunspacePoolStateMessage(state=RunspacePoolState.OPENED))
+            with self.lock:
+                self.shells[shell.id] = shell
+                self.stats["shells_opened"] += 1
+
+            created = ET.SubElement(response, "{%s}ResourceCreated" % NAMESPACES["wst"])
+            ET.SubElement(created, "{%s}Address" % NAMESPACES["wsa"]).text = "http://%s:5985/wsman" % target
+            params = ET.SubElement(created, "{%s}ReferenceParameters" % NAMESPACES["wsa"])
+            selectors = ET.SubElement(params, "{%s}SelectorSet" % NAMESPACES["wsman"])
+            ET.SubElement(selectors, "{%s}Selector" % NAMESPACES["wsman"], Name="ShellId").text = shell.id
+            shell_xml = ET.SubElement(response, "{%s}Shell" % RSP)
+            ET.SubElement(shell_xml, "{%s}ShellId" % RSP).text = shell.id
+            ET.SubElement(shell_xml, "{%s}ResourceUri" % RSP).text = "http://schemas.microsoft.com/powershell/Microsoft.PowerShell"
+            return response
+
+        shell = self.shells.get(shell_id)
+        if shell is None:
+            raise KeyError(f"Unknown shell {shell_id}")
+
+        if action == WSManAction.DELETE:
+            with self.lock:
+                self.shells.pop(shell_id, None)
+            return response
+
+        if action == WSManAction.COMMAND:
+            command = body.find("rsp:CommandLine", NAMESPACES)
+            pipeline = Pipeline(id=command.attrib["CommandId"])
+            shell.pipelines[pipeline.id] = pipeline
+            self.feed(shell, pipeline, base64.b64decode(command.find("rsp:Arguments", NAMESPACES).text))
+            ET.SubElement(ET.SubElement(response, "{%s}CommandResponse" % RSP), "{%s}CommandId" % RSP).text = pipeline.id
+            return response
+
+        if action == WSManAction.SEND:
+            stream = body.find("rsp:Send/rsp:Stream", NAMESPACES)
+            data = base64.b64decode(stream.text or "")
+            command_id = stream.attrib.get("CommandId")
+            if command_id:
+                self.feed(shell, shell.pipelines[command_id], data)
+            else:
+                for message_type, _, _, xml in shell.defragmenter.feed(data):
+                    if message_type == MessageType.GET_AVAILABLE_RUNSPACES:
+                        ci = int(ET.fromstring(xml).find(".//*[@N='ci']").text)
+                        shell.pending += self.pack_object(shell, RunspaceAvailability(response=1, ci=ci))
+            ET.SubElement(response, "{%s}SendResponse" % RSP)
+            return response
+
+        if action == WSManAction.RECEIVE:
+            desired = body.find("rsp:Receive/rsp:DesiredStream", NAMESPACES)
+            command_id = desired.attrib.get("CommandId")
+            receive = ET.SubElement(response, "{%s}ReceiveResponse" % RSP)
+            if command_id is None:
+                data, shell.pending = shell.pending, b""
+                if data:
+                    ET.SubElement(receive, "{%s}Stream" % RSP, Name="stdout").text = base64.b64encode(data).decode()
+                return response
+
+            # Everything that is ready, waiting for the next fragment if nothing is yet
+            pipeline = shell.pipelines[command_id]
+            if pipeline.output:
+                delay = pipeline.output[0][0] - time.monotonic()
+                operation_timeout = header.find("wsman:OperationTimeout", NAMESPACES)
+                if operation_timeout is not None and delay > float(operation_timeout.text[2:-1]):
+                    time.sleep(float(operation_timeout.text[2:-1]))
+                    raise OperationTimedOut()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.monotonic()
+            ready = [fragment for ready_at, fragment in pipeline.output if ready_at <= now]
+            pipeline.output = pipeline.output[len(ready):]
+            ET.SubElement(receive, "{%s}Stream" % RSP, Name="stdout", CommandId=command_id).text = \
+                base64.b64encode(b"".join(ready)).decode()
+            if not pipeline.output:
+                ET.SubElement(receive, "{%s}CommandState" % RSP, CommandId=command_id, State=COMMAND_DONE)
+                shell.pipelines.pop(pipeline.id, None)
+            return response
+
+        if action == WSManAction.SIGNAL:
+            ET.SubElement(response, "{%s}SignalResponse" % RSP)
+            return response
+
+        raise KeyError(f"Unsupported action {action}")
+
+    def feed(self, shell: Shell, pipeline: Pipeline, data: bytes) -> None:
+        for message_type, _, pid, xml in shell.defragmenter.feed(data):
+            if message_type != MessageType.CREATE_PIPELINE:
+                continue
+            with self.lock:
+                self.stats["pipelines"] += 1
+            profile = self.profile_for(shell.target)
+            ready_at = time.monotonic()
+            final = []
+            for line in self.run_pipeline(shell, *self.parse_pipeline(xml)):
+                if isinstance(line, InformationRecord):
+                    ready_at += profile.step_latency
+                    pipeline.output.append((ready_at, self.pack_object(shell, line, pid)))
+                else:
+                    final.append(self.pack(shell, MessageType.PIPELINE_OUTPUT, self.serializer.serialize(line), pid))
+            final.append(self.pack_object(shell, PipelineState(state=PSInvocationState.COMPLETED), pid))
+            ready_at += profile.script_latency
+            pipeline.output.extend((ready_at, fragment) for fragment in final)
+
+
+def envelope(action: str, relates_to: str, body: ET.Element) -> bytes:
+    s, wsa = NAMESPACES["s"], NAMESPACES["wsa"]
+    root = ET.Element("{%s}Envelope" % s)
+    header = ET.SubElement(root, "{%s}Header" % s)
+    ET.SubElement(header, "{%s}Action" % wsa).text = action + "Response"
+    ET.SubElement(header, "{%s}MessageID" % wsa).text = "uuid:%s" % str(uuid.uuid4()).upper()
+    ET.SubElement(header, "{%s}RelatesTo" % wsa).text = relates_to
+    root.append(body)
+    return ET.tostring(root, encoding="utf-8", method="xml")
+
+
+def fault(relates_to: str, reason: str, fault_code: Optional[int] = None) -> bytes:
+    s = NAMESPACES["s"]
+    body = ET.Element("{%s}Body" % s)
+    fault_xml = ET.SubElement(body, "{%s}Fault" % s)
+    code = ET.SubElement(fault_xml, "{%s}Code" % s)
+    ET.SubElement(code, "{%s}Value" % s).text = "s:Receiver"
+    ET.SubElement(ET.SubElement(fault_xml, "{%s}Reason" % s), "{%s}Text" % s).text = reason
+    if fault_code is not None:
+        detail = ET.SubElement(fault_xml, "{%s}Detail" % s)
+        ET.SubElement(detail, "{%s}WSManFault" % NAMESPACES["wsmanfault"], Code=str(fault_code))
+    return envelope("http://schemas.dmtf.org/wbem/wsman/1/wsman/fault", relates_to, body)
+
+
+def make_handler(fake: FakeWinRM):
+    class WSManHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            payload = self.rfile.read(length)
+            target = (self.headers.get("Host") or "").rsplit(":", 1)[0]
+            profile = fake.profile_for(target)
+            with fake.lock:
+                fake.stats["requests"] += 1
+
+            if not self.authorized(profile):
+                with fake.lock:
+                    fake.stats["auth_failures"] += 1
+                self.reply(401, b"", {"WWW-Authenticate": 'Basic realm="WSMAN"'})
+                return
+
+            if profile.latency:
+                time.sleep(profile.latency)
+
+            root = ET.fromstring(payload)
+            header = root.find("s:Header", NAMESPACES)
+            body = root.find("s:Body", NAMESPACES)
+            action = header.find("wsa:Action", NAMESPACES).text
+            message_id = header.find("wsa:MessageID", NAMESPACES).text
+            if action == WSManAction.CREATE and profile.hang_seconds:
+                time.sleep(profile.hang_seconds)
+
+            try:
+                response = envelope(action, message_id, fake.handle(target, action, header, body))
+                self.reply(200, response)
+            except OperationTimedOut:
+                self.reply(500, fault(message_id, "The operation did not complete within OperationTimeout",
+                                      OPERATION_TIMED_OUT))
+            except Exception as exc:
+                self.reply(500, fault(message_id, f"{type(exc).__name__}: {exc}"))
+
+        def authorized(self, profile: HostProfile) -> bool:
+            if profile.auth_fail:
+                return False
+            if profile.password is None:
+                return True
+            scheme, _, encoded = (self.headers.get("Authorization") or "").partition(" ")
+            if scheme.lower() != "basic":
+                return False
+            _, _, password = base64.b64decode(encoded).decode("utf-8").partition(":")
+            return password == profile.password
+
+        def reply(self, status: int, body: bytes, headers: Optional[dict] = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/soap+xml;charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return WSManHandler
+
+
+def start_fake_winrm(fake: FakeWinRM, host: str = "0.0.0.0", port: int = 5985, certfile: Optional[str] = None,
+                     keyfile: Optional[str] = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, name="fake-winrm", daemon=True).start()
+    return server
+
+
+def load_profiles(path: Optional[str]) -> dict[str, HostProfile]:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as handle:
+        raw = json.load(handle)
+    known = {f.name for f in fields(HostProfile)}
+    return {target: HostProfile(**{k: v for k, v in spec.items() if k in known}) for target, spec in raw.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5985)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every WS-Man message")
+    parser.add_argument("--script-latency", type=float, default=0.0, help="seconds added once per pipeline")
+    parser.add_argument("--profiles", help="JSON file of per-target HostProfile overrides")
+    parser.add_argument("--certfile", help="serve HTTPS (WinRM over 5986) with this certificate")
+    parser.add_argument("--keyfile", help="private key for --certfile, if not in the same file")
+    args = parser.parse_args()
+
+    fake = FakeWinRM(HostProfile(latency=args.latency, script_latency=args.script_latency), load_profiles(args.profiles))
+    server = start_fake_winrm(fake, args.host, args.port, args.certfile, args.keyfile)
+    print(f"Fake WinRM listening on {'https' if args.certfile else 'http'}://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(fake.stats))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
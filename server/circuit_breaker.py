@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+# Only failures that say "the host/WinRM is not there" trip the breaker.
+# Credential errors mean the host answered, so they close it instead.
+TRIP_ERROR_CODES = ("SERVER_UNREACHABLE", "WINRM_PORT_CLOSED", "WINRM_NOT_CONFIGURED")
+# Running out of the request deadline says nothing either way about the host:
+# the circuit is left as it was and a half-open probe is given back.
+NEUTRAL_ERROR_CODES = ("TIMEOUT",)
+
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.environ.get("CIRCUIT_MAX_OPEN_SECONDS", "300"))
+# A half-open probe that never reports back frees the slot after this long.
+CIRCUIT_PROBE_TIMEOUT_SECONDS = float(os.environ.get("CIRCUIT_PROBE_TIMEOUT_SECONDS", "60"))
+CIRCUIT_MAX_TRACKED = int(os.environ.get("CIRCUIT_MAX_TRACKED", "10000"))
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, error_info: dict[str, Any]):
+        super().__init__(error_info.get("error", "Circuit open"))
+        self.error_info = error_info
+
+    @property
+    def retry_after(self) -> int:
+        return self.error_info["retry_after"]
+
+
+@dataclass
+class Circuit:
+    error_info: dict[str, Any]
+    failures: int = 0
+    opened_until: float = 0.0
+    probe_started: Optional[float] = None
+    updated_at: float = field(default_factory=time.monotonic)
+
+
+class CircuitBreaker:
+    """
+    Per-target negative cache with half-open probing.
+
+    After a tripping failure the target is "open" for CIRCUIT_OPEN_SECONDS
+    (doubling on consecutive failures up to CIRCUIT_MAX_OPEN_SECONDS) and every
+    call fails fast with the cached error. Once the window passes, exactly one
+    caller is let through as a probe; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, open_seconds: float = CIRCUIT_OPEN_SECONDS, max_open_seconds: float = CIRCUIT_MAX_OPEN_SECONDS,
+                 probe_timeout: float = CIRCUIT_PROBE_TIMEOUT_SECONDS, max_tracked: int = CIRCUIT_MAX_TRACKED):
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_timeout = probe_timeout
+        self.max_tracked = max_tracked
+        self._circuits: dict[str, Circuit] = {}
+        self._lock = threading.Lock()
+
+    def check(self, target: str) -> Optional[dict[str, Any]]:
+        """
+        Return the cached error payload (with retry_after) if calls to target
+        should fail fast, or None if the caller may proceed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if circuit is None:
+                return None
+            if now < circuit.opened_until:
+                return self._fast_fail(circuit, circuit.opened_until - now)
+            if circuit.probe_started is not None and now - circuit.probe_started < self.probe_timeout:
+                # Another request is already probing this target.
+                return self._fast_fail(circuit, 1)
+            circuit.probe_started = now
+            return None
+
+    def is_open(self, target: str) -> bool:
+        """
+        Whether target is inside its open window. Unlike check(), never claims the half-open probe.
+        """
+        with self._lock:
+            circuit = self._circuits.get(target)
+            return circuit is not None and time.monotonic() < circuit.opened_until
+
+    def guard(self, target: str) -> None:
+        error_info = self.check(target)
+        if error_info is not None:
+            raise CircuitOpenError(error_info)
+
+    def release(self, target: str) -> None:
+        """
+        Give up a half-open probe claimed by check() without an outcome (the call
+        never reached the host), leaving the failure state as it is.
+        """
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if circuit is not None:
+                circuit.probe_started = None
+
+    def record(self, target: str, error_info: Optional[dict[str, Any]]) -> None:
+        """
+        Record an outcome for target: None for success, or a build_error_response()
+        payload for a failure.
+        """
+        if error_info is not None and error_info.get("error_code") in NEUTRAL_ERROR_CODES:
+            self.release(target)
+            return
+        if error_info is None or error_info.get("error_code") not in TRIP_ERROR_CODES:
+            with self._lock:
+                self._circuits.pop(target, None)
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if circuit is None:
+                if len(self._circuits) >= self.max_tracked:
+                    self._evict_closed(now)
+                circuit = self._circuits[target] = Circuit(error_info=error_info)
+            circuit.error_info = error_info
+            circuit.failures += 1
+            backoff = self.open_seconds * (2 ** min(circuit.failures - 1, 16))
+            circuit.opened_until = now + min(backoff, self.max_open_seconds)
+            circuit.probe_started = None
+            circuit.updated_at = now
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                target: {
+                    "error_code": circuit.error_info.get("error_code"),
+                    "failures": circuit.failures,
+                    "retry_after": max(0, math.ceil(circuit.opened_until - now)),
+                    "half_open": now >= circuit.opened_until,
+                }
+                for target, circuit in self._circuits.items()
+            }
+
+    @staticmethod
+    def _fast_fail(circuit: Circuit, remaining: float) -> dict[str, Any]:
+        return {
+            **circuit.error_info,
+            "circuit_open": True,
+            "retry_after": max(1, math.ceil(remaining)),
+        }
+
+    def _evict_closed(self, now: float) -> None:
+        # Caller holds the lock. Drop circuits whose window has long passed, oldest first.
+        stale = sorted(
+            (target for target, circuit in self._circuits.items() if now >= circuit.opened_until),
+            key=lambda target: self._circuits[target].updated_at,
+        )
+        for target in stale[: max(1, len(stale) // 2)]:
+            del self._circuits[target]
+
+
+CIRCUIT_BREAKER = CircuitBreaker()
@@ -0,0 +1,101 @@
+import math
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+# WinRM budget of a request that does not ask for one. Keep it (and the maximum)
+# under GUNICORN_TIMEOUT so a hung host ends in a TIMEOUT response, not a killed worker.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "25"))
+# Most a request may ask for with "deadline" (seconds) in its body.
+REQUEST_DEADLINE_MAX_SECONDS = float(os.environ.get("REQUEST_DEADLINE_MAX_SECONDS", "25"))
+
+TIMEOUT = "TIMEOUT"
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, phase: str, budget: float):
+        detail = f"The {budget:g}s deadline ran out during {phase}"
+        super().__init__(detail)
+        self.phase = phase
+        self.budget = budget
+        self.detail = detail
+        self.error_code = TIMEOUT
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, phase: str) -> float:
+        """
+        Seconds left, or DeadlineExceeded naming the phase that found none.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(phase, self.budget)
+        return remaining
+
+
+# Deadline of the request (or job, or batch item) being served; None means no budget.
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+def phase_timeout(phase: str, cap: float) -> float:
+    """
+    Timeout for one phase: cap, shortened to what is left of the current deadline.
+    """
+    deadline = current_deadline.get()
+    return cap if deadline is None else min(cap, deadline.check(phase))
+
+
+def remaining_budget(phase: str) -> Optional[float]:
+    """
+    Seconds left of the current deadline (None without one).
+    """
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline.check(phase)
+
+
+def check_deadline(phase: str) -> None:
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check(phase)
+
+
+def deadline_expired() -> bool:
+    deadline = current_deadline.get()
+    return deadline is not None and deadline.expired
+
+
+def requested_deadline(value: Any) -> float:
+    """
+    Budget for a request that asked for `value` seconds: the default when absent
+    or unusable, never more than REQUEST_DEADLINE_MAX_SECONDS.
+    """
+    try:
+        seconds = REQUEST_DEADLINE_SECONDS if value is None else float(value)
+    except (TypeError, ValueError):
+        seconds = REQUEST_DEADLINE_SECONDS
+    if not math.isfinite(seconds) or seconds <= 0:
+        seconds = REQUEST_DEADLINE_SECONDS
+    return min(seconds, REQUEST_DEADLINE_MAX_SECONDS)
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[Deadline]:
+    deadline = Deadline(seconds)
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
@@ -0,0 +1,232 @@
+import heapq
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from deadline import deadline_scope, requested_deadline
+from metrics import current_endpoint
+from winrm_diagnostics import classify_connection_error
+
+# Opt-in: tracking keeps each server's Administrator password in memory (see DriftScheduler).
+DRIFT_ENABLED = os.environ.get("DRIFT_ENABLED", "0") != "0"
+DRIFT_CHECK_INTERVAL_SECONDS = float(os.environ.get("DRIFT_CHECK_INTERVAL_SECONDS", "3600"))
+# Each check lands at interval * (1 +/- jitter) so servers configured together spread out.
+DRIFT_JITTER = float(os.environ.get("DRIFT_JITTER", "0.1"))
+DRIFT_MAX_WORKERS = int(os.environ.get("DRIFT_MAX_WORKERS", "8"))
+DRIFT_MAX_TRACKED = int(os.environ.get("DRIFT_MAX_TRACKED", "10000"))
+DRIFT_BACKOFF_SECONDS = float(os.environ.get("DRIFT_BACKOFF_SECONDS", "300"))
+DRIFT_MAX_BACKOFF_SECONDS = float(os.environ.get("DRIFT_MAX_BACKOFF_SECONDS", "21600"))
+# A server (and its password) is forgotten this long after it was configured.
+DRIFT_TRACK_TTL_SECONDS = float(os.environ.get("DRIFT_TRACK_TTL_SECONDS", "604800"))
+
+DRIFT_PENDING = "pending"
+DRIFT_OK = "ok"
+DRIFT_DRIFTED = "drifted"
+DRIFT_ERROR = "error"
+
+
+@dataclass
+class TrackedServer:
+    target: str
+    password: str
+    proxy: str
+    expected_public_ip: Optional[str] = None
+    expected_timezone: Optional[str] = None
+    status: str = DRIFT_PENDING
+    drift: list = field(default_factory=list)
+    observed: Optional[dict[str, Any]] = None
+    error_info: Optional[dict[str, Any]] = None
+    failures: int = 0
+    configured_at: float = field(default_factory=time.time)
+    expires_at: float = float("inf")
+    checked_at: Optional[float] = None
+    next_check: float = 0.0
+    in_flight: bool = False
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "serverIp": self.target,
+            "proxy": self.proxy,
+            "expected": {"public_ip": self.expected_public_ip, "timezone": self.expected_timezone},
+            "status": self.status,
+            "drift": list(self.drift),
+            "observed": self.observed,
+            "error": self.error_info,
+            "failures": self.failures,
+            "configuredAt": self.configured_at,
+            "expiresAt": self.expires_at,
+            "checkedAt": self.checked_at,
+            "nextCheckAt": self.next_check,
+        }
+
+
+class DriftScheduler:
+    """
+    Periodic re-verification of configured servers.
+
+    Every tracked server sits in a heap keyed by its next check time; a single
+    scheduler thread hands due servers, stalest first, to a pool of max_workers,
+    so checks trickle out at the pool's pace instead of all firing at once.
+    `verify(server)` returns {"drift": [...], "observed": {...}}; an exception
+    counts as a failure and backs the server off exponentially, with jitter, up
+    to max_backoff. Servers live in the worker process that configured them.
+
+    Checks log in again, so every tracked server keeps the password it was
+    configured with in memory until it is dropped: ttl seconds after it was
+    configured, when it is evicted past max_tracked, or when the process exits.
+    """
+
+    def __init__(self, verify: Optional[Callable[[TrackedServer], dict[str, Any]]] = None,
+                 interval: float = DRIFT_CHECK_INTERVAL_SECONDS, jitter: float = DRIFT_JITTER,
+                 max_workers: int = DRIFT_MAX_WORKERS, max_tracked: int = DRIFT_MAX_TRACKED,
+                 backoff: float = DRIFT_BACKOFF_SECONDS, max_backoff: float = DRIFT_MAX_BACKOFF_SECONDS,
+                 ttl: float = DRIFT_TRACK_TTL_SECONDS):
+        self.verify = verify
+        self.interval = interval
+        self.jitter = jitter
+        self.max_workers = max_workers
+        self.max_tracked = max_tracked
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ttl = ttl
+        self._servers: "OrderedDict[str, TrackedServer]" = OrderedDict()
+        self._heap: list = []
+        self._in_flight = 0
+        self._changed = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def track(self, target: str, password: str, proxy: str, expected_public_ip: Optional[str] = None,
+              expected_timezone: Optional[str] = None) -> None:
+        """
+        Start (or restart) tracking target with the state it was just configured to.
+        """
+        with self._changed:
+            self._servers.pop(target, None)
+            while len(self._servers) >= self.max_tracked:
+                self._servers.popitem(last=False)
+            server = TrackedServer(target, password, proxy, expected_public_ip, expected_timezone)
+            server.expires_at = server.configured_at + self.ttl
+            self._servers[target] = server
+            self._schedule(server, time.time() + self._jittered(self.interval))
+            self._ensure_started()
+
+    def get(self, target: str) -> Optional[dict[str, Any]]:
+        with self._changed:
+            server = self._servers.get(target)
+            return server.to_dict() if server is not None else None
+
+    def snapshot(self, status: Optional[str] = None) -> list:
+        with self._changed:
+            return [server.to_dict() for server in self._servers.values() if status in (None, server.status)]
+
+    def summary(self) -> dict[str, int]:
+        with self._changed:
+            counts = {DRIFT_PENDING: 0, DRIFT_OK: 0, DRIFT_DRIFTED: 0, DRIFT_ERROR: 0}
+            for server in self._servers.values():
+                counts[server.status] += 1
+            return {"tracked": len(self._servers), **counts}
+
+    def check_now(self, target: str) -> bool:
+        """
+        Move target to the front of the queue. False if it is not tracked.
+        """
+        with self._changed:
+            server = self._servers.get(target)
+            if server is None:
+                return False
+            if not server.in_flight:
+                self._schedule(server, time.time())
+            return True
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _schedule(self, server: TrackedServer, at: float) -> None:
+        # Caller holds the condition. Superseded heap entries are skipped when popped;
+        # one due at expires_at drops the server instead of checking it.
+        at = min(at, server.expires_at)
+        server.next_check = at
+        heapq.heappush(self._heap, (at, server.target))
+        self._changed.notify_all()
+
+    def _ensure_started(self) -> None:
+        # Caller holds the condition.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="drift")
+            threading.Thread(target=self._dispatch_loop, name="drift-scheduler", daemon=True).start()
+
+    def _pop_due(self, now: float) -> Optional[TrackedServer]:
+        # Caller holds the condition.
+        while self._heap and self._heap[0][0] <= now:
+            due, target = heapq.heappop(self._heap)
+            server = self._servers.get(target)
+            if server is None or server.in_flight or server.next_check != due:
+                continue
+            if now >= server.expires_at:
+                del self._servers[target]
+                continue
+            return server
+        return None
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._changed:
+                while True:
+                    now = time.time()
+                    server = self._pop_due(now) if self._in_flight < self.max_workers else None
+                    if server is not None:
+                        break
+                    timeout = None
+                    if self._heap and self._in_flight < self.max_workers:
+                        timeout = self._heap[0][0] - now
+                    self._changed.wait(timeout)
+                server.in_flight = True
+                self._in_flight += 1
+            try:
+                self._executor.submit(self._check, server)
+            except RuntimeError:
+                # Interpreter shutdown: the executor no longer takes work
+                return
+
+    def _check(self, server: TrackedServer) -> None:
+        current_endpoint.set("drift")
+        error_info = None
+        try:
+            # No request deadline here: bound the check by the default one, or a hung
+            # host would hold this worker (and its pooled session) indefinitely
+            with deadline_scope(requested_deadline(None)):
+                outcome = self.verify(server)
+        except Exception as exc:
+            outcome = None
+            error_info = classify_connection_error(exc, server.target)
+
+        with self._changed:
+            server.in_flight = False
+            self._in_flight -= 1
+            server.checked_at = time.time()
+            if outcome is None:
+                server.status = DRIFT_ERROR
+                server.error_info = error_info
+                server.failures += 1
+                # Full jitter over an exponentially growing window
+                window = min(self.max_backoff, self.backoff * (2 ** min(server.failures - 1, 16)))
+                delay = random.uniform(window / 2, window)
+            else:
+                server.drift = outcome["drift"]
+                server.observed = outcome["observed"]
+                server.status = DRIFT_DRIFTED if server.drift else DRIFT_OK
+                server.error_info = None
+                server.failures = 0
+                delay = self._jittered(self.interval)
+            if self._servers.get(server.target) is server:
+                self._schedule(server, server.checked_at + delay)
+            else:
+                self._changed.notify_all()
+
+
+DRIFT_SCHEDULER = DriftScheduler()
@@ -1,5 +1,6 @@
 # PowerShell script to check RDP license status, extend using slmgr and restart RDP service
 # This script checks remaining license days, re-arms if expired, and restarts Remote Desktop services
+# Progress is reported with Write-Host (streamed by POST /api/extend-rdp); the last output line is the result as JSON
 
 Write-Host "Starting RDP license management process..." -ForegroundColor Cyan
 
@@ -32,12 +33,14 @@ try {
         
         # Step 2: Re-arm the Windows license using slmgr
         Write-Host "`nStep 2: Re-arming Windows license..." -ForegroundColor Yellow
-        $rearmResult = Start-Process -FilePath "slmgr.vbs" -ArgumentList "/rearm" -NoNewWindow -Wait -PassThru
+        # cscript, not wscript: a wscript message box never returns in a non-interactive WinRM session
+        $rearmOutput = cscript //nologo C:\Windows\System32\slmgr.vbs /rearm 2>&1 | Out-String
+        $rearmExitCode = $LASTEXITCODE
         
-        if ($rearmResult.ExitCode -eq 0) {
+        if ($rearmExitCode -eq 0) {
             Write-Host "License re-armed successfully" -ForegroundColor Green
         } else {
-            Write-Host "License re-arm completed with exit code: $($rearmResult.ExitCode)" -ForegroundColor Yellow
+            Write-Host "License re-arm completed with exit code: $($rearmExitCode) $($rearmOutput.Trim())" -ForegroundColor Yellow
         }
         
         # Step 3: Stop Remote Desktop Services
@@ -92,7 +95,7 @@ try {
         $result = @{
             Status = "Success"
             Message = "RDP license re-armed and service restarted successfully"
-            ServiceStatus = $service.Status
+            ServiceStatus = "$($service.Status)"
             PreviousRemainingDays = $remainingDays
             Action = "Rearm executed"
             Timestamp = Get-Date -Format "yyyy-MM-dd HH:mm:ss"
@@ -130,7 +133,7 @@ try {
         Write-Host "========================================" -ForegroundColor Green
     }
     
-    return $result
+    return ($result | ConvertTo-Json -Compress)
     
 } catch {
     Write-Host "`nError occurred during RDP management: $($_.Exception.Message)" -ForegroundColor Red
@@ -142,6 +145,6 @@ try {
         Timestamp = Get-Date -Format "yyyy-MM-dd HH:mm:ss"
     }
     
-    return $result
+    return ($result | ConvertTo-Json -Compress)
 }
 
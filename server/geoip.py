@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Optional
+
+try:
+    import maxminddb
+except ImportError:  # Optional: local geo lookups are disabled without it
+    maxminddb = None
+
+logger = logging.getLogger(__name__)
+
+# MaxMind-format databases, e.g. GeoLite2-City.mmdb (country + timezone) and
+# GeoLite2-ASN.mmdb (org). Either may be omitted; missing fields come back None.
+GEOIP_CITY_DB = os.environ.get("GEOIP_CITY_DB")
+GEOIP_ASN_DB = os.environ.get("GEOIP_ASN_DB")
+GEOIP_CACHE_SIZE = int(os.environ.get("GEOIP_CACHE_SIZE", "4096"))
+
+
+class GeoIPResolver:
+    """
+    Resolves org/country/timezone for a public IP from memory-mapped MMDB files.
+
+    Readers are opened on first use (so each gunicorn worker maps the files after
+    fork) and kept for the life of the process; results are LRU-cached per IP.
+    """
+
+    def __init__(self, city_path: Optional[str] = GEOIP_CITY_DB, asn_path: Optional[str] = GEOIP_ASN_DB,
+                 cache_size: int = GEOIP_CACHE_SIZE):
+        self.city_path = city_path
+        self.asn_path = asn_path
+        self._city = None
+        self._asn = None
+        self._opened = False
+        self._lock = threading.Lock()
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @property
+    def configured(self) -> bool:
+        return maxminddb is not None and bool(self.city_path)
+
+    @property
+    def available(self) -> bool:
+        self._open()
+        return self._city is not None
+
+    def _open(self) -> None:
+        if self._opened:
+            return
+        with self._lock:
+            if self._opened:
+                return
+            if self.configured:
+                self._city = self._open_reader(self.city_path)
+                if self.asn_path:
+                    self._asn = self._open_reader(self.asn_path)
+            self._opened = True
+
+    @staticmethod
+    def _open_reader(path: str):
+        try:
+            return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not open GeoIP database %s: %s", path, exc)
+            return None
+
+    def _lookup(self, ip: str) -> Optional[dict[str, Any]]:
+        """
+        Return {"ip", "org", "country", "timezone"} shaped like ipinfo.io's
+        response, or None if the IP is not in the city database.
+        """
+        if not self.available:
+            return None
+        try:
+            city = self._city.get(ip)
+            asn = self._asn.get(ip) if self._asn is not None else None
+        except ValueError:
+            return None
+        if not city:
+            return None
+
+        org = None
+        if asn and asn.get("autonomous_system_number"):
+            org = f"AS{asn['autonomous_system_number']} {asn.get('autonomous_system_organization', '')}".strip()
+        return {
+            "ip": ip,
+            "org": org,
+            "country": (city.get("country") or city.get("registered_country") or {}).get("iso_code"),
+            "timezone": (city.get("location") or {}).get("time_zone"),
+        }
+
+
+GEOIP_RESOLVER = GeoIPResolver()
@@ -0,0 +1,61 @@
+# Gunicorn settings for the DashRDP Proxy Configurator API.
+#
+# WinRM work is network-bound and long-running, so requests are served by a
+# threaded worker: a slow target ties up one thread, not a whole process, and the
+# worker keeps heart-beating to the arbiter while requests are in flight. Several
+# worker processes keep one stuck process from taking the API down; async jobs
+# run in the worker that accepted them and are shared with the others through
+# JOB_STATE_PATH. WinRM concurrency for async jobs and batches is sized
+# separately (JOB_MAX_WORKERS, BATCH_MAX_WORKERS).
+#
+# SERVER_MODE=asgi serves asgi.py on uvicorn workers instead: the event loop holds
+# the connections and WinRM work runs on an I/O executor (ASGI_WINRM_THREADS), so
+# one process can hold hundreds of sessions in flight.
+import os
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "wsgi")
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+if SERVER_MODE == "asgi":
+    wsgi_app = "asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "app:app"
+    worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+# Keep above REQUEST_DEADLINE_MAX_SECONDS (deadline.py) so slow hosts get a TIMEOUT answer, not a killed worker
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+keepalive = 2
+# No max_requests: each worker runs its jobs and holds its circuit breaker, pooled
+# WinRM sessions and drift tracking in memory, and recycling it would drop them.
+preload_app = True
+
+# Prometheus multiprocess collection: each worker writes its samples under this
+# directory and /metrics sums them. It has to be set before the app (and with it
+# prometheus_client) is imported, and is wiped on start so counters from a
+# previous run do not leak in.
+prometheus_multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/dashrdp-prometheus")
+os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+for name in os.listdir(prometheus_multiproc_dir):
+    os.remove(os.path.join(prometheus_multiproc_dir, name))
+
+
+def post_fork(server, worker):
+    from log_pipeline import LOG_PIPELINE
+    from metrics import WORKER_THREADS
+
+    # The log listener thread started under preload_app stayed in the arbiter
+    LOG_PIPELINE.start()
+    if SERVER_MODE == "asgi":
+        from asgi import ASGI_WINRM_THREADS
+
+        WORKER_THREADS.set(ASGI_WINRM_THREADS)
+    else:
+        WORKER_THREADS.set(server.cfg.threads)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
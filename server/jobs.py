@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+JOB_MAX_WORKERS = int(os.environ.get("JOB_MAX_WORKERS", "16"))
+JOB_MAX_RETAINED = int(os.environ.get("JOB_MAX_RETAINED", "1000"))
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", "900"))
+# Shared by all worker processes, so a job can be polled through any of them ("" keeps jobs in memory only)
+JOB_STATE_PATH = os.environ.get(
+    "JOB_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "jobs.db")
+)
+# How often a worker re-reads a job another worker is running
+JOB_POLL_SECONDS = 0.25
+PRUNE_INTERVAL_SECONDS = 60
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    target TEXT,
+    status TEXT NOT NULL,
+    events TEXT NOT NULL,
+    response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated_at);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class JobStoreFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    target: Optional[str] = None
+    status: str = JOB_QUEUED
+    events: list = field(default_factory=list)
+    response: Optional[dict[str, Any]] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def phase(self) -> Optional[str]:
+        return self.events[-1]["phase"] if self.events else None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "status": self.status,
+            "phase": self.phase,
+            "phases": list(self.events),
+            "createdAt": self.created_at,
+            "updatedAt": self.updated_at,
+            "response": self.response,
+        }
+
+
+class JobStore:
+    """
+    Job registry backed by a bounded executor.
+
+    Finished jobs are kept for JOB_RETENTION_SECONDS and at most JOB_MAX_RETAINED
+    jobs are held at once; the oldest finished jobs are evicted first. A job runs
+    in the worker process that accepted it, which also writes every state change
+    to SQLite at path (WAL mode). Other workers read jobs they do not own from
+    there, so polling and the SSE stream work whichever worker serves them.
+    """
+
+    def __init__(self, max_workers: int = JOB_MAX_WORKERS, max_retained: int = JOB_MAX_RETAINED,
+                 retention_seconds: float = JOB_RETENTION_SECONDS, path: str = JOB_STATE_PATH):
+        self.max_workers = max_workers
+        self.max_retained = max_retained
+        self.retention_seconds = retention_seconds
+        self.path = path
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._changed = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._last_prune = 0.0
+
+    def submit(self, kind: str, fn: Callable[[Callable[[str], None]], dict[str, Any]],
+               target: Optional[str] = None) -> Job:
+        """
+        Queue fn(report_phase) for background execution. fn returns the final
+        response payload; its "success" key decides the job's end state.
+        """
+        job = Job(id=uuid.uuid4().hex, kind=kind, target=target)
+        with self._changed:
+            self._evict(time.time())
+            if len(self._jobs) >= self.max_retained:
+                raise JobStoreFull(f"{len(self._jobs)} jobs are still running or retained")
+            self._jobs[job.id] = job
+            self._record(job, JOB_QUEUED)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+            executor = self._executor
+
+        # Carry the submitting request's context (e.g. its metrics endpoint label) into the job
+        executor.submit(copy_context().run, self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._changed:
+            self._evict(time.time())
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+            row = self._load(job_id)
+        if row is None:
+            return None
+        job = Job(id=row["id"], kind=row["kind"], target=row["target"])
+        self._refresh(job, row)
+        return job
+
+    def wait_for_events(self, job: Job, seen: int, timeout: float) -> list:
+        """
+        Block until job has more than `seen` events or timeout expires,
+        then return the unseen events.
+        """
+        with self._changed:
+            if self._jobs.get(job.id) is job:
+                self._changed.wait_for(lambda: len(job.events) > seen, timeout=timeout)
+                return list(job.events[seen:])
+
+        # Running in another worker: re-read it until it moves on
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._changed:
+                row = self._load(job.id)
+            if row is not None:
+                self._refresh(job, row)
+            remaining = deadline - time.monotonic()
+            if len(job.events) > seen or row is None or remaining <= 0:
+                return list(job.events[seen:])
+            time.sleep(min(JOB_POLL_SECONDS, remaining))
+
+    def _run(self, job: Job, fn: Callable[[Callable[[str], None]], dict[str, Any]]) -> None:
+        self._update(job, JOB_RUNNING, JOB_RUNNING)
+        try:
+            response = fn(lambda phase: self._update(job, JOB_RUNNING, phase))
+        except Exception as exc:
+            response = {"success": False, "error": str(exc)}
+        status = JOB_SUCCEEDED if response.get("success") else JOB_FAILED
+        self._update(job, status, status, response)
+
+    def _update(self, job: Job, status: str, phase: str, response: Optional[dict[str, Any]] = None) -> None:
+        with self._changed:
+            job.status = status
+            if response is not None:
+                job.response = response
+            self._record(job, phase)
+
+    def _record(self, job: Job, phase: str) -> None:
+        # Caller holds the condition.
+        job.updated_at = time.time()
+        job.events.append({"phase": phase, "status": job.status, "at": job.updated_at})
+        self._save(job)
+        self._changed.notify_all()
+
+    def _evict(self, now: float) -> None:
+        # Caller holds the condition. Jobs are kept in submission order.
+        for job_id, job in list(self._jobs.items()):
+            expired = job.finished and now - job.updated_at > self.retention_seconds
+            overflow = job.finished and len(self._jobs) >= self.max_retained
+            if expired or overflow:
+                del self._jobs[job_id]
+                self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        # Finished jobs of other (or since restarted) workers
+        if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        self._execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                      (*FINISHED_STATES, now - self.retention_seconds))
+
+    @staticmethod
+    def _refresh(job: Job, row: sqlite3.Row) -> None:
+        job.status = row["status"]
+        job.events = json.loads(row["events"])
+        job.response = json.loads(row["response"]) if row["response"] is not None else None
+        job.created_at = row["created_at"]
+        job.updated_at = row["updated_at"]
+
+    def _save(self, job: Job) -> None:
+        # Caller holds the condition.
+        self._execute(
+            "INSERT OR REPLACE INTO jobs (id, kind, target, status, events, response, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.kind, job.target, job.status, json.dumps(job.events),
+             json.dumps(job.response, default=str) if job.response is not None else None,
+             job.created_at, job.updated_at),
+        )
+
+    def _load(self, job_id: str) -> Optional[sqlite3.Row]:
+        # Caller holds the condition.
+        cursor = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return cursor.fetchone() if cursor is not None else None
+
+    def _execute(self, sql: str, params: tuple) -> Optional[sqlite3.Cursor]:
+        # Caller holds the condition. A failing state file only costs other workers
+        # their view of the job; the worker running it keeps it in memory.
+        if not self.path:
+            return None
+        try:
+            with self._connect() as connection:
+                return connection.execute(sql, params)
+        except sqlite3.Error as exc:
+            logger.error("Job state update failed: %s", exc)
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened again in a forked worker: a SQLite connection must not cross fork()
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+
+JOB_STORE = JobStore()
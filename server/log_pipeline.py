@@ -0,0 +1,180 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+from metrics import LOG_RECORDS_DROPPED, current_endpoint
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text" for the plain format when reading logs by hand.
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Fraction of requests whose DEBUG/INFO records are kept, per Flask endpoint, e.g.
+# "execute_script=0.1,preflight_check=0.25". Warnings and errors are always kept.
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+LOG_SAMPLE_DEFAULT = float(os.environ.get("LOG_SAMPLE_DEFAULT", "1"))
+
+REDACTED = "[redacted]"
+SECRET_KEYS = ("password", "passwd", "secret", "token", "authorization", "cookie", "apikey", "api_key")
+# key=value, key: value, "key": "value" and 'key': 'value' inside free-form messages
+SECRET_PATTERN = re.compile(
+    r"(?i)\b(password|passwd|secret|token|authorization|cookie|api_?key)([\"']?\s*[:=]\s*)"
+    r"(\"[^\"]*\"|'[^']*'|[^\"'\s,;&}]+)"
+)
+
+# Attributes every LogRecord has; anything else on a record came in via extra=.
+RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "endpoint"}
+
+# Whether the current request's DEBUG/INFO records are kept; copied into executor
+# threads with the rest of the request context.
+log_sampled: ContextVar[bool] = ContextVar("log_sampled", default=True)
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    rates = {}
+    for entry in spec.split(","):
+        endpoint, _, rate = entry.partition("=")
+        if endpoint.strip() and rate.strip():
+            rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def begin_request_logging(endpoint: str) -> None:
+    """
+    Decide once per request whether its success-path records are kept, so a
+    sampled request keeps all of its lines rather than a random subset.
+    """
+    rate = SAMPLE_RATES.get(endpoint, LOG_SAMPLE_DEFAULT)
+    log_sampled.set(rate >= 1 or random.random() < rate)
+
+
+def is_secret_key(key: Any) -> bool:
+    lowered = str(key).lower()
+    return any(secret in lowered for secret in SECRET_KEYS)
+
+
+def redact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: REDACTED if is_secret_key(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return SECRET_PATTERN.sub(lambda match: f"{match.group(1)}{match.group(2)}{REDACTED}", value)
+    return value
+
+
+def record_extras(record: logging.LogRecord) -> dict[str, Any]:
+    return {
+        key: REDACTED if is_secret_key(key) else redact(value)
+        for key, value in vars(record).items()
+        if key not in RECORD_ATTRS and not key.startswith("_")
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "endpoint": getattr(record, "endpoint", None),
+            "msg": redact(record.getMessage()),
+            **record_extras(record),
+        }
+        if record.exc_info:
+            entry["exc"] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = redact(super().format(record))
+        extras = record_extras(record)
+        if extras:
+            line = f"{line} {json.dumps(extras, default=str)}"
+        return line
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Runs on the calling thread, before the record is queued: tags it with the
+    current endpoint and drops DEBUG/INFO records of requests that were not sampled.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not log_sampled.get():
+            LOG_RECORDS_DROPPED.labels("sampled").inc()
+            return False
+        record.endpoint = current_endpoint.get()
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread unformatted (QueueHandler.prepare would
+    build the message on the calling thread) and drops them when the queue is full
+    instead of blocking the request.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+
+class LogPipeline:
+    """
+    Root handler that queues records for a background listener thread, which
+    formats (JSON or text, with secrets redacted) and writes them to stderr.
+    """
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, log_format: str = LOG_FORMAT):
+        self.queue_size = queue_size
+        self.handler = LazyQueueHandler(queue.Queue(queue_size))
+        self.handler.addFilter(RequestContextFilter())
+        self.output = logging.StreamHandler()
+        if log_format == "text":
+            self.output.setFormatter(TextFormatter("%(levelname)s:%(name)s:%(message)s"))
+        else:
+            self.output.setFormatter(JsonFormatter())
+        self._listener = None
+
+    def start(self) -> None:
+        # Always on a fresh queue: after a fork the parent's listener thread is
+        # gone and the old queue's lock may have been held mid-put.
+        self.handler.queue = queue.Queue(self.queue_size)
+        self._listener = QueueListener(self.handler.queue, self.output)
+        self._listener.start()
+
+    def stop(self) -> None:
+        # Flushes whatever is still queued.
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+LOG_PIPELINE = LogPipeline()
+
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LOG_PIPELINE.handler)
+    root.setLevel(level)
+    LOG_PIPELINE.start()
+    atexit.register(LOG_PIPELINE.stop)
@@ -0,0 +1,150 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+from timings import record_span
+
+# Set (by gunicorn.conf.py) when running several worker processes: every process
+# writes its samples to files in this directory and /metrics aggregates them.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# WinRM phases range from a few ms (warm pool) to the 30s request timeout.
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+NO_ERROR = "none"
+
+# Flask endpoint name of the request being served; copied into executor threads
+# by the batch and job runners so their phases keep the originating endpoint.
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="none")
+
+PHASE_SECONDS = Histogram(
+    "dashrdp_phase_duration_seconds",
+    "Duration of one WinRM/probe phase",
+    ("phase", "endpoint", "error_code"),
+    buckets=PHASE_BUCKETS,
+)
+PHASES_IN_FLIGHT = Gauge(
+    "dashrdp_phases_in_flight",
+    "Phases currently running",
+    ("phase",),
+    multiprocess_mode="livesum",
+)
+REQUEST_SECONDS = Histogram(
+    "dashrdp_request_duration_seconds",
+    "HTTP request duration (for streamed responses, until the handler returns)",
+    ("endpoint", "status"),
+    buckets=PHASE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "dashrdp_requests_in_flight",
+    "HTTP requests currently being handled",
+    ("endpoint",),
+    multiprocess_mode="livesum",
+)
+# busy ratio = rate(dashrdp_worker_busy_seconds_total) / sum(dashrdp_worker_threads)
+WORKER_BUSY_SECONDS = Counter(
+    "dashrdp_worker_busy_seconds_total",
+    "Request-handling thread time spent across all workers",
+)
+WORKER_THREADS = Gauge(
+    "dashrdp_worker_threads",
+    "Request-handling threads available in live worker processes",
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAITING = Gauge(
+    "dashrdp_admission_waiting",
+    "Requests queued for a WinRM session slot",
+    multiprocess_mode="livesum",
+)
+ADMISSION_REJECTED = Counter(
+    "dashrdp_admission_rejected_total",
+    "Requests turned away with 429 by admission control",
+    ("error_code",),
+)
+LOG_RECORDS_DROPPED = Counter(
+    "dashrdp_log_records_dropped_total",
+    "Log records dropped by per-endpoint sampling or a full log queue",
+    ("reason",),
+)
+WINRM_TLS_HANDSHAKES = Counter(
+    "dashrdp_winrm_tls_handshakes_total",
+    "TLS handshakes with WinRM HTTPS listeners, full or resumed",
+    ("handshake",),
+)
+RESULTS_DROPPED = Counter(
+    "dashrdp_results_dropped_total",
+    "Execution results not persisted to the result store (queue full or write error)",
+    ("reason",),
+)
+PROXY_PROBES = Counter(
+    "dashrdp_proxy_probes_total",
+    "Proxy reachability checks by outcome, probed or answered from the cache",
+    ("outcome", "source"),
+)
+
+
+def observe_phase(phase: str, seconds: float, error_code: str = NO_ERROR) -> None:
+    PHASE_SECONDS.labels(phase, current_endpoint.get(), error_code).observe(seconds)
+    record_span(phase, seconds, None if error_code == NO_ERROR else error_code)
+
+
+def error_code_for(exc: BaseException) -> str:
+    # Imported here: winrm_diagnostics (via winrm_pool) imports this module.
+    from winrm_diagnostics import classify_connection_error
+
+    return classify_connection_error(exc)["error_code"]
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    """
+    Time the enclosed block as `phase`. Exceptions are labelled with the
+    error_code classify_connection_error assigns them and re-raised.
+    """
+    in_flight = PHASES_IN_FLIGHT.labels(phase)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as exc:
+        observe_phase(phase, time.perf_counter() - started, error_code_for(exc))
+        raise
+    else:
+        observe_phase(phase, time.perf_counter() - started)
+    finally:
+        in_flight.dec()
+
+
+def request_started(endpoint: str) -> float:
+    current_endpoint.set(endpoint)
+    REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+    return time.perf_counter()
+
+
+def request_finished(endpoint: str, started: float, status: int) -> None:
+    elapsed = time.perf_counter() - started
+    REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+    REQUEST_SECONDS.labels(endpoint, str(status)).observe(elapsed)
+    WORKER_BUSY_SECONDS.inc(elapsed)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,286 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from metrics import NO_ERROR, PROXY_PROBES, observe_phase
+from singleflight import SingleFlight
+
+# Off by default: the CONNECT comes from the API server, and proxies that only allow
+# the Windows host's IP may refuse it outright. Enable where the proxies accept both.
+PROXY_PROBE_ENABLED = os.environ.get("PROXY_PROBE_ENABLED", "0") != "0"
+# Budget for the TCP connect and again for the CONNECT answer.
+PROXY_PROBE_TIMEOUT_SECONDS = float(os.environ.get("PROXY_PROBE_TIMEOUT_SECONDS", "3"))
+# Tunnel requested through the proxy: the ipinfo.io lookup is the remote script's first request.
+PROXY_PROBE_CONNECT_TARGET = os.environ.get("PROXY_PROBE_CONNECT_TARGET", "ipinfo.io:443")
+PROXY_PROBE_TTL_SECONDS = float(os.environ.get("PROXY_PROBE_TTL_SECONDS", "60"))
+# Failures expire sooner so a proxy that comes back is noticed quickly.
+PROXY_PROBE_FAILURE_TTL_SECONDS = float(os.environ.get("PROXY_PROBE_FAILURE_TTL_SECONDS", "15"))
+PROXY_PROBE_CACHE_SIZE = int(os.environ.get("PROXY_PROBE_CACHE_SIZE", "10000"))
+PROXY_SCAN_CONCURRENCY = int(os.environ.get("PROXY_SCAN_CONCURRENCY", "200"))
+# Ranking compares latencies, so it only reuses probes this recent (e.g. one just
+# taken by the ASGI prefetch for the same request); older ones are re-measured.
+PROXY_RANK_MAX_AGE_SECONDS = float(os.environ.get("PROXY_RANK_MAX_AGE_SECONDS", "5"))
+
+PROXY_UNREACHABLE = "PROXY_UNREACHABLE"
+
+STATUS_LINE = re.compile(r"^HTTP/1\.[01] (\d{3})")
+# A hostname, IPv4 address or (bracket-stripped) IPv6 address
+PROXY_HOST = re.compile(r"^(?:[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*|[0-9A-Fa-f:.]+)$")
+
+
+class ProxyUnreachable(Exception):
+    def __init__(self, proxy: str, detail: str):
+        super().__init__(detail)
+        self.proxy = proxy
+        self.detail = detail
+        self.error_code = PROXY_UNREACHABLE
+
+
+def parse_proxy(proxy: str) -> tuple[str, int]:
+    """
+    "ip:port" (optionally with an http:// scheme, or [v6]:port) to (host, port).
+    """
+    address = proxy.strip()
+    if "://" in address:
+        address = address.split("://", 1)[1]
+    address = address.rstrip("/")
+    host, _, port = address.rpartition(":")
+    host = host.strip("[]")
+    if not PROXY_HOST.match(host) or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"Proxy address '{proxy}' is not in IP:Port form")
+    return host.lower(), int(port)
+
+
+def endpoint_key(proxy: str) -> str:
+    try:
+        host, port = parse_proxy(proxy)
+    except ValueError:
+        return proxy
+    return f"{host}:{port}"
+
+
+def elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def describe_connect_error(exc: BaseException, timeout: float) -> str:
+    if isinstance(exc, asyncio.TimeoutError):
+        return f"Connection timed out after {timeout}s"
+    if isinstance(exc, ConnectionRefusedError):
+        return "Connection refused"
+    lowered = str(exc).lower()
+    if "unreachable" in lowered or "no route" in lowered:
+        return "Proxy host is unreachable on the network"
+    return str(exc)
+
+
+async def probe_proxy_async(proxy: str, timeout: float = PROXY_PROBE_TIMEOUT_SECONDS,
+                            connect_target: str = PROXY_PROBE_CONNECT_TARGET) -> dict[str, Any]:
+    """
+    TCP-connect to the proxy, then ask it for a CONNECT tunnel to connect_target.
+
+    ok is False when the proxy cannot be reached, does not answer like an HTTP proxy
+    or cannot reach upstream (5xx). A 4xx answer still counts as ok: proxies often
+    allow only the Windows host's IP, so a denial sent to the API server says nothing
+    about the host. A value that is not ip:port (e.g. a per-protocol list like
+    "http=h:p;https=h:p") is not probed: it is ok with skipped set, and left to the host.
+    """
+    result: dict[str, Any] = {
+        "proxy": proxy,
+        "ok": False,
+        "skipped": False,
+        "reachable": False,
+        "connect_status": None,
+        "latency_ms": None,
+        "handshake_ms": None,
+        "message": None,
+        "checkedAt": time.time(),
+    }
+    started = time.perf_counter()
+    try:
+        host, port = parse_proxy(proxy)
+    except ValueError:
+        result.update(ok=True, skipped=True, message=f"Proxy value '{proxy}' is not in IP:Port form, probe skipped")
+        return finish(result, started)
+
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError) as exc:
+        result["message"] = describe_connect_error(exc, timeout)
+        return finish(result, started)
+    result["reachable"] = True
+    result["latency_ms"] = elapsed_ms(started)
+
+    handshake_started = time.perf_counter()
+    try:
+        writer.write(f"CONNECT {connect_target} HTTP/1.1\r\nHost: {connect_target}\r\n\r\n".encode("ascii"))
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+    except asyncio.TimeoutError:
+        result["message"] = f"No answer to CONNECT within {timeout}s"
+        return finish(result, started)
+    except OSError as exc:
+        result["message"] = f"Connection dropped during CONNECT: {exc}"
+        return finish(result, started)
+    finally:
+        writer.close()
+    result["handshake_ms"] = elapsed_ms(handshake_started)
+
+    match = STATUS_LINE.match(status_line.decode("latin1"))
+    if match is None:
+        result["message"] = ("Closed the connection without answering CONNECT" if not status_line
+                             else "Did not answer CONNECT as an HTTP proxy")
+        return finish(result, started)
+    status = int(match.group(1))
+    result["connect_status"] = status
+    if 200 <= status < 300:
+        result["ok"] = True
+        result["message"] = f"Tunnel to {connect_target} opened"
+    elif 400 <= status < 500:
+        result["ok"] = True
+        result["message"] = f"Proxy answered CONNECT with {status} (may only allow the server's IP)"
+    else:
+        result["message"] = f"Proxy answered CONNECT with {status}, it cannot reach {connect_target}"
+    return finish(result, started)
+
+
+def probe_outcome(result: dict[str, Any]) -> str:
+    if result["skipped"]:
+        return "skipped"
+    return "ok" if result["ok"] else "unreachable"
+
+
+def finish(result: dict[str, Any], started: float) -> dict[str, Any]:
+    if not result["ok"]:
+        result["error_code"] = PROXY_UNREACHABLE
+    observe_phase("proxy_probe", time.perf_counter() - started, result.get("error_code", NO_ERROR))
+    return result
+
+
+class ProxyProber:
+    """
+    Server-side proxy check run before a Windows host is touched, with results
+    cached per proxy endpoint: successes for ttl, failures for failure_ttl. A
+    batch reusing one proxy probes it once, and concurrent callers missing the
+    cache share one probe.
+    """
+
+    def __init__(self, timeout: float = PROXY_PROBE_TIMEOUT_SECONDS, connect_target: str = PROXY_PROBE_CONNECT_TARGET,
+                 ttl: float = PROXY_PROBE_TTL_SECONDS, failure_ttl: float = PROXY_PROBE_FAILURE_TTL_SECONDS,
+                 max_entries: int = PROXY_PROBE_CACHE_SIZE):
+        self.timeout = timeout
+        self.connect_target = connect_target
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self._results: "OrderedDict[str, tuple[float, dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight(replay_seconds=0)
+
+    def cached(self, proxy: str, max_age: Optional[float] = None) -> Optional[dict[str, Any]]:
+        """
+        The cached probe of proxy, or None if there is none (or, with max_age, none
+        taken within the last max_age seconds).
+        """
+        key = endpoint_key(proxy)
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if time.monotonic() >= expires_at:
+                del self._results[key]
+                return None
+            if max_age is not None and time.time() - result["checkedAt"] > max_age:
+                return None
+        PROXY_PROBES.labels(probe_outcome(result), "cache").inc()
+        return {**result, "proxy": proxy, "cached": True}
+
+    def probe(self, proxy: str, refresh: bool = False) -> dict[str, Any]:
+        if not refresh:
+            cached = self.cached(proxy)
+            if cached is not None:
+                return cached
+        result, _ = self._flights.do(
+            endpoint_key(proxy),
+            lambda: self._remember(asyncio.run(probe_proxy_async(proxy, self.timeout, self.connect_target))),
+        )
+        return {**result, "proxy": proxy, "cached": False}
+
+    async def probe_async(self, proxy: str, refresh: bool = False,
+                          max_age: Optional[float] = None) -> dict[str, Any]:
+        if not refresh:
+            cached = self.cached(proxy, max_age)
+            if cached is not None:
+                return cached
+        result = self._remember(await probe_proxy_async(proxy, self.timeout, self.connect_target))
+        return {**result, "proxy": proxy, "cached": False}
+
+    def guard(self, proxy: str) -> dict[str, Any]:
+        """
+        Probe (or reuse the cached probe of) proxy; raise ProxyUnreachable if it is not usable.
+        """
+        result = self.probe(proxy)
+        if not result["ok"]:
+            raise ProxyUnreachable(proxy, f"Proxy {proxy}: {result['message']}")
+        return result
+
+    async def scan_async(self, proxies: list, concurrency: int = PROXY_SCAN_CONCURRENCY,
+                         refresh: bool = False, max_age: Optional[float] = None) -> list:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def probe_one(proxy: str) -> dict[str, Any]:
+            async with semaphore:
+                return await self.probe_async(proxy, refresh, max_age)
+
+        return await asyncio.gather(*(probe_one(proxy) for proxy in proxies))
+
+    def scan(self, proxies: list, concurrency: int = PROXY_SCAN_CONCURRENCY, refresh: bool = False,
+             max_age: Optional[float] = None) -> list:
+        return asyncio.run(self.scan_async(proxies, concurrency, refresh, max_age))
+
+    def rank(self, proxies: list, max_age: float = PROXY_RANK_MAX_AGE_SECONDS) -> list:
+        """
+        Probe proxies concurrently and order them for selection: healthy ones by
+        connect + CONNECT latency (rtt_ms), then skipped ones (not ip:port, so
+        unmeasured), then the rest in the order given.
+        Cached probes older than max_age are taken again, so the order reflects
+        current latencies rather than ones up to the cache TTL old.
+        """
+        rows = self.scan(proxies, max_age=max_age)
+        for row in rows:
+            measured = row["ok"] and not row["skipped"]
+            row["rtt_ms"] = round(row["latency_ms"] + row["handshake_ms"], 1) if measured else None
+        ranked = sorted(rows, key=lambda row: (not row["ok"], row["skipped"], row["rtt_ms"] or 0.0))
+        for position, row in enumerate(ranked, 1):
+            row["rank"] = position
+        return ranked
+
+    def _remember(self, result: dict[str, Any]) -> dict[str, Any]:
+        PROXY_PROBES.labels(probe_outcome(result), "probe").inc()
+        ttl = self.ttl if result["ok"] else self.failure_ttl
+        key = endpoint_key(result["proxy"])
+        with self._lock:
+            self._results[key] = (time.monotonic() + ttl, result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+
+def proxy_check(result: dict[str, Any]) -> dict[str, Any]:
+    """
+    A probe result as an entry of the /api/configure checks list.
+    """
+    return {
+        "name": "proxy",
+        "label": f"Proxy {result['proxy']}",
+        "ok": result["ok"],
+        "message": result["message"],
+    }
+
+
+PROXY_PROBER = ProxyProber()
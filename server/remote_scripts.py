@@ -0,0 +1,330 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Mapping
+
+from timezones import COUNTRY_TO_WINDOWS_TIMEZONE, IANA_TO_WINDOWS_TIMEZONE
+
+IPINFO_URL = "https://ipinfo.io/json"
+# Plain-text "what is my IP" endpoint used when geo data is resolved locally.
+PUBLIC_IP_URL = os.environ.get("PUBLIC_IP_URL", "https://api.ipify.org")
+
+# Shipped as a file so it can also be run by hand on a host
+EXTEND_RDP_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extend_rdp.ps1")
+
+# Every script runs as a function of one script library, defined once per
+# runspace (see RunspacePoolCache) and then called with typed parameters:
+# a call ships only the function name and its arguments, and user input is
+# never spliced into script text. Helpers shared by the entry points below.
+PROXY_FUNCTIONS = r'''
+$global:dashProxySettingsPaths = @(
+    "HKLM:\Software\Microsoft\Windows\CurrentVersion\Internet Settings",
+    "HKCU:\Software\Microsoft\Windows\CurrentVersion\Internet Settings"
+)
+
+# Writes only the values that differ; returns whether anything was written.
+function global:Set-DashProxy {
+    param([string]$ProxyServer)
+    $changed = $false
+    foreach ($path in $dashProxySettingsPaths) {
+        $settings = Get-ItemProperty -Path $path -ErrorAction SilentlyContinue
+        if ($settings.ProxyEnable -ne 1) {
+            Set-ItemProperty -Path $path ProxyEnable -Value 1
+            $changed = $true
+        }
+        if ($settings.ProxyServer -ne $ProxyServer) {
+            Set-ItemProperty -Path $path ProxyServer -Value $ProxyServer
+            $changed = $true
+        }
+    }
+    return $changed
+}
+
+function global:Get-DashProxy {
+    foreach ($path in $dashProxySettingsPaths) {
+        $settings = Get-ItemProperty -Path $path -ErrorAction SilentlyContinue
+        [ordered]@{ path = $path; proxy_enable = $settings.ProxyEnable; proxy_server = $settings.ProxyServer }
+    }
+}
+'''
+
+# __IANA_MAP__ and __COUNTRY_MAP__ are replaced with PowerShell hashtables.
+TIMEZONE_FUNCTIONS = r'''
+$global:ianaMap = __IANA_MAP__
+$global:countryMap = __COUNTRY_MAP__
+
+# Resolve the target Windows zone, compare, set and verify. The decision tree
+# (and every sync_status string) mirrors run_stepwise_script in app.py. Step
+# durations (ms) are returned under "timings".
+function global:Sync-DashTimezone {
+    param([string]$IpinfoTimezone, [string]$Country, [string]$BrowserTimezone)
+    $sync = [ordered]@{
+        current = $null
+        target = $null
+        new = $null
+        changed = $false
+        sync_status = "Not attempted"
+        timings = [ordered]@{}
+    }
+    $sw = [Diagnostics.Stopwatch]::StartNew()
+    try {
+        $current = (Get-TimeZone).Id
+        $sync.current = $current
+        $sync.timings.get_timezone = $sw.Elapsed.TotalMilliseconds
+
+        $target = $null
+        if ($IpinfoTimezone) {
+            if ($ianaMap.ContainsKey($IpinfoTimezone)) {
+                $target = $ianaMap[$IpinfoTimezone]
+                $sync.sync_status = "Using ipinfo timezone: $IpinfoTimezone"
+            } elseif ($Country -and $countryMap.ContainsKey($Country)) {
+                $target = $countryMap[$Country]
+                $sync.sync_status = "ipinfo timezone not mapped, using country default: $Country"
+            } else {
+                $sync.sync_status = "Could not determine timezone from ipinfo ($IpinfoTimezone) or country ($Country)"
+            }
+        } elseif ($Country -and $countryMap.ContainsKey($Country)) {
+            $target = $countryMap[$Country]
+            $sync.sync_status = "ipinfo timezone not available, using country default: $Country"
+        } elseif ($BrowserTimezone) {
+            if ($ianaMap.ContainsKey($BrowserTimezone)) {
+                $target = $ianaMap[$BrowserTimezone]
+                $sync.sync_status = "Using browser timezone as fallback: $BrowserTimezone"
+            } else {
+                $sync.sync_status = "Could not determine timezone from any source"
+            }
+        } else {
+            $sync.sync_status = "Could not determine timezone (ipinfo unavailable, no browser timezone)"
+        }
+        $sync.target = $target
+
+        if ($target -and $current -ne $target) {
+            $sw.Restart()
+            Set-TimeZone -Id $target
+            $sync.timings.set_timezone = $sw.Elapsed.TotalMilliseconds
+            $sw.Restart()
+            $new = (Get-TimeZone).Id
+            $sync.timings.verify_timezone = $sw.Elapsed.TotalMilliseconds
+            $sync.new = $new
+            $sync.changed = ($new -eq $target)
+            if ($sync.changed) {
+                $sync.sync_status = "Timezone changed successfully"
+            } else {
+                $sync.sync_status = "Timezone change attempted (current: $new)"
+            }
+        } else {
+            $sync.new = $current
+            if ($current -eq $target) {
+                $sync.sync_status = "Timezone already correct"
+            } else {
+                $sync.sync_status = "Timezone change skipped (no target timezone)"
+            }
+        }
+    } catch {
+        $sync.sync_status = "Timezone sync error: $($_.Exception.Message)"
+    }
+    return $sync
+}
+'''
+
+# Sets the proxy, looks up geo data through it and syncs the timezone in a
+# single invocation.
+FUSED_EXECUTE_SCRIPT = r'''
+param(
+    [string]$ProxyServer,
+    [string]$TargetIp,
+    [string]$BrowserTimezone,
+    [int]$WebTimeoutSec = 15
+)
+$timings = [ordered]@{}
+$sw = [Diagnostics.Stopwatch]::StartNew()
+$proxyChanged = Set-DashProxy -ProxyServer $ProxyServer
+$timings.set_proxy = $sw.Elapsed.TotalMilliseconds
+
+$result = [ordered]@{
+    proxy_changed = $proxyChanged
+    ip = $null
+    org = $null
+    country = $null
+    ipinfo_timezone = $null
+    ipinfo_error = $null
+}
+
+$sw.Restart()
+try {
+    $response = Invoke-WebRequest -Uri "__IPINFO_URL__" -UseBasicParsing -TimeoutSec $WebTimeoutSec
+    $data = $response.Content | ConvertFrom-Json
+    $result.ip = $data.ip
+    $result.org = $data.org
+    $result.country = $data.country
+    if ($data.timezone) { $result.ipinfo_timezone = $data.timezone }
+} catch {
+    $result.ipinfo_error = $_.Exception.Message
+}
+$timings.ipinfo = $sw.Elapsed.TotalMilliseconds
+
+if ($result.ip -and $result.ip -ne $TargetIp) {
+    $sync = Sync-DashTimezone -IpinfoTimezone $result.ipinfo_timezone -Country $result.country -BrowserTimezone $BrowserTimezone
+    foreach ($key in $sync.Keys) {
+        if ($key -eq "timings") {
+            foreach ($step in $sync.timings.Keys) { $timings[$step] = $sync.timings[$step] }
+        } else {
+            $result[$key] = $sync[$key]
+        }
+    }
+}
+$result.timings = $timings
+
+$result | ConvertTo-Json -Compress
+'''
+
+# Sets the proxy and fetches only the bare public IP through it; geo data is
+# then resolved on the API server.
+PUBLIC_IP_SCRIPT = r'''
+param(
+    [string]$ProxyServer,
+    [string]$PublicIpUrl,
+    [int]$WebTimeoutSec = 15
+)
+$result = [ordered]@{ proxy_changed = $null; ip = $null; error = $null; timings = [ordered]@{} }
+$sw = [Diagnostics.Stopwatch]::StartNew()
+$result.proxy_changed = Set-DashProxy -ProxyServer $ProxyServer
+$result.timings.set_proxy = $sw.Elapsed.TotalMilliseconds
+
+$sw.Restart()
+try {
+    $response = Invoke-WebRequest -Uri $PublicIpUrl -UseBasicParsing -TimeoutSec $WebTimeoutSec
+    $result.ip = ([string]$response.Content).Trim()
+} catch {
+    $result.error = $_.Exception.Message
+}
+$result.timings.public_ip = $sw.Elapsed.TotalMilliseconds
+$result | ConvertTo-Json -Compress
+'''
+
+# Timezone resolve/compare/set/verify from geo data the caller already has.
+TIMEZONE_SYNC_SCRIPT = r'''
+param(
+    [string]$IpinfoTimezone,
+    [string]$Country,
+    [string]$BrowserTimezone
+)
+Sync-DashTimezone -IpinfoTimezone $IpinfoTimezone -Country $Country -BrowserTimezone $BrowserTimezone | ConvertTo-Json -Compress
+'''
+
+# Read-only: proxy registry values, the public IP seen through them and the
+# current timezone. Used by /api/verify and the drift checks.
+VERIFY_SCRIPT = r'''
+param([string]$PublicIpUrl, [int]$WebTimeoutSec = 15)
+$result = [ordered]@{
+    registry = @()
+    public_ip = $null
+    public_ip_error = $null
+    timezone = $null
+    timings = [ordered]@{}
+}
+$sw = [Diagnostics.Stopwatch]::StartNew()
+$result.registry = @(Get-DashProxy)
+$result.timings.read_registry = $sw.Elapsed.TotalMilliseconds
+
+$sw.Restart()
+try {
+    $response = Invoke-WebRequest -Uri $PublicIpUrl -UseBasicParsing -TimeoutSec $WebTimeoutSec
+    $result.public_ip = ([string]$response.Content).Trim()
+} catch {
+    $result.public_ip_error = $_.Exception.Message
+}
+$result.timings.public_ip = $sw.Elapsed.TotalMilliseconds
+
+$sw.Restart()
+$result.timezone = (Get-TimeZone).Id
+$result.timings.get_timezone = $sw.Elapsed.TotalMilliseconds
+$result | ConvertTo-Json -Compress -Depth 4
+'''
+
+# Step 1 of run_stepwise_script in app.py: set the proxy, then ipinfo's ip, org,
+# country and timezone as four lines.
+PROXY_IPINFO_SCRIPT = r'''
+param(
+    [string]$ProxyServer,
+    [int]$WebTimeoutSec = 15
+)
+$null = Set-DashProxy -ProxyServer $ProxyServer
+$response = Invoke-WebRequest -Uri "__IPINFO_URL__" -UseBasicParsing -TimeoutSec $WebTimeoutSec
+$data = $response.Content | ConvertFrom-Json
+$data.ip
+$data.org
+$data.country
+$data.timezone
+'''
+
+# Entry points of the library, called by name with add_cmd.
+FUSED = "Invoke-DashFused"
+PUBLIC_IP = "Invoke-DashPublicIp"
+TIMEZONE_SYNC = "Invoke-DashTimezoneSync"
+VERIFY = "Invoke-DashVerify"
+PROXY_IPINFO = "Invoke-DashProxyIpinfo"
+GET_TIMEZONE = "Get-DashTimezoneId"
+HOSTNAME = "Get-DashHostname"
+EXTEND_RDP = "Invoke-DashExtendRdp"
+
+
+def ps_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def ps_hashtable(mapping: Mapping[str, str]) -> str:
+    entries = "; ".join(f"{ps_string(key)} = {ps_string(value)}" for key, value in mapping.items())
+    return "@{" + entries + "}"
+
+
+def render_timezone_functions(iana_map: Mapping[str, str], country_map: Mapping[str, str]) -> str:
+    return (
+        TIMEZONE_FUNCTIONS
+        .replace("__IANA_MAP__", ps_hashtable(iana_map))
+        .replace("__COUNTRY_MAP__", ps_hashtable(country_map))
+    )
+
+
+def read_script(path: str) -> str:
+    with open(path, "r", encoding="utf-8-sig") as handle:
+        return handle.read()
+
+
+def define_function(name: str, body: str) -> str:
+    return f"function global:{name} {{\n{body.strip()}\n}}\n"
+
+
+@dataclass(frozen=True)
+class ScriptLibrary:
+    # Definitions of every function; run once on a runspace before calling them.
+    text: str
+    # Content hash: a runspace that defined an older library gets the new one.
+    version: str
+    functions: tuple
+
+
+def render_library(iana_map: Mapping[str, str], country_map: Mapping[str, str]) -> ScriptLibrary:
+    """
+    Render the library once, with the timezone tables embedded and extend_rdp.ps1
+    (kept as a file so it can also be run by hand) as one of its functions.
+    """
+    entry_points = {
+        FUSED: FUSED_EXECUTE_SCRIPT,
+        PUBLIC_IP: PUBLIC_IP_SCRIPT,
+        TIMEZONE_SYNC: TIMEZONE_SYNC_SCRIPT,
+        VERIFY: VERIFY_SCRIPT,
+        PROXY_IPINFO: PROXY_IPINFO_SCRIPT,
+        GET_TIMEZONE: "(Get-TimeZone).Id",
+        HOSTNAME: "$env:COMPUTERNAME",
+        EXTEND_RDP: read_script(EXTEND_RDP_SCRIPT_PATH),
+    }
+    text = PROXY_FUNCTIONS + render_timezone_functions(iana_map, country_map) + "".join(
+        define_function(name, body.replace("__IPINFO_URL__", IPINFO_URL)) for name, body in entry_points.items()
+    )
+    version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    text += f"$global:DashScriptLibraryVersion = '{version}'\n"
+    return ScriptLibrary(text=text, version=version, functions=tuple(entry_points))
+
+
+SCRIPT_LIBRARY = render_library(IANA_TO_WINDOWS_TIMEZONE, COUNTRY_TO_WINDOWS_TIMEZONE)
@@ -0,0 +1,211 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from metrics import RESULTS_DROPPED
+
+RESULT_STORE_ENABLED = os.environ.get("RESULT_STORE_ENABLED", "1") != "0"
+RESULT_STORE_PATH = os.environ.get(
+    "RESULT_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "results.db")
+)
+RESULT_STORE_QUEUE_SIZE = int(os.environ.get("RESULT_STORE_QUEUE_SIZE", "10000"))
+# Most rows written in one transaction; the writer commits whatever is queued as soon
+# as it wakes up, so batches only grow when results arrive faster than commits.
+RESULT_STORE_BATCH_SIZE = int(os.environ.get("RESULT_STORE_BATCH_SIZE", "500"))
+# Rows older than this are pruned by the writer (0 keeps everything).
+RESULT_STORE_RETENTION_DAYS = float(os.environ.get("RESULT_STORE_RETENTION_DAYS", "90"))
+PRUNE_INTERVAL_SECONDS = 3600
+
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 500
+
+# Kinds of outcome stored
+RESULT_EXECUTE = "execute"
+RESULT_PREFLIGHT = "preflight"
+RESULT_VERIFY = "verify"
+RESULT_EXTEND_RDP = "extend_rdp"
+RESULT_KINDS = (RESULT_EXECUTE, RESULT_PREFLIGHT, RESULT_VERIFY, RESULT_EXTEND_RDP)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    target_ip TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error_code TEXT,
+    recorded_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_target_time ON results (target_ip, recorded_at);
+CREATE INDEX IF NOT EXISTS results_target_kind_time ON results (target_ip, kind, recorded_at);
+CREATE INDEX IF NOT EXISTS results_time ON results (recorded_at);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def row_to_dict(row: sqlite3.Row) -> dict[str, Any]:
+    return {
+        "id": row["id"],
+        "serverIp": row["target_ip"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "errorCode": row["error_code"],
+        "recordedAt": row["recorded_at"],
+        "result": json.loads(row["payload"]),
+    }
+
+
+class ResultStore:
+    """
+    Execution history in SQLite (WAL mode), indexed by target and time.
+
+    record() only puts the row on a bounded queue; one writer thread per process
+    commits queued rows in batches, so requests never wait on the disk and a full
+    queue drops rows rather than blocking. Reads use a connection per thread and,
+    thanks to WAL, are not blocked by the writer (or by other worker processes
+    writing to the same file). A row becomes visible once its batch is committed,
+    normally within milliseconds of the request finishing.
+    """
+
+    def __init__(self, path: str = RESULT_STORE_PATH, queue_size: int = RESULT_STORE_QUEUE_SIZE,
+                 batch_size: int = RESULT_STORE_BATCH_SIZE, retention_days: float = RESULT_STORE_RETENTION_DAYS):
+        self.path = path
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self._queue: Optional[queue.Queue] = None
+        self._writer: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+        self._last_prune = 0.0
+
+    def record(self, kind: str, target: str, status: str, payload: dict[str, Any],
+               error_code: Optional[str] = None) -> None:
+        self._ensure_started()
+        row = (target, kind, status, error_code, time.time(), json.dumps(payload, default=str))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            RESULTS_DROPPED.labels("queue_full").inc()
+
+    def latest(self, target: str) -> dict[str, Optional[dict[str, Any]]]:
+        """
+        Most recent row of each kind for target (None for kinds never recorded).
+        """
+        connection = self._reader()
+        latest = {}
+        for kind in RESULT_KINDS:
+            row = connection.execute(
+                "SELECT * FROM results WHERE target_ip = ? AND kind = ? ORDER BY recorded_at DESC LIMIT 1",
+                (target, kind),
+            ).fetchone()
+            latest[kind] = row_to_dict(row) if row is not None else None
+        return latest
+
+    def history(self, target: str, kind: Optional[str] = None, since: Optional[float] = None,
+                until: Optional[float] = None, limit: int = HISTORY_DEFAULT_LIMIT) -> list:
+        """
+        Rows for target, newest first. since/until are epoch seconds (until exclusive,
+        so the last recordedAt of a page fetches the next one).
+        """
+        clauses = ["target_ip = ?"]
+        params: list = [target]
+        if kind is not None:
+            clauses.append("kind = ?")
+            params.append(kind)
+        if since is not None:
+            clauses.append("recorded_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("recorded_at < ?")
+            params.append(until)
+        params.append(max(1, min(limit, HISTORY_MAX_LIMIT)))
+        rows = self._reader().execute(
+            f"SELECT * FROM results WHERE {' AND '.join(clauses)} ORDER BY recorded_at DESC LIMIT ?", params
+        ).fetchall()
+        return [row_to_dict(row) for row in rows]
+
+    def flush(self, timeout: float = 5.0) -> None:
+        # Wait until everything queued so far is committed (or timeout).
+        if self._queue is None or self._pid != os.getpid():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def _ensure_started(self) -> None:
+        # Started on first use, and again in a forked worker: the writer thread
+        # does not survive gunicorn's preload fork.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._writer = threading.Thread(target=self._write_loop, args=(self._queue,), name="result-store",
+                                            daemon=True)
+            self._writer.start()
+            self._pid = os.getpid()
+            atexit.register(self.flush)
+
+    def _write_loop(self, rows: queue.Queue) -> None:
+        connection = self._connect()
+        while True:
+            batch = [rows.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(rows.get_nowait())
+                except queue.Empty:
+                    break
+            waiters = [item for item in batch if isinstance(item, threading.Event)]
+            batch = [item for item in batch if not isinstance(item, threading.Event)]
+            if batch:
+                self._write(connection, batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, connection: sqlite3.Connection, batch: list) -> None:
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO results (target_ip, kind, status, error_code, recorded_at, payload)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                now = time.time()
+                if self.retention_days > 0 and now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                    connection.execute("DELETE FROM results WHERE recorded_at < ?",
+                                       (now - self.retention_days * 86400,))
+                    self._last_prune = now
+        except sqlite3.Error as exc:
+            RESULTS_DROPPED.labels("write_error").inc(len(batch))
+            logger.error("Result store write of %d rows failed: %s", len(batch), exc)
+
+
+RESULT_STORE = ResultStore()
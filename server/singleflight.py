@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Optional
+
+# How long a finished result is replayed to identical requests (0 disables replay).
+SINGLEFLIGHT_REPLAY_SECONDS = float(os.environ.get("SINGLEFLIGHT_REPLAY_SECONDS", "5"))
+SINGLEFLIGHT_MAX_REPLAYS = int(os.environ.get("SINGLEFLIGHT_MAX_REPLAYS", "1000"))
+
+LEADER = "leader"
+SHARED = "shared"
+REPLAYED = "replayed"
+
+
+@dataclass
+class Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs fn,
+    later callers block until it finishes and get the same value (or exception).
+    Values accepted by `replayable` are also handed to identical calls that
+    arrive within replay_seconds after it finished.
+    """
+
+    def __init__(self, replay_seconds: float = SINGLEFLIGHT_REPLAY_SECONDS, max_replays: int = SINGLEFLIGHT_MAX_REPLAYS):
+        self.replay_seconds = replay_seconds
+        self.max_replays = max_replays
+        self._flights: dict[Hashable, Flight] = {}
+        self._recent: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any],
+           replayable: Callable[[Any], bool] = lambda value: True) -> tuple[Any, str]:
+        """
+        Return (value, outcome) where outcome is LEADER, SHARED or REPLAYED.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._pop_expired(now)
+            recent = self._recent.get(key)
+            if recent is not None:
+                return recent[1], REPLAYED
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, SHARED
+
+        try:
+            flight.value = fn()
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and self.replay_seconds > 0 and replayable(flight.value):
+                    self._recent[key] = (time.monotonic(), flight.value)
+                    self._recent.move_to_end(key)
+                    while len(self._recent) > self.max_replays:
+                        self._recent.popitem(last=False)
+            flight.done.set()
+        return flight.value, LEADER
+
+    def _pop_expired(self, now: float) -> None:
+        # Caller holds the lock. Entries are kept in finish order.
+        while self._recent:
+            finished_at, _ = next(iter(self._recent.values()))
+            if now - finished_at <= self.replay_seconds:
+                break
+            self._recent.popitem(last=False)
+
+
+SINGLE_FLIGHT = SingleFlight()
@@ -0,0 +1,57 @@
+import os
+import socket
+import sys
+import tempfile
+
+import pytest
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.join(SERVER_DIR, "bench"))
+
+# Read once at import by the modules under test: keep results and jobs out of state/,
+# and let every test see its own requests run rather than a replayed result
+STATE_DIR = tempfile.mkdtemp(prefix="dashrdp-tests-")
+os.environ.setdefault("RESULT_STORE_PATH", os.path.join(STATE_DIR, "results.db"))
+os.environ.setdefault("JOB_STATE_PATH", os.path.join(STATE_DIR, "jobs.db"))
+os.environ.setdefault("SINGLEFLIGHT_REPLAY_SECONDS", "0")
+
+from fake_winrm import FakeWinRM, start_fake_winrm  # noqa: E402
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def fake_host(monkeypatch):
+    """
+    A fake WinRM listener the API's WinRM code connects to instead of 5985, for
+    any 127.0.0.x target (profiles are picked per target). 5986 is a closed port.
+    """
+    import winrm_diagnostics
+    import winrm_pool
+    from circuit_breaker import CIRCUIT_BREAKER
+
+    fake = FakeWinRM()
+    server = start_fake_winrm(fake, "0.0.0.0", 0)
+    fake.port = server.server_address[1]
+    closed = unused_port()
+    for module in (winrm_pool, winrm_diagnostics):
+        monkeypatch.setattr(module, "WINRM_HTTP_PORT", fake.port)
+        monkeypatch.setattr(module, "WINRM_HTTPS_PORT", closed)
+    yield fake
+    winrm_pool.POOL_CACHE.close_all()
+    CIRCUIT_BREAKER._circuits.clear()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(fake_host):
+    from app import app
+
+    return app.test_client()
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from admission import SERVER_BUSY, TARGET_BUSY, AdmissionController, AdmissionRejected
+from deadline import TIMEOUT, DeadlineExceeded, deadline_scope
+
+
+def hold(controller, target, mutate=True):
+    """
+    Admit target on a background thread and keep the slot until the returned event is set.
+    """
+    admitted = threading.Event()
+    release = threading.Event()
+
+    def run():
+        with controller.admit(target, mutate):
+            admitted.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert admitted.wait(5)
+    return release, thread
+
+
+def test_one_mutating_session_per_target():
+    controller = AdmissionController(max_sessions=4, max_per_target=1, queue_timeout=0.1)
+    release, thread = hold(controller, "10.0.0.1")
+    try:
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit("10.0.0.1"):
+                pass
+        assert excinfo.value.error_code == TARGET_BUSY
+        assert excinfo.value.retry_after >= 1
+        with controller.admit("10.0.0.2"):
+            pass
+        with controller.admit("10.0.0.1", mutate=False):
+            pass
+    finally:
+        release.set()
+        thread.join(5)
+
+
+def test_global_cap_rejects_as_server_busy():
+    controller = AdmissionController(max_sessions=1, queue_timeout=0.1)
+    release, thread = hold(controller, "10.0.0.1")
+    try:
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit("10.0.0.2"):
+                pass
+        assert excinfo.value.error_code == SERVER_BUSY
+    finally:
+        release.set()
+        thread.join(5)
+
+
+def test_full_queue_rejects_without_waiting():
+    controller = AdmissionController(max_sessions=1, queue_size=0, queue_timeout=5)
+    release, thread = hold(controller, "10.0.0.1")
+    try:
+        started = time.monotonic()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit("10.0.0.2"):
+                pass
+        assert excinfo.value.error_code == SERVER_BUSY
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        thread.join(5)
+
+
+def test_waiter_gets_the_slot_when_it_frees():
+    controller = AdmissionController(max_sessions=1, queue_timeout=5)
+    release, thread = hold(controller, "10.0.0.1")
+    threading.Timer(0.1, release.set).start()
+    with controller.admit("10.0.0.2"):
+        assert controller._in_flight == 1
+    thread.join(5)
+    assert controller._in_flight == 0
+    assert controller._per_target == {}
+    assert controller._waiting == 0
+
+
+def test_slot_is_released_when_the_body_raises():
+    controller = AdmissionController(max_sessions=1)
+    with pytest.raises(RuntimeError):
+        with controller.admit("10.0.0.1"):
+            raise RuntimeError()
+    assert controller._in_flight == 0
+    assert controller._per_target == {}
+
+
+def test_queue_wait_never_outlasts_the_deadline():
+    controller = AdmissionController(max_sessions=1, queue_timeout=5)
+    release, thread = hold(controller, "10.0.0.1")
+    try:
+        started = time.monotonic()
+        with deadline_scope(0.2), pytest.raises(DeadlineExceeded) as excinfo:
+            with controller.admit("10.0.0.2"):
+                pass
+        assert excinfo.value.error_code == TIMEOUT
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        thread.join(5)
+
+
+def test_busy_target_gets_429_from_the_api(client, monkeypatch):
+    import app
+
+    controller = AdmissionController(max_sessions=4, max_per_target=1, queue_timeout=0.1)
+    monkeypatch.setattr(app, "ADMISSION", controller)
+    release, thread = hold(controller, "127.0.0.2")
+    try:
+        response = client.post("/api/execute-script", json={
+            "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": "198.51.100.7:3128",
+        })
+        assert response.status_code == 429
+        assert response.get_json()["error_code"] == TARGET_BUSY
+        assert int(response.headers["Retry-After"]) >= 1
+    finally:
+        release.set()
+        thread.join(5)
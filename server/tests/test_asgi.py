@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import asgi
+
+PROXY = "198.51.100.7:3128"
+
+
+def call(path, payload):
+    """
+    Run one POST through the ASGI app and return the messages it sent.
+    """
+    body = json.dumps(payload).encode()
+    scope = {"type": "http", "http_version": "1.1", "method": "POST", "path": path, "root_path": "",
+             "query_string": b"", "headers": [(b"content-type", b"application/json"),
+                                               (b"content-length", str(len(body)).encode())]}
+    incoming = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if incoming:
+            return incoming.pop()
+        await asyncio.Event().wait()  # the client stays connected
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent
+
+
+def test_ndjson_is_streamed_through_the_adapter(fake_host):
+    sent = call("/api/execute-batch", {"servers": [
+        {"serverIp": "127.0.0.2", "password": "x", "proxyIpPort": PROXY},
+        {"serverIp": "127.0.0.3", "password": "x", "proxyIpPort": PROXY},
+    ]})
+    start, *chunks = sent
+    assert start["type"] == "http.response.start" and start["status"] == 200
+    assert (b"content-type", b"application/x-ndjson") in [(name.lower(), value) for name, value in start["headers"]]
+    # One body message per record as it finishes, then the summary, then the end of the body
+    assert [chunk.get("more_body", False) for chunk in chunks] == [True, True, True, False]
+    records = [json.loads(chunk["body"]) for chunk in chunks[:-1]]
+    assert records[-1] == {"done": True, "total": 2, "succeeded": 2}
+    assert sorted(record["serverIp"] for record in records[:-1]) == ["127.0.0.2", "127.0.0.3"]
+
+
+def test_prefetched_port_probe_route(fake_host):
+    start, body, *_ = call("/api/preflight-check", {"serverIp": "127.0.0.2", "password": "x"})
+    assert start["status"] == 200
+    assert json.loads(body["body"])["success"] is True
@@ -0,0 +1,49 @@
+import json
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from bench_api import build_payloads, percentile, run_level
+from fake_winrm import HostProfile, load_profiles
+from winrm_diagnostics import run_preflight_check
+
+
+@pytest.fixture
+def api_url(fake_host):
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_profiles_file_ignores_unknown_fields(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps({"127.0.0.3": {"auth_fail": True, "colour": "red"}, "127.0.0.4": {"latency": 0.5}}))
+    assert load_profiles(str(path)) == {"127.0.0.3": HostProfile(auth_fail=True), "127.0.0.4": HostProfile(latency=0.5)}
+    assert load_profiles(None) == {}
+
+
+def test_fake_host_checks_the_password(fake_host):
+    fake_host.profiles["127.0.0.2"] = HostProfile(password="right")
+    assert run_preflight_check("127.0.0.2", "right")["success"]
+    rejected = run_preflight_check("127.0.0.2", "wrong")
+    assert not rejected["success"] and rejected["error_code"] == "INVALID_CREDENTIALS"
+    assert fake_host.stats["auth_failures"] >= 1
+
+
+def test_percentile_picks_the_nearest_rank():
+    samples = [float(value) for value in range(1, 101)]
+    assert (percentile(samples, 50), percentile(samples, 99), percentile(samples, 100)) == (50.0, 99.0, 100.0)
+    assert percentile([], 99) == 0.0
+
+
+def test_benchmark_level_against_the_fake_host(api_url, fake_host):
+    payloads = build_payloads("execute-script", ["127.0.0.2", "127.0.0.3"])
+    level = run_level(api_url, "execute-script", payloads, concurrency=2, duration=0.5)
+    assert level["requests"] > 0
+    assert level["statuses"] == {"200": level["requests"]}
+    assert level["p50_ms"] <= level["p99_ms"]
+    assert fake_host.stats["shells_opened"] == 2
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def failure(code="SERVER_UNREACHABLE"):
+    return {"success": False, "error_code": code, "error": f"{code} for the test"}
+
+
+def half_open(breaker, target="10.0.0.1"):
+    breaker.record(target, failure())
+    breaker._circuits[target].opened_until = 0.0
+
+
+def test_trip_codes_open_the_circuit():
+    breaker = CircuitBreaker(open_seconds=30)
+    breaker.record("10.0.0.1", failure())
+    cached = breaker.check("10.0.0.1")
+    assert cached["error_code"] == "SERVER_UNREACHABLE"
+    assert cached["circuit_open"] is True
+    assert 1 <= cached["retry_after"] <= 30
+    with pytest.raises(CircuitOpenError):
+        breaker.guard("10.0.0.1")
+
+
+def test_backoff_grows_and_is_capped():
+    breaker = CircuitBreaker(open_seconds=10, max_open_seconds=25)
+    for expected in (10, 20, 25):
+        breaker.record("10.0.0.1", failure())
+        remaining = breaker._circuits["10.0.0.1"].opened_until - time.monotonic()
+        assert expected - 1 < remaining <= expected
+
+
+def test_success_and_other_errors_close_the_circuit():
+    breaker = CircuitBreaker()
+    breaker.record("10.0.0.1", failure())
+    breaker.record("10.0.0.1", None)
+    assert breaker.check("10.0.0.1") is None
+
+    breaker.record("10.0.0.2", failure())
+    breaker.record("10.0.0.2", failure("INVALID_CREDENTIALS"))
+    assert breaker.check("10.0.0.2") is None
+
+
+def test_half_open_admits_a_single_probe():
+    breaker = CircuitBreaker(probe_timeout=60)
+    half_open(breaker)
+    assert breaker.check("10.0.0.1") is None
+    assert breaker.check("10.0.0.1")["retry_after"] == 1
+
+
+def test_release_frees_the_half_open_probe():
+    breaker = CircuitBreaker(probe_timeout=60)
+    half_open(breaker)
+    assert breaker.check("10.0.0.1") is None
+    breaker.release("10.0.0.1")
+    circuit = breaker._circuits["10.0.0.1"]
+    assert circuit.failures == 1
+    assert breaker.check("10.0.0.1") is None
+
+
+def test_stale_probe_claim_expires():
+    breaker = CircuitBreaker(probe_timeout=0.1)
+    half_open(breaker)
+    assert breaker.check("10.0.0.1") is None
+    time.sleep(0.15)
+    assert breaker.check("10.0.0.1") is None
+
+
+def test_timeout_leaves_an_open_circuit_open():
+    breaker = CircuitBreaker(open_seconds=30)
+    breaker.record("10.0.0.1", failure())
+    breaker.record("10.0.0.1", failure("TIMEOUT"))
+    assert breaker.check("10.0.0.1")["error_code"] == "SERVER_UNREACHABLE"
+    assert breaker._circuits["10.0.0.1"].failures == 1
+
+
+def test_timeout_releases_a_half_open_probe_without_closing():
+    breaker = CircuitBreaker(probe_timeout=60)
+    half_open(breaker)
+    assert breaker.check("10.0.0.1") is None
+    breaker.record("10.0.0.1", failure("TIMEOUT"))
+    assert "10.0.0.1" in breaker._circuits
+    assert breaker._circuits["10.0.0.1"].probe_started is None
+    assert breaker.check("10.0.0.1") is None
+
+
+def test_timeout_does_not_create_a_circuit():
+    breaker = CircuitBreaker()
+    breaker.record("10.0.0.1", failure("TIMEOUT"))
+    assert breaker.snapshot() == {}
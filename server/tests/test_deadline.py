@@ -0,0 +1,94 @@
+import time
+from contextvars import copy_context
+
+import pytest
+
+from deadline import (
+    REQUEST_DEADLINE_MAX_SECONDS,
+    REQUEST_DEADLINE_SECONDS,
+    TIMEOUT,
+    Deadline,
+    DeadlineExceeded,
+    check_deadline,
+    current_deadline,
+    deadline_expired,
+    deadline_scope,
+    phase_timeout,
+    remaining_budget,
+    requested_deadline,
+)
+
+
+def test_check_names_the_phase_once_expired():
+    deadline = Deadline(0.05)
+    assert deadline.check("connect") > 0
+    time.sleep(0.1)
+    assert deadline.expired
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        deadline.check("invoke_fused")
+    assert excinfo.value.phase == "invoke_fused"
+    assert excinfo.value.error_code == TIMEOUT
+
+
+def test_helpers_without_a_deadline():
+    assert current_deadline.get() is None
+    assert phase_timeout("connect", 7) == 7
+    assert remaining_budget("connect") is None
+    assert not deadline_expired()
+    check_deadline("connect")
+
+
+def test_phase_timeout_is_shortened_to_the_budget():
+    with deadline_scope(1):
+        assert phase_timeout("connect", 10) <= 1
+        assert phase_timeout("connect", 0.5) == 0.5
+        assert 0 < remaining_budget("connect") <= 1
+
+
+def test_scope_restores_the_previous_deadline():
+    with deadline_scope(5) as outer:
+        with deadline_scope(1) as inner:
+            assert current_deadline.get() is inner
+        assert current_deadline.get() is outer
+    assert current_deadline.get() is None
+
+
+def test_expired_scope_raises_in_helpers():
+    with deadline_scope(0.01):
+        time.sleep(0.05)
+        assert deadline_expired()
+        with pytest.raises(DeadlineExceeded):
+            check_deadline("admission_wait")
+        with pytest.raises(DeadlineExceeded):
+            phase_timeout("tcp_probe", 3)
+
+
+def test_copied_context_carries_the_deadline():
+    with deadline_scope(5) as deadline:
+        context = copy_context()
+    assert context.run(current_deadline.get) is deadline
+
+
+@pytest.mark.parametrize("value", [None, "soon", -1, 0, float("nan"), float("inf")])
+def test_unusable_requests_get_the_default(value):
+    assert requested_deadline(value) == min(REQUEST_DEADLINE_SECONDS, REQUEST_DEADLINE_MAX_SECONDS)
+
+
+def test_requested_deadline_is_capped():
+    assert requested_deadline(REQUEST_DEADLINE_MAX_SECONDS * 10) == REQUEST_DEADLINE_MAX_SECONDS
+    assert requested_deadline("2.5") == 2.5
+
+
+def test_hung_host_answers_504_and_leaves_the_circuit_closed(client, fake_host):
+    from circuit_breaker import CIRCUIT_BREAKER
+    from fake_winrm import HostProfile
+
+    fake_host.profiles["127.0.0.2"] = HostProfile(script_latency=5)
+    started = time.monotonic()
+    response = client.post("/api/execute-script", json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": "198.51.100.7:3128", "deadline": 1,
+    })
+    assert response.status_code == 504
+    assert response.get_json()["error_code"] == TIMEOUT
+    assert time.monotonic() - started < 3
+    assert CIRCUIT_BREAKER.check("127.0.0.2") is None
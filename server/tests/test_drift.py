@@ -0,0 +1,88 @@
+import time
+
+from deadline import TIMEOUT, DeadlineExceeded, remaining_budget, requested_deadline
+from drift import DRIFT_DRIFTED, DRIFT_ERROR, DRIFT_OK, DRIFT_PENDING, DriftScheduler
+
+PROXY = "198.51.100.7:3128"
+
+
+def wait_checked(scheduler, target, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        server = scheduler.get(target)
+        if server["status"] != DRIFT_PENDING:
+            return server
+        time.sleep(0.01)
+    raise AssertionError(f"{target} was never checked")
+
+
+def test_checks_record_drift_and_reschedule():
+    outcomes = iter([{"drift": [], "observed": {"timezone": "UTC"}},
+                     {"drift": [{"check": "timezone"}], "observed": {"timezone": "GMT"}}])
+    scheduler = DriftScheduler(lambda server: next(outcomes), interval=3600, jitter=0)
+    scheduler.track("10.0.0.1", "x", PROXY)
+    assert scheduler.check_now("10.0.0.1") and not scheduler.check_now("10.0.0.2")
+    server = wait_checked(scheduler, "10.0.0.1")
+    assert server["status"] == DRIFT_OK
+    assert server["nextCheckAt"] == server["checkedAt"] + 3600
+
+    scheduler.check_now("10.0.0.1")
+    deadline = time.monotonic() + 5
+    while scheduler.get("10.0.0.1")["status"] == DRIFT_OK and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.get("10.0.0.1")["status"] == DRIFT_DRIFTED
+    assert scheduler.summary()[DRIFT_DRIFTED] == 1
+
+
+def test_failures_back_off():
+    def unreachable(server):
+        raise OSError("timed out")
+
+    scheduler = DriftScheduler(unreachable, backoff=300, max_backoff=600)
+    scheduler.track("10.0.0.1", "x", PROXY)
+    scheduler.check_now("10.0.0.1")
+    server = wait_checked(scheduler, "10.0.0.1")
+    assert server["status"] == DRIFT_ERROR and server["failures"] == 1
+    assert 150 <= server["nextCheckAt"] - server["checkedAt"] <= 300
+
+
+def test_servers_are_forgotten_after_the_ttl():
+    checked = []
+    scheduler = DriftScheduler(checked.append, interval=3600, ttl=0.1)
+    scheduler.track("10.0.0.1", "x", PROXY)
+    assert scheduler.get("10.0.0.1")["expiresAt"] <= time.time() + 0.1
+    deadline = time.monotonic() + 5
+    while scheduler.get("10.0.0.1") is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.get("10.0.0.1") is None
+    assert checked == []
+
+
+def test_checks_run_under_the_default_deadline():
+    budgets = []
+
+    def verify(server):
+        budgets.append(remaining_budget("verify"))
+        raise DeadlineExceeded("verify", budgets[0])
+
+    scheduler = DriftScheduler(verify)
+    scheduler.track("10.0.0.1", "x", PROXY)
+    scheduler.check_now("10.0.0.1")
+    server = wait_checked(scheduler, "10.0.0.1")
+    assert 0 < budgets[0] <= requested_deadline(None)
+    assert server["error"]["error_code"] == TIMEOUT
+
+
+def test_execute_tracks_servers_only_when_enabled(fake_host, monkeypatch):
+    import app
+
+    scheduler = DriftScheduler(lambda server: {"drift": [], "observed": {}}, interval=3600)
+    monkeypatch.setattr(app, "DRIFT_SCHEDULER", scheduler)
+    assert app.DRIFT_ENABLED is False
+    app.execute_powershell_script("127.0.0.2", "x", PROXY)
+    assert scheduler.snapshot() == []
+
+    monkeypatch.setattr(app, "DRIFT_ENABLED", True)
+    app.execute_powershell_script("127.0.0.2", "x", PROXY)
+    [server] = scheduler.snapshot()
+    assert server["serverIp"] == "127.0.0.2" and server["expected"]["public_ip"] == "203.0.113.10"
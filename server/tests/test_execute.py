@@ -0,0 +1,32 @@
+from fake_winrm import HostProfile
+
+from app import execute_powershell_script
+
+PROXY = "198.51.100.7:3128"
+
+
+def run(fake_host, target, fused):
+    before = fake_host.stats["pipelines"]
+    result = execute_powershell_script(target, "x", PROXY, "America/New_York", fused=fused)
+    return result, fake_host.stats["pipelines"] - before
+
+
+def test_fused_and_stepwise_scripts_agree(fake_host):
+    fused, fused_pipelines = run(fake_host, "127.0.0.2", fused=True)
+    stepwise, stepwise_pipelines = run(fake_host, "127.0.0.3", fused=False)
+
+    for result in (fused, stepwise):
+        assert result["status"] == "Proxy Active"
+        assert result["public_ip"] == "203.0.113.10"
+        assert result["country"] == "DE"
+        assert result["timezone"]["new"] == "W. Europe Standard Time"
+        assert result["timezone"]["ipinfo_timezone"] == "Europe/Berlin"
+    assert fused["timezone"]["changed"] == stepwise["timezone"]["changed"] is True
+    assert fused_pipelines < stepwise_pipelines
+    assert fake_host.proxies == {"127.0.0.2": PROXY, "127.0.0.3": PROXY}
+
+
+def test_unchanged_public_ip_is_reported_inactive(fake_host):
+    fake_host.profiles["127.0.0.4"] = fake_host.profiles["127.0.0.5"] = HostProfile(public_ip="target")
+    assert run(fake_host, "127.0.0.4", fused=True)[0]["status"] == "Proxy inactive"
+    assert run(fake_host, "127.0.0.5", fused=False)[0]["status"] == "Proxy inactive"
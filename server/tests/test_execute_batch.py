@@ -0,0 +1,30 @@
+import json
+
+from fake_winrm import HostProfile
+
+PROXY = "198.51.100.7:3128"
+
+
+def test_batch_streams_one_record_per_server_then_a_summary(client, fake_host):
+    fake_host.profiles["127.0.0.3"] = HostProfile(auth_fail=True)
+    response = client.post("/api/execute-batch", json={"servers": [
+        {"serverIp": "127.0.0.2", "password": "x", "proxyIpPort": PROXY},
+        {"serverIp": "127.0.0.3", "password": "x", "proxyIpPort": PROXY},
+        {"serverIp": "127.0.0.4", "password": "x"},
+    ]})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {"done": True, "total": 3, "succeeded": 1}
+    records = {record["index"]: record for record in lines[:-1]}
+    assert sorted(records) == [0, 1, 2]
+    assert records[0]["success"] and records[0]["status"] == "Proxy Active"
+    assert records[1]["error_code"] == "INVALID_CREDENTIALS"
+    assert not records[2]["success"] and "Missing required fields" in records[2]["error"]
+
+
+def test_batch_rejects_an_empty_list(client):
+    response = client.post("/api/execute-batch", json={"servers": []})
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
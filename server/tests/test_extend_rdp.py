@@ -0,0 +1,85 @@
+import json
+import threading
+
+import pytest
+
+import app
+from admission import SERVER_BUSY, AdmissionController
+from circuit_breaker import CIRCUIT_BREAKER
+from fake_winrm import HostProfile
+
+TARGET = "127.0.0.2"
+
+
+def events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def unreachable():
+    return {"success": False, "error_code": "SERVER_UNREACHABLE", "error": "unreachable for the test"}
+
+
+@pytest.fixture
+def busy(monkeypatch):
+    """
+    An admission controller with its only slot taken until the returned function frees it.
+    """
+    controller = AdmissionController(max_sessions=1, queue_timeout=0.1)
+    monkeypatch.setattr(app, "ADMISSION", controller)
+    admitted, release = threading.Event(), threading.Event()
+
+    def hold():
+        with controller.admit("127.0.0.99"):
+            admitted.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold, daemon=True)
+    thread.start()
+    assert admitted.wait(5)
+
+    def free():
+        release.set()
+        thread.join(5)
+
+    yield free
+    free()
+
+
+def test_progress_is_streamed_then_the_result(client, fake_host):
+    fake_host.profiles[TARGET] = HostProfile(license_days=0)
+    response = client.post("/api/extend-rdp", json={"serverIp": TARGET, "password": "x"})
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    lines = events(response)
+    assert [line["phase"] for line in lines[:2]] == ["connecting", "running"]
+    output = [line["text"] for line in lines if line["event"] == "output"]
+    assert "License re-armed successfully" in output
+    assert lines[-1]["event"] == "result" and lines[-1]["result"]["Action"] == "Rearm executed"
+    assert all(line["serverIp"] == TARGET for line in lines)
+
+
+def test_open_circuit_is_a_503_before_streaming(client, fake_host):
+    CIRCUIT_BREAKER.record(TARGET, unreachable())
+    response = client.post("/api/extend-rdp", json={"serverIp": TARGET, "password": "x"})
+    assert response.status_code == 503
+    assert response.get_json()["error_code"] == "SERVER_UNREACHABLE"
+    assert fake_host.stats["requests"] == 0
+
+
+def test_busy_server_is_a_429_before_streaming(client, fake_host, busy):
+    response = client.post("/api/extend-rdp", json={"serverIp": TARGET, "password": "x"})
+    assert response.status_code == 429
+    assert response.get_json()["error_code"] == SERVER_BUSY
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_half_open_probe_is_claimed_once_and_given_back_when_busy(client, fake_host, busy):
+    CIRCUIT_BREAKER.record(TARGET, unreachable())
+    CIRCUIT_BREAKER._circuits[TARGET].opened_until = 0.0
+    assert client.post("/api/extend-rdp", json={"serverIp": TARGET, "password": "x"}).status_code == 429
+
+    busy()
+    # The probe claim was given back, and the view does not claim it a second time
+    response = client.post("/api/extend-rdp", json={"serverIp": TARGET, "password": "x"})
+    assert response.status_code == 200
+    assert events(response)[-1]["event"] == "result"
+    assert CIRCUIT_BREAKER.check(TARGET) is None and TARGET not in CIRCUIT_BREAKER.snapshot()
@@ -0,0 +1,55 @@
+import app
+from app import execute_powershell_script
+from geoip import GeoIPResolver
+
+PUBLIC_IP = "203.0.113.10"  # what the fake host reports through any proxy
+
+
+class Reader:
+    def __init__(self, records):
+        self.records = records
+
+    def get(self, ip):
+        if ip == "not-an-ip":
+            raise ValueError(ip)
+        return self.records.get(ip)
+
+
+def resolver(city, asn=None):
+    resolver = GeoIPResolver(city_path=None)
+    resolver._city, resolver._asn, resolver._opened = Reader(city), Reader(asn or {}), True
+    return resolver
+
+
+CITY = {PUBLIC_IP: {"country": {"iso_code": "US"}, "location": {"time_zone": "America/Chicago"}}}
+ASN = {PUBLIC_IP: {"autonomous_system_number": 64500, "autonomous_system_organization": "Example Transit"}}
+
+
+def test_lookup_is_shaped_like_ipinfo():
+    geo = resolver(CITY, ASN)
+    assert geo.lookup(PUBLIC_IP) == {"ip": PUBLIC_IP, "org": "AS64500 Example Transit", "country": "US",
+                                     "timezone": "America/Chicago"}
+    assert geo.lookup("198.51.100.1") is None
+    assert geo.lookup("not-an-ip") is None
+
+
+def test_missing_database_disables_local_lookups(tmp_path):
+    assert not GeoIPResolver(city_path=None).available
+    missing = GeoIPResolver(city_path=str(tmp_path / "GeoLite2-City.mmdb"))
+    assert missing.configured and not missing.available
+    assert missing.lookup(PUBLIC_IP) is None
+
+
+def test_local_mode_resolves_geo_without_ipinfo(fake_host, monkeypatch):
+    monkeypatch.setattr(app, "GEOIP_RESOLVER", resolver(CITY, ASN))
+    result = execute_powershell_script("127.0.0.2", "x", "198.51.100.7:3128", geo_mode="local")
+    assert result["status"] == "Proxy Active"
+    assert (result["isp"], result["country"]) == ("AS64500 Example Transit", "US")
+    assert result["timezone"]["ipinfo_timezone"] == "America/Chicago"
+
+
+def test_ip_missing_from_the_database_falls_back_to_ipinfo(fake_host, monkeypatch):
+    monkeypatch.setattr(app, "GEOIP_RESOLVER", resolver({}))
+    result = execute_powershell_script("127.0.0.2", "x", "198.51.100.7:3128", geo_mode="local")
+    assert (result["isp"], result["country"]) == ("AS64500 Bench Transit", "DE")
+    assert result["timezone"]["ipinfo_timezone"] == "Europe/Berlin"
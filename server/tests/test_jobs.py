@@ -0,0 +1,120 @@
+import threading
+import time
+from contextvars import ContextVar
+
+import pytest
+
+from fake_winrm import HostProfile
+from jobs import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JobStore, JobStoreFull
+
+request_label: ContextVar[str] = ContextVar("request_label", default="none")
+
+
+def wait_finished(store, job, timeout=5):
+    seen = 0
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        seen += len(store.wait_for_events(job, seen, 0.1))
+    assert job.finished
+    return job
+
+
+def test_job_reports_phases_and_succeeds():
+    store = JobStore(max_workers=2)
+
+    def work(report_phase):
+        report_phase("connecting")
+        report_phase("running")
+        return {"success": True, "result": 42}
+
+    job = wait_finished(store, store.submit("execute", work, target="10.0.0.1"))
+    assert job.status == JOB_SUCCEEDED
+    assert [event["phase"] for event in job.events] == [JOB_QUEUED, JOB_RUNNING, "connecting", "running",
+                                                        JOB_SUCCEEDED]
+    assert job.to_dict()["response"] == {"success": True, "result": 42}
+
+
+def test_unsuccessful_or_raising_work_fails_the_job():
+    store = JobStore(max_workers=2)
+    unsuccessful = wait_finished(store, store.submit("execute", lambda report_phase: {"success": False}))
+    assert unsuccessful.status == JOB_FAILED
+
+    def boom(report_phase):
+        raise RuntimeError("boom")
+
+    raised = wait_finished(store, store.submit("execute", boom))
+    assert raised.status == JOB_FAILED
+    assert raised.response == {"success": False, "error": "boom"}
+
+
+def test_job_runs_in_the_submitting_context():
+    store = JobStore(max_workers=1)
+    token = request_label.set("execute-script")
+    try:
+        job = store.submit("execute", lambda report_phase: {"success": True, "label": request_label.get()})
+    finally:
+        request_label.reset(token)
+    assert wait_finished(store, job).response["label"] == "execute-script"
+
+
+def test_store_full_counts_unfinished_jobs_only():
+    store = JobStore(max_workers=1, max_retained=1)
+    release = threading.Event()
+    running = store.submit("execute", lambda report_phase: release.wait(5) and {"success": True})
+    with pytest.raises(JobStoreFull):
+        store.submit("execute", lambda report_phase: {"success": True})
+    release.set()
+    wait_finished(store, running)
+    # A finished job makes room for the next one
+    store.submit("execute", lambda report_phase: {"success": True})
+    assert store.get(running.id) is None
+
+
+def test_finished_jobs_expire_after_retention():
+    store = JobStore(max_workers=1, retention_seconds=0.1)
+    job = wait_finished(store, store.submit("execute", lambda report_phase: {"success": True}))
+    assert store.get(job.id) is job
+    time.sleep(0.2)
+    assert store.get(job.id) is None
+
+
+def test_other_workers_follow_the_job_through_the_state_file(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    owner, other = JobStore(max_workers=1, path=path), JobStore(max_workers=1, path=path)
+    release = threading.Event()
+
+    def work(report_phase):
+        report_phase("connecting")
+        release.wait(5)
+        return {"success": True, "result": 42}
+
+    job = owner.submit("execute", work, target="10.0.0.1")
+    seen = other.get(job.id)
+    assert seen is not None and seen is not job
+    threading.Timer(0.2, release.set).start()
+    wait_finished(other, seen)
+    assert seen.status == JOB_SUCCEEDED
+    assert seen.response == {"success": True, "result": 42}
+    assert seen.events == job.events
+    assert JobStore(path="").get(job.id) is None
+
+
+def test_async_job_survives_while_other_requests_are_served(client, fake_host):
+    fake_host.profiles["127.0.0.2"] = HostProfile(script_latency=0.5)
+    submitted = client.post("/api/execute-script", json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": "198.51.100.7:3128", "async": True,
+    })
+    assert submitted.status_code == 202
+    status_url = submitted.get_json()["statusUrl"]
+
+    deadline = time.monotonic() + 10
+    while True:
+        assert client.get("/api/health").status_code == 200
+        assert client.post("/api/execute-script", json={
+            "serverIp": "127.0.0.3", "password": "x", "proxyIpPort": "198.51.100.7:3128",
+        }).get_json()["success"]
+        job = client.get(status_url).get_json()
+        if job["status"] in (JOB_SUCCEEDED, JOB_FAILED) or time.monotonic() > deadline:
+            break
+    assert job["status"] == JOB_SUCCEEDED
+    assert "Status: Proxy Active" in job["response"]["result"]
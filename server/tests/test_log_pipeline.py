@@ -0,0 +1,59 @@
+import io
+import json
+import logging
+from contextvars import copy_context
+
+import pytest
+
+import log_pipeline
+from log_pipeline import LogPipeline, begin_request_logging, parse_sample_rates
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = LogPipeline(queue_size=100)
+    pipeline.output.stream = io.StringIO()
+    logger = logging.getLogger("tests.log_pipeline")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(pipeline.handler)
+    pipeline.start()
+    yield pipeline, logger
+    logger.removeHandler(pipeline.handler)
+
+
+def lines(pipeline):
+    pipeline.stop()
+    return [json.loads(line) for line in pipeline.output.stream.getvalue().splitlines()]
+
+
+def request(endpoint, logger):
+    begin_request_logging(endpoint)
+    logger.info("configured %s", "10.0.0.1")
+    logger.warning("slow host")
+
+
+def test_unsampled_requests_keep_only_warnings(pipeline, monkeypatch):
+    pipeline, logger = pipeline
+    monkeypatch.setattr(log_pipeline, "SAMPLE_RATES", parse_sample_rates("execute_script=0, preflight_check=1"))
+    copy_context().run(request, "execute_script", logger)
+    copy_context().run(request, "preflight_check", logger)
+    assert [entry["msg"] for entry in lines(pipeline)] == ["slow host", "configured 10.0.0.1", "slow host"]
+
+
+def test_records_are_json_with_secrets_redacted(pipeline):
+    pipeline, logger = pipeline
+    logger.info("login password=hunter2 ok", extra={"timings": {"total_ms": 5}, "api_token": "abc"})
+    [entry] = lines(pipeline)
+    assert entry["level"] == "INFO" and entry["logger"] == "tests.log_pipeline"
+    assert "hunter2" not in entry["msg"]
+    assert entry["timings"] == {"total_ms": 5}
+    assert entry["api_token"] == log_pipeline.REDACTED
+
+
+def test_full_queue_drops_instead_of_blocking():
+    pipeline = LogPipeline(queue_size=1)
+    record = logging.LogRecord("tests", logging.WARNING, __file__, 1, "message", (), None)
+    pipeline.handler.handle(record)
+    pipeline.handler.handle(record)
+    assert pipeline.handler.queue.qsize() == 1
@@ -0,0 +1,45 @@
+import os
+import runpy
+import subprocess
+import sys
+from types import SimpleNamespace
+
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+from conftest import SERVER_DIR
+
+WORKER = """
+import os
+import metrics
+
+metrics.WORKER_THREADS.set(8)
+started = metrics.request_started("execute_script")
+metrics.request_finished("execute_script", started - 1, 200)
+print(os.getpid())
+"""
+
+
+def samples(text):
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(text) for sample in family.samples}
+
+
+def test_samples_from_all_workers_are_aggregated(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    (tmp_path / "counter_4242.db").write_bytes(b"")  # left over from a previous run
+    config = runpy.run_path(os.path.join(SERVER_DIR, "gunicorn.conf.py"))
+    assert os.listdir(tmp_path) == []
+
+    pids = [int(subprocess.run([sys.executable, "-c", WORKER], cwd=SERVER_DIR, env=os.environ, check=True,
+                               capture_output=True, text=True).stdout) for _ in range(2)]
+    config["child_exit"](None, SimpleNamespace(pid=pids[0]))
+
+    monkeypatch.setattr(metrics, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    body, _ = metrics.render_metrics()
+    values = samples(body.decode())
+    labels = (("endpoint", "execute_script"), ("status", "200"))
+    assert values[("dashrdp_request_duration_seconds_count", labels)] == 2
+    assert values[("dashrdp_worker_busy_seconds_total", ())] >= 2
+    # Only the live worker's threads count
+    assert values[("dashrdp_worker_threads", ())] == 8
@@ -0,0 +1,80 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+import winrm_diagnostics
+from conftest import unused_port
+from winrm_diagnostics import HTTP_PREFERENCE_GRACE_SECONDS, probe_winrm_ports, probe_winrm_ports_async
+
+HTTP, HTTPS = 15985, 15986
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """
+    Replace the TCP check with one answering (open, after seconds) per port.
+    """
+    answers = {}
+
+    async def check(host, port, timeout):
+        is_open, delay = answers[port]
+        await asyncio.sleep(delay)
+        return is_open, f"Port {port} {'is open' if is_open else 'refused the connection'}"
+
+    monkeypatch.setattr(winrm_diagnostics, "WINRM_HTTP_PORT", HTTP)
+    monkeypatch.setattr(winrm_diagnostics, "WINRM_HTTPS_PORT", HTTPS)
+    monkeypatch.setattr(winrm_diagnostics, "check_tcp_port_async", check)
+    return answers
+
+
+def probe(**kwargs):
+    started = time.monotonic()
+    results = asyncio.run(probe_winrm_ports_async("10.0.0.1", **kwargs))
+    return results, time.monotonic() - started
+
+
+def test_open_http_ends_the_probe(answers):
+    answers.update({HTTP: (True, 0.01), HTTPS: (True, 5)})
+    results, elapsed = probe()
+    assert results == {HTTP: (True, f"Port {HTTP} is open")}
+    assert elapsed < 1
+
+
+def test_open_https_waits_out_the_http_grace_only(answers):
+    answers.update({HTTP: (True, 5), HTTPS: (True, 0.01)})
+    results, elapsed = probe()
+    assert results[HTTPS][0] and not results[HTTP][0]
+    assert "did not answer" in results[HTTP][1]
+    assert elapsed < HTTP_PREFERENCE_GRACE_SECONDS + 0.5
+
+
+def test_http_answering_within_the_grace_is_preferred(answers):
+    answers.update({HTTP: (True, 0.05), HTTPS: (True, 0.01)})
+    results, _ = probe()
+    assert results[HTTP][0] and results[HTTPS][0]
+
+
+def test_closed_http_keeps_waiting_for_https(answers):
+    answers.update({HTTP: (False, 0.01), HTTPS: (True, 0.1)})
+    results, _ = probe()
+    assert not results[HTTP][0] and results[HTTPS][0]
+
+
+def test_scan_waits_for_both_ports(answers):
+    answers.update({HTTP: (True, 0.01), HTTPS: (False, 0.1)})
+    results, _ = probe(short_circuit=False)
+    assert results[HTTP][0] and not results[HTTPS][0]
+
+
+def test_real_ports(monkeypatch):
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        http, https = listener.getsockname()[1], unused_port()
+        monkeypatch.setattr(winrm_diagnostics, "WINRM_HTTP_PORT", http)
+        monkeypatch.setattr(winrm_diagnostics, "WINRM_HTTPS_PORT", https)
+        assert probe_winrm_ports("127.0.0.1", timeout=2)[http] == (True, f"Port {http} is open")
+        closed = asyncio.run(probe_winrm_ports_async("127.0.0.1", 2, short_circuit=False))
+    assert closed[https] == (False, f"Port {https} refused the connection")
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import proxy_probe
+from proxy_probe import PROXY_UNREACHABLE, ProxyProber, endpoint_key
+
+FAST, SLOW, DEAD, GONE = "192.0.2.1:3128", "192.0.2.2:3128", "192.0.2.3:3128", "192.0.2.4:3128"
+
+
+class StubProbes:
+    """
+    Stands in for the network: a proxy's round trip comes from rtts (None: refused),
+    and every probe taken is recorded in calls.
+    """
+
+    def __init__(self):
+        self.rtts = {FAST: 10.0, SLOW: 30.0, DEAD: None, GONE: None}
+        self.calls = []
+
+    async def probe(self, proxy, timeout, connect_target):
+        self.calls.append(proxy)
+        rtt = self.rtts[proxy]
+        if rtt is None:
+            return {"proxy": proxy, "ok": False, "skipped": False, "reachable": False, "connect_status": None,
+                    "latency_ms": None, "handshake_ms": None, "message": "Connection refused",
+                    "checkedAt": time.time(), "error_code": PROXY_UNREACHABLE}
+        return {"proxy": proxy, "ok": True, "skipped": False, "reachable": True, "connect_status": 200,
+                "latency_ms": rtt / 2, "handshake_ms": rtt / 2, "message": "Tunnel opened",
+                "checkedAt": time.time()}
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    import app
+
+    stub = StubProbes()
+    monkeypatch.setattr(proxy_probe, "probe_proxy_async", stub.probe)
+    monkeypatch.setattr(app, "PROXY_PROBER", ProxyProber())
+    return stub
+
+
+def test_healthy_proxies_are_ranked_by_round_trip_then_the_rest_in_order(probes):
+    ranking = ProxyProber().rank([DEAD, SLOW, FAST, GONE])
+    assert [(row["rank"], row["proxy"], row["rtt_ms"]) for row in ranking] == [
+        (1, FAST, 10.0), (2, SLOW, 30.0), (3, DEAD, None), (4, GONE, None),
+    ]
+
+
+def test_ranking_reprobes_results_older_than_max_age(probes):
+    prober = ProxyProber()
+    prober.rank([FAST, SLOW], max_age=5)
+    prober.rank([FAST, SLOW], max_age=5)
+    assert sorted(probes.calls) == [FAST, SLOW]
+
+    _, result = prober._results[endpoint_key(FAST)]
+    result["checkedAt"] -= 10
+    probes.rtts[FAST] = 50.0
+    ranking = prober.rank([FAST, SLOW], max_age=5)
+    assert probes.calls[2:] == [FAST]
+    assert [row["proxy"] for row in ranking] == [SLOW, FAST]
+    # Still within the cache TTL for everything but ranking
+    assert prober.probe(FAST)["cached"] is True
+
+
+def test_no_usable_candidate_fails_before_the_host_is_touched(client, fake_host, probes):
+    response = client.post("/api/execute-script", json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": [DEAD, GONE],
+    })
+    assert response.status_code == 422
+    body = response.get_json()
+    assert body["error_code"] == PROXY_UNREACHABLE
+    assert "None of the 2 candidate proxies is usable" in str(body)
+    assert fake_host.stats["requests"] == 0
+
+
+@pytest.fixture
+def fast_proxy_inactive(monkeypatch):
+    """
+    The fastest candidate turns out inactive on the host; every other proxy is executed for real.
+    """
+    import app
+
+    execute = app.execute_powershell_script
+
+    def stub(target_ip, password, proxy_ip_port, *args, **kwargs):
+        if proxy_ip_port == FAST:
+            return {"status": "Proxy inactive", "target_ip": target_ip, "proxy": proxy_ip_port}
+        return execute(target_ip, password, proxy_ip_port, *args, **kwargs)
+
+    monkeypatch.setattr(app, "execute_powershell_script", stub)
+
+
+@pytest.mark.parametrize("endpoint", ["/api/execute-script", "/api/configure"])
+def test_next_candidate_is_applied_when_the_fastest_is_inactive(client, fake_host, probes, fast_proxy_inactive,
+                                                                endpoint):
+    response = client.post(endpoint, json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": [DEAD, SLOW, FAST],
+    })
+    assert response.status_code == 200
+    selection = response.get_json()["proxySelection"]
+    assert [row["proxy"] for row in selection["ranking"]] == [FAST, SLOW, DEAD]
+    assert selection["attempts"] == [
+        {"proxy": FAST, "status": "Proxy inactive"},
+        {"proxy": SLOW, "status": "Proxy Active"},
+    ]
+    assert selection["selected"] == SLOW
+    assert fake_host.proxies["127.0.0.2"] == SLOW
@@ -0,0 +1,138 @@
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from conftest import SERVER_DIR, unused_port
+from proxy_probe import PROXY_UNREACHABLE, ProxyProber, ProxyUnreachable
+
+PER_PROTOCOL = "http=127.0.0.1:3128;https=127.0.0.1:3128"
+
+
+class ConnectProxy(socketserver.ThreadingTCPServer):
+    """
+    Answers every CONNECT with status and counts the connections it accepted.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, status):
+        super().__init__(("127.0.0.1", 0), ConnectHandler)
+        self.status = status
+        self.connections = 0
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class ConnectHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        self.rfile.readline()
+        self.wfile.write(f"HTTP/1.1 {self.server.status} Status\r\n\r\n".encode("ascii"))
+
+
+@pytest.fixture
+def connect_proxy():
+    servers = []
+
+    def start(status):
+        server = ConnectProxy(status)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("status, ok", [(200, True), (407, True), (502, False)])
+def test_connect_answer_decides(connect_proxy, status, ok):
+    proxy = connect_proxy(status)
+    result = ProxyProber().probe(proxy.address)
+    assert result["ok"] is ok
+    assert result["reachable"] is True
+    assert result["connect_status"] == status
+    assert result["latency_ms"] is not None and result["handshake_ms"] is not None
+    assert ("error_code" in result) is not ok
+
+
+def test_refused_port_is_unreachable():
+    result = ProxyProber().probe(f"127.0.0.1:{unused_port()}")
+    assert result["ok"] is False
+    assert result["reachable"] is False
+    assert result["message"] == "Connection refused"
+    assert result["error_code"] == PROXY_UNREACHABLE
+
+
+def test_value_that_is_not_ip_port_is_skipped():
+    result = ProxyProber().guard(PER_PROTOCOL)
+    assert result["ok"] is True
+    assert result["skipped"] is True
+    assert result["reachable"] is False
+    assert "error_code" not in result
+
+
+def test_guard_raises_and_caches_the_failure(connect_proxy):
+    proxy = connect_proxy(502)
+    prober = ProxyProber()
+    for _ in range(2):
+        with pytest.raises(ProxyUnreachable) as excinfo:
+            prober.guard(proxy.address)
+        assert excinfo.value.error_code == PROXY_UNREACHABLE
+    assert proxy.connections == 1
+
+
+def test_probe_is_off_by_default():
+    env = {key: value for key, value in os.environ.items() if key != "PROXY_PROBE_ENABLED"}
+    enabled = subprocess.run([sys.executable, "-c", "import proxy_probe; print(proxy_probe.PROXY_PROBE_ENABLED)"],
+                             cwd=SERVER_DIR, env=env, check=True, capture_output=True, text=True).stdout
+    assert enabled.strip() == "False"
+
+
+@pytest.fixture
+def probing(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "PROXY_PROBE_ENABLED", True)
+    monkeypatch.setattr(app, "PROXY_PROBER", ProxyProber())
+
+
+def test_enabled_guard_answers_422_before_the_host_is_touched(client, fake_host, probing):
+    response = client.post("/api/execute-script", json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": f"127.0.0.1:{unused_port()}",
+    })
+    assert response.status_code == 422
+    assert response.get_json()["error_code"] == PROXY_UNREACHABLE
+    assert fake_host.stats["requests"] == 0
+
+
+def test_enabled_guard_lets_unparseable_values_through(client, fake_host, probing):
+    response = client.post("/api/execute-script", json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": PER_PROTOCOL,
+    })
+    assert response.status_code == 200
+    assert response.get_json()["success"] is True
+    assert fake_host.proxies["127.0.0.2"] == PER_PROTOCOL
+
+
+def test_skipped_candidate_is_ranked_after_measured_ones(connect_proxy):
+    proxy = connect_proxy(200)
+    refused = f"127.0.0.1:{unused_port()}"
+    ranking = ProxyProber().rank([refused, PER_PROTOCOL, proxy.address])
+    assert [row["proxy"] for row in ranking] == [proxy.address, PER_PROTOCOL, refused]
+    assert ranking[1]["rtt_ms"] is None
+
+
+def test_skipped_candidate_is_shown_as_not_probed():
+    from app import format_proxy_selection
+
+    ranking = ProxyProber().rank([PER_PROTOCOL])
+    text = format_proxy_selection({"ranking": ranking, "attempts": [], "selected": PER_PROTOCOL})
+    assert text.splitlines()[1] == f"1. {PER_PROTOCOL} - not probed (not IP:Port) ✓ applied"
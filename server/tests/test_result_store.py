@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from result_store import (
+    HISTORY_MAX_LIMIT,
+    RESULT_EXECUTE,
+    RESULT_PREFLIGHT,
+    RESULT_STORE,
+    RESULT_VERIFY,
+    ResultStore,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / "results.db"))
+
+
+def test_latest_per_kind_and_history_newest_first(store):
+    store.record(RESULT_PREFLIGHT, "10.0.0.1", "ok", {"checks": []})
+    store.record(RESULT_EXECUTE, "10.0.0.1", "Proxy inactive", {"n": 1})
+    time.sleep(0.01)
+    store.record(RESULT_EXECUTE, "10.0.0.1", "Proxy Active", {"n": 2})
+    store.record(RESULT_EXECUTE, "10.0.0.2", "error", {"n": 3}, "SERVER_UNREACHABLE")
+    store.flush()
+
+    latest = store.latest("10.0.0.1")
+    assert latest[RESULT_EXECUTE]["result"] == {"n": 2}
+    assert latest[RESULT_PREFLIGHT]["status"] == "ok"
+    assert latest[RESULT_VERIFY] is None
+    assert store.latest("10.0.0.2")[RESULT_EXECUTE]["errorCode"] == "SERVER_UNREACHABLE"
+
+    history = store.history("10.0.0.1", kind=RESULT_EXECUTE)
+    assert [row["result"]["n"] for row in history] == [2, 1]
+    # The last recordedAt of a page fetches the next one
+    [first] = store.history("10.0.0.1", kind=RESULT_EXECUTE, limit=1)
+    assert store.history("10.0.0.1", kind=RESULT_EXECUTE, until=first["recordedAt"]) == history[1:]
+    assert store.history("10.0.0.1", since=time.time() + 60) == []
+
+
+def test_history_limit_is_clamped(store):
+    for index in range(3):
+        store.record(RESULT_EXECUTE, "10.0.0.1", "ok", {"n": index})
+    store.flush()
+    assert len(store.history("10.0.0.1", limit=0)) == 1
+    assert len(store.history("10.0.0.1", limit=HISTORY_MAX_LIMIT * 2)) == 3
+
+
+def test_status_endpoint_reads_stored_results(client):
+    assert client.get("/api/servers/127.0.0.9/status").status_code == 404
+    client.post("/api/execute-script", json={"serverIp": "127.0.0.9", "password": "x",
+                                             "proxyIpPort": "198.51.100.7:3128"})
+    RESULT_STORE.flush()
+    status = client.get("/api/servers/127.0.0.9/status").get_json()
+    assert status["proxyStatus"] == "Proxy Active"
+    history = client.get("/api/servers/127.0.0.9/history?kind=execute").get_json()
+    assert history["count"] == 1 and history["results"][0]["status"] == "Proxy Active"
+    assert client.get("/api/servers/127.0.0.9/history?kind=nope").status_code == 400
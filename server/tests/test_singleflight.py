@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import LEADER, REPLAYED, SHARED, SingleFlight
+
+
+def run_concurrently(flight, key, fn, callers):
+    results = [None] * callers
+    errors = [None] * callers
+
+    def call(index):
+        try:
+            results[index] = flight.do(key, fn)
+        except Exception as exc:
+            errors[index] = exc
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight(replay_seconds=0)
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    threads, results, _ = run_concurrently(flight, "key", fn, 4)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(outcome for _, outcome in results) == [LEADER, SHARED, SHARED, SHARED]
+    assert all(value == "value" for value, _ in results)
+
+
+def test_error_reaches_every_waiter_and_is_not_replayed():
+    flight = SingleFlight(replay_seconds=60)
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threads, results, errors = run_concurrently(flight, "key", fn, 3)
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert flight.do("key", lambda: "fresh") == ("fresh", LEADER)
+
+
+def test_replay_window_and_expiry():
+    flight = SingleFlight(replay_seconds=0.2)
+    assert flight.do("key", lambda: 1) == (1, LEADER)
+    assert flight.do("key", lambda: 2) == (1, REPLAYED)
+    time.sleep(0.3)
+    assert flight.do("key", lambda: 3) == (3, LEADER)
+
+
+def test_replayable_filters_results():
+    flight = SingleFlight(replay_seconds=60)
+    flight.do("key", lambda: {"success": False}, replayable=lambda value: value["success"])
+    value, outcome = flight.do("key", lambda: {"success": True})
+    assert outcome == LEADER and value == {"success": True}
+
+
+def test_zero_replay_seconds_disables_replay():
+    flight = SingleFlight(replay_seconds=0)
+    flight.do("key", lambda: 1)
+    assert flight.do("key", lambda: 2) == (2, LEADER)
+
+
+def test_replays_are_bounded():
+    flight = SingleFlight(replay_seconds=60, max_replays=2)
+    for key in ("a", "b", "c"):
+        flight.do(key, lambda: key)
+    assert flight.do("a", lambda: "again") == ("again", LEADER)
+    assert flight.do("c", lambda: "again")[1] == REPLAYED
+
+
+def test_leader_failure_frees_the_key():
+    flight = SingleFlight(replay_seconds=0)
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: (_ for _ in ()).throw(ValueError()))
+    assert flight.do("key", lambda: "ok") == ("ok", LEADER)
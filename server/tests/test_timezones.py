@@ -0,0 +1,39 @@
+from importlib import resources
+
+import pytest
+
+from timezones import COUNTRY_DEFAULT_ZONES, country_to_timezone, iana_to_windows_timezone
+
+
+def country_zones():
+    tzdata = pytest.importorskip("tzdata")
+    zones = {}
+    for line in resources.files(tzdata).joinpath("zoneinfo", "zone.tab").read_text(encoding="utf-8").splitlines():
+        if line and not line.startswith("#"):
+            fields = line.split("\t")
+            zones.setdefault(fields[0], []).append(fields[2])
+    return zones
+
+
+@pytest.mark.parametrize("country, zone", [
+    ("FR", "Europe/Paris"), ("ES", "Europe/Madrid"), ("DE", "Europe/Berlin"), ("GB", "Europe/London"),
+    ("US", "America/New_York"), ("IN", "Asia/Kolkata"), ("JP", "Asia/Tokyo"), *COUNTRY_DEFAULT_ZONES.items(),
+])
+def test_country_default_matches_its_main_zone(country, zone):
+    assert country_to_timezone(country) == iana_to_windows_timezone(zone)
+
+
+def test_every_country_default_is_one_of_its_zones():
+    for country, zones in country_zones().items():
+        windows_ids = {iana_to_windows_timezone(zone) for zone in zones} - {None}
+        if windows_ids:
+            assert country_to_timezone(country) in windows_ids, country
+        assert country_to_timezone(country.lower()) == country_to_timezone(country)
+
+
+def test_aliases_and_unknown_names():
+    assert iana_to_windows_timezone("Asia/Calcutta") == iana_to_windows_timezone("Asia/Kolkata") == "India Standard Time"
+    assert iana_to_windows_timezone("Europe/Kiev") == "FLE Standard Time"
+    assert iana_to_windows_timezone("Mars/Olympus") is None
+    assert iana_to_windows_timezone(None) is None
+    assert country_to_timezone("ZZ") is None
@@ -0,0 +1,26 @@
+from fake_winrm import HostProfile
+
+REQUEST = {"serverIp": "127.0.0.2", "password": "x", "proxyIpPort": "198.51.100.7:3128"}
+
+
+def span_names(timings):
+    return [span["name"] for span in timings["spans"]]
+
+
+def test_timings_are_returned_on_request_only(client):
+    assert "timings" not in client.post("/api/execute-script", json=REQUEST).get_json()
+
+    timings = client.post("/api/execute-script", json={**REQUEST, "includeTimings": True}).get_json()["timings"]
+    names = span_names(timings)
+    assert {"invoke_fused", "invoke_fused.set_proxy", "invoke_fused.ipinfo"} <= set(names)
+    assert [span["start_ms"] for span in timings["spans"]] == sorted(span["start_ms"] for span in timings["spans"])
+    assert all(span["remote"] for span in timings["spans"] if span["name"].startswith("invoke_fused."))
+    assert timings["total_ms"] >= max(span["start_ms"] for span in timings["spans"])
+
+
+def test_query_opt_in_and_failed_phases(client, fake_host):
+    fake_host.profiles["127.0.0.3"] = HostProfile(auth_fail=True)
+    response = client.post("/api/execute-script?timings=1", json={**REQUEST, "serverIp": "127.0.0.3"})
+    assert response.get_json()["error_code"] == "INVALID_CREDENTIALS"
+    failed = [span for span in response.get_json()["timings"]["spans"] if span.get("error_code")]
+    assert failed and all(span["error_code"] == "INVALID_CREDENTIALS" for span in failed)
@@ -0,0 +1,93 @@
+import datetime
+import ipaddress
+
+import pytest
+from prometheus_client import REGISTRY
+
+import winrm_diagnostics
+import winrm_pool
+from conftest import unused_port
+from fake_winrm import FakeWinRM, start_fake_winrm
+from winrm_diagnostics import run_preflight_check
+from winrm_pool import TRANSPORTS, RunspacePoolCache, TransportMemo
+
+TARGET = "127.0.0.1"
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    """
+    Self-signed certificate for 127.0.0.1, like the ones WinRM HTTPS listeners mostly use.
+    """
+    x509 = pytest.importorskip("cryptography.x509")
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, TARGET)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(TARGET))]), False)
+            .sign(key, hashes.SHA256()))
+    path = tmp_path_factory.mktemp("tls") / "winrm.pem"
+    path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                       serialization.NoEncryption())
+                     + cert.public_bytes(serialization.Encoding.PEM))
+    return str(path)
+
+
+@pytest.fixture
+def https_only(certificate, monkeypatch):
+    """
+    A fake WinRM listener on the HTTPS port only; the HTTP port is closed.
+    """
+    fake = FakeWinRM()
+    server = start_fake_winrm(fake, TARGET, 0, certfile=certificate)
+    fake.port = server.server_address[1]
+    closed = unused_port()
+    for module in (winrm_pool, winrm_diagnostics):
+        monkeypatch.setattr(module, "WINRM_HTTP_PORT", closed)
+        monkeypatch.setattr(module, "WINRM_HTTPS_PORT", fake.port)
+    yield fake
+    winrm_pool.POOL_CACHE.close_all()
+    TRANSPORTS._use_ssl.pop(TARGET, None)
+    server.shutdown()
+    server.server_close()
+
+
+def handshakes(kind):
+    return REGISTRY.get_sample_value("dashrdp_winrm_tls_handshakes_total", {"handshake": kind}) or 0
+
+
+def test_transport_memo():
+    memo = TransportMemo(mode="auto", max_size=2)
+    memo.remember("10.0.0.1", use_ssl=True)
+    assert memo.port_and_ssl("10.0.0.1") == (winrm_pool.WINRM_HTTPS_PORT, True)
+    assert memo.port_and_ssl("10.0.0.2") == (winrm_pool.WINRM_HTTP_PORT, False)
+    memo.remember("10.0.0.2", use_ssl=False)
+    memo.remember("10.0.0.3", use_ssl=True)
+    assert not memo.use_ssl("10.0.0.1")  # least recently remembered, evicted
+    assert TransportMemo(mode="https").use_ssl("10.0.0.9")
+    assert not TransportMemo(mode="http").use_ssl("10.0.0.3")
+
+
+def test_preflight_picks_https_for_the_session(https_only):
+    assert run_preflight_check(TARGET, "x")["success"]
+    assert TRANSPORTS.port_and_ssl(TARGET) == (https_only.port, True)
+    assert https_only.stats["shells_opened"] == 1
+
+
+def test_new_pools_resume_the_tls_session(https_only):
+    cache = RunspacePoolCache(idle_ttl=60, health_check_after=60)
+    full, resumed = handshakes("full"), handshakes("resumed")
+    with cache.lease(TARGET, "first", https_only.port, use_ssl=True):
+        pass
+    # The session ticket is kept when the connection closes
+    cache.close_all()
+    with cache.lease(TARGET, "second", https_only.port, use_ssl=True):
+        pass
+    cache.close_all()
+    assert handshakes("full") - full == 1
+    assert handshakes("resumed") - resumed >= 1
@@ -0,0 +1,46 @@
+from app import DRIFT_DRIFTED, DRIFT_OK
+
+PROXY = "198.51.100.7:3128"
+
+
+def verify(client, target, **fields):
+    return client.post("/api/verify", json={"serverIp": target, "password": "x", "proxyIpPort": PROXY, **fields})
+
+
+def test_configured_host_verifies_clean(client, fake_host):
+    assert client.post("/api/execute-script", json={
+        "serverIp": "127.0.0.2", "password": "x", "proxyIpPort": PROXY,
+    }).get_json()["success"]
+
+    body = verify(client, "127.0.0.2", expectedPublicIp="203.0.113.10",
+                  expectedTimezone="W. Europe Standard Time").get_json()
+    assert body["success"] is True
+    assert body["status"] == DRIFT_OK
+    assert body["drift"] == []
+    assert body["observed"]["public_ip"] == "203.0.113.10"
+
+
+def test_unconfigured_host_reports_drift_and_is_left_alone(client, fake_host):
+    response = verify(client, "127.0.0.3")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["status"] == DRIFT_DRIFTED
+    checks = {entry["check"] for entry in body["drift"]}
+    assert checks == {"proxy_registry", "public_ip"}
+    assert any(entry.get("detail") == "Traffic exits via the server IP (proxy not in use)"
+               for entry in body["drift"])
+    # Read-only: the proxy is still unset on the host
+    assert "127.0.0.3" not in fake_host.proxies
+
+
+def test_changed_exit_ip_and_timezone_are_drift(client, fake_host):
+    client.post("/api/execute-script", json={"serverIp": "127.0.0.4", "password": "x", "proxyIpPort": PROXY})
+    body = verify(client, "127.0.0.4", expectedPublicIp="192.0.2.1", expectedTimezone="UTC").get_json()
+    assert {entry["check"]: entry["actual"] for entry in body["drift"]} == {
+        "public_ip": "203.0.113.10",
+        "timezone": "W. Europe Standard Time",
+    }
+
+
+def test_missing_fields_are_rejected(client):
+    assert client.post("/api/verify", json={"serverIp": "127.0.0.2"}).status_code == 400
@@ -0,0 +1,104 @@
+import time
+from dataclasses import replace
+
+import pytest
+from pypsrp.powershell import PowerShell
+from pypsrp.wsman import WSMan
+
+from deadline import DeadlineExceeded, deadline_scope
+from fake_winrm import FakeWinRM, HostProfile, start_fake_winrm
+from remote_scripts import HOSTNAME, SCRIPT_LIBRARY
+from winrm_pool import (
+    WINRM_CONNECT_TIMEOUT_SECONDS,
+    WINRM_OPERATION_TIMEOUT_SECONDS,
+    RunspacePoolCache,
+    apply_timeouts,
+    invoke_pipeline,
+)
+
+TARGET = "127.0.0.1"
+
+
+@pytest.fixture
+def fake():
+    fake = FakeWinRM()
+    server = start_fake_winrm(fake, TARGET, 0)
+    fake.port = server.server_address[1]
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache():
+    cache = RunspacePoolCache(idle_ttl=60, health_check_after=60)
+    yield cache
+    cache.close_all()
+
+
+def test_pool_is_reused_and_library_defined_once(fake, cache):
+    for _ in range(2):
+        with cache.lease(TARGET, "x", fake.port) as pool:
+            ps = PowerShell(pool)
+            ps.add_cmdlet(HOSTNAME)
+            invoke_pipeline(ps, "invoke_hostname")
+            assert not ps.had_errors
+    assert fake.stats["shells_opened"] == 1
+    assert fake.stats["library_definitions"] == 1
+    assert len(cache) == 1
+
+
+def test_new_library_version_is_defined_on_cached_pools(fake, cache):
+    with cache.lease(TARGET, "x", fake.port):
+        pass
+    cache.library = replace(SCRIPT_LIBRARY, version="next")
+    with cache.lease(TARGET, "x", fake.port):
+        pass
+    assert fake.stats["shells_opened"] == 1
+    assert fake.stats["library_definitions"] == 2
+
+
+def test_other_credentials_get_their_own_pool(fake, cache):
+    with cache.lease(TARGET, "first", fake.port), cache.lease(TARGET, "second", fake.port):
+        pass
+    assert fake.stats["shells_opened"] == 2
+    assert len(cache) == 2
+
+
+def test_pool_that_raised_is_closed_not_returned(fake, cache):
+    with pytest.raises(RuntimeError):
+        with cache.lease(TARGET, "x", fake.port):
+            raise RuntimeError()
+    assert len(cache) == 0
+
+
+def test_timeouts_are_fitted_into_the_budget():
+    connection = WSMan(TARGET, username="Administrator", password="x", auth="basic", encryption="never")
+    apply_timeouts(connection, 6)
+    assert connection.transport.read_timeout == 6
+    assert connection.operation_timeout == 5
+    assert connection.transport.connection_timeout == min(WINRM_CONNECT_TIMEOUT_SECONDS, 6)
+
+    # Never so short that the listener cannot answer, and back to the caps without a budget
+    apply_timeouts(connection, 0.1)
+    assert connection.transport.read_timeout == 2.0
+    assert connection.operation_timeout == 1
+    apply_timeouts(connection)
+    assert connection.operation_timeout == WINRM_OPERATION_TIMEOUT_SECONDS
+    assert connection.transport.read_timeout > connection.operation_timeout
+
+
+def test_hung_invoke_stops_at_the_deadline_and_discards_the_pool(fake, cache):
+    with cache.lease(TARGET, "x", fake.port):
+        pass
+    fake.profiles[TARGET] = HostProfile(script_latency=5)
+    started = time.monotonic()
+    with deadline_scope(1):
+        with pytest.raises(DeadlineExceeded) as excinfo:
+            with cache.lease(TARGET, "x", fake.port) as pool:
+                ps = PowerShell(pool)
+                ps.add_cmdlet(HOSTNAME)
+                invoke_pipeline(ps, "invoke_hostname")
+    assert excinfo.value.phase == "invoke_hostname"
+    assert time.monotonic() - started < 3
+    assert len(cache) == 0
@@ -0,0 +1,65 @@
+import json
+import os
+from functools import lru_cache
+from typing import Optional
+
+# Generated by tools/build_timezone_index.py from CLDR windowsZones and tzdata.
+TIMEZONE_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "timezones.json")
+
+# Most populous zone for the countries whose first zone.tab entry is a smaller
+# one. They are mapped through the same index as ipinfo's IANA zone, so the
+# country fallback never disagrees with the zone it stands in for.
+COUNTRY_DEFAULT_ZONES = {
+    "AU": "Australia/Sydney",
+    "BR": "America/Sao_Paulo",
+    "CA": "America/Toronto",
+    "RU": "Europe/Moscow",
+    "UA": "Europe/Kyiv",
+}
+
+
+def load_timezone_index(path: str = TIMEZONE_INDEX_PATH) -> dict:
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+TIMEZONE_INDEX = load_timezone_index()
+TIMEZONE_ALIASES: dict[str, str] = TIMEZONE_INDEX["aliases"]
+
+# Every IANA name (canonical or alias) -> Windows zone ID, flattened so lookups
+# (and the copy shipped to the remote host) never need a second alias hop.
+IANA_TO_WINDOWS_TIMEZONE: dict[str, str] = dict(TIMEZONE_INDEX["iana_to_windows"])
+for _alias, _target in TIMEZONE_ALIASES.items():
+    if _alias not in IANA_TO_WINDOWS_TIMEZONE and _target in IANA_TO_WINDOWS_TIMEZONE:
+        IANA_TO_WINDOWS_TIMEZONE[_alias] = IANA_TO_WINDOWS_TIMEZONE[_target]
+
+COUNTRY_TO_WINDOWS_TIMEZONE: dict[str, str] = {
+    **TIMEZONE_INDEX["country_defaults"],
+    **{country: IANA_TO_WINDOWS_TIMEZONE[zone] for country, zone in COUNTRY_DEFAULT_ZONES.items()},
+}
+
+
+def canonical_timezone(iana_timezone: str) -> str:
+    return TIMEZONE_ALIASES.get(iana_timezone, iana_timezone)
+
+
+@lru_cache(maxsize=1024)
+def iana_to_windows_timezone(iana_timezone: Optional[str]) -> Optional[str]:
+    """
+    Convert IANA timezone name to Windows timezone ID
+    Returns Windows timezone ID or None if not found
+    """
+    if not iana_timezone:
+        return None
+    return IANA_TO_WINDOWS_TIMEZONE.get(iana_timezone) or IANA_TO_WINDOWS_TIMEZONE.get(canonical_timezone(iana_timezone))
+
+
+@lru_cache(maxsize=512)
+def country_to_timezone(country_code: Optional[str]) -> Optional[str]:
+    """
+    Map country code to most common Windows timezone ID for that country
+    Returns Windows timezone ID or None if not found
+    """
+    if not country_code:
+        return None
+    return COUNTRY_TO_WINDOWS_TIMEZONE.get(country_code.upper())
@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+
+class SpanRecorder:
+    """
+    Collects the phases of one request (or one batch item / job) as flat spans
+    with start offsets, so nested phases such as connect > pool_open show up
+    as overlapping intervals.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: list = []
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def add(self, name: str, start_ms: float, duration_ms: float, error_code: Optional[str] = None,
+            remote: bool = False) -> None:
+        span = {"name": name, "start_ms": round(max(0.0, start_ms), 1), "duration_ms": round(duration_ms, 1)}
+        if error_code:
+            span["error_code"] = error_code
+        if remote:
+            span["remote"] = True
+        self.spans.append(span)
+
+    def record(self, name: str, seconds: float, error_code: Optional[str] = None) -> None:
+        # Called when the phase ends, so it started `seconds` ago.
+        self.add(name, self.elapsed_ms() - seconds * 1000, seconds * 1000, error_code)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "total_ms": round(self.elapsed_ms(), 1),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+
+current_recorder: ContextVar[Optional[SpanRecorder]] = ContextVar("current_recorder", default=None)
+
+
+@contextmanager
+def recording() -> Iterator[SpanRecorder]:
+    recorder = SpanRecorder()
+    token = current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        current_recorder.reset(token)
+
+
+def record_span(name: str, seconds: float, error_code: Optional[str] = None) -> None:
+    recorder = current_recorder.get()
+    if recorder is not None:
+        recorder.record(name, seconds, error_code)
+
+
+def record_remote_spans(invoke_step: str, remote_timings: Optional[dict[str, Any]]) -> None:
+    """
+    Record Stopwatch timings (ms) reported by a remote script as spans named
+    "<invoke_step>.<name>", laid out back to back and ending now (when the
+    invoke that produced them returned).
+    """
+    recorder = current_recorder.get()
+    if recorder is None or not remote_timings:
+        return
+    durations = [(name, float(ms)) for name, ms in remote_timings.items() if ms is not None]
+    cursor = recorder.elapsed_ms() - sum(ms for _, ms in durations)
+    for name, ms in durations:
+        recorder.add(f"{invoke_step}.{name}", cursor, ms, remote=True)
+        cursor += ms
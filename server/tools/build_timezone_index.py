@@ -0,0 +1,114 @@
+"""
+Regenerate data/timezones.json, the bundled timezone index loaded by timezones.py.
+
+Sources:
+  - IANA -> Windows zone IDs from the Unicode CLDR windowsZones supplemental data,
+    either a windowsZones.xml passed with --cldr or the copy packaged by tzlocal.
+  - Link (alias) lines and the country -> zone table from the IANA tz database
+    shipped in the `tzdata` package.
+
+Usage:
+    pip install tzdata tzlocal
+    python tools/build_timezone_index.py [--cldr path/to/windowsZones.xml]
+"""
+import argparse
+import json
+import os
+import xml.etree.ElementTree as ET
+from importlib import resources
+
+OUTPUT_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "data", "timezones.json")
+
+
+def load_cldr_mapping(cldr_path):
+    if cldr_path:
+        mapping = {}
+        root = ET.parse(cldr_path).getroot()
+        for zone in root.iter("mapZone"):
+            windows_id = zone.get("other")
+            for iana in zone.get("type", "").split():
+                # The "001" territory row is the primary zone for a Windows ID
+                if zone.get("territory") == "001" or iana not in mapping:
+                    mapping[iana] = windows_id
+        source = os.path.basename(cldr_path)
+    else:
+        from tzlocal import windows_tz
+        mapping = {iana: windows_id for iana, windows_id in windows_tz.tz_win.items() if iana}
+        source = "tzlocal.windows_tz (CLDR windowsZones)"
+    return mapping, source
+
+
+def read_tzdata_file(name):
+    return resources.files("tzdata").joinpath("zoneinfo", name).read_text(encoding="utf-8")
+
+
+def load_links():
+    links = {}
+    for line in read_tzdata_file("tzdata.zi").splitlines():
+        if line.startswith("L "):
+            _, target, alias = line.split()
+            links[alias] = target
+    return links
+
+
+def load_country_zones():
+    countries = {}
+    for line in read_tzdata_file("zone.tab").splitlines():
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        countries.setdefault(fields[0], []).append(fields[2])
+    return countries
+
+
+def build_index(cldr_path=None):
+    mapping, source = load_cldr_mapping(cldr_path)
+    links = load_links()
+
+    # Fill in aliases (both directions) that CLDR lists under the other name
+    for alias, target in links.items():
+        if alias not in mapping and target in mapping:
+            mapping[alias] = mapping[target]
+        elif target not in mapping and alias in mapping:
+            mapping[target] = mapping[alias]
+
+    lowered = {}
+    for name in mapping:
+        if name.lower() in lowered:
+            raise SystemExit(f"Zone names differ only by case: {name} / {lowered[name.lower()]}")
+        lowered[name.lower()] = name
+
+    # First zone listed for a country that has a Windows mapping
+    country_defaults = {}
+    for country, zones in load_country_zones().items():
+        for zone in zones:
+            windows_id = mapping.get(zone) or mapping.get(links.get(zone, ""))
+            if windows_id:
+                country_defaults[country] = windows_id
+                break
+
+    import tzdata
+    return {
+        "source": {"windows_zones": source, "tzdata": tzdata.IANA_VERSION},
+        "iana_to_windows": dict(sorted(mapping.items())),
+        "aliases": dict(sorted(links.items())),
+        "country_defaults": dict(sorted(country_defaults.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cldr", help="Path to CLDR common/supplemental/windowsZones.xml")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    args = parser.parse_args()
+
+    index = build_index(args.cldr)
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(index, handle, indent=1, sort_keys=False)
+        handle.write("\n")
+    print(f"Wrote {len(index['iana_to_windows'])} zones, {len(index['aliases'])} aliases, "
+          f"{len(index['country_defaults'])} countries to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,29 @@
+import asyncio
 import socket
+import time
+from contextvars import ContextVar
 from typing import Any, Optional
 
-from pypsrp.powershell import PowerShell, RunspacePool
-from pypsrp.wsman import WSMan
+from pypsrp.powershell import PowerShell
+
+from admission import ADMISSION, AdmissionRejected
+from circuit_breaker import CIRCUIT_BREAKER, CircuitOpenError
+from deadline import TIMEOUT, DeadlineExceeded, deadline_expired, phase_timeout
+from metrics import observe_phase, timed_phase
+from proxy_probe import ProxyUnreachable
+from remote_scripts import HOSTNAME
+from winrm_pool import POOL_CACHE, TRANSPORTS, WINRM_HTTP_PORT, WINRM_HTTPS_PORT, invoke_pipeline
 
-WINRM_HTTP_PORT = 5985
-WINRM_HTTPS_PORT = 5986
 TCP_TIMEOUT_SECONDS = 5
+# When 5986 answers first, how long a still-pending 5985 gets to answer (HTTP is preferred)
+HTTP_PREFERENCE_GRACE_SECONDS = 0.25
+SCAN_CONCURRENCY = 200
+
+# (target_ip, probe_winrm_ports result) probed ahead of the view by the ASGI layer
+# on its event loop; run_port_stage uses it instead of probing again.
+prefetched_port_results: ContextVar[Optional[tuple[str, dict[int, tuple[bool, str]]]]] = ContextVar(
+    "prefetched_port_results", default=None
+)
 
 ERROR_CATALOG = {
     "SERVER_UNREACHABLE": {
@@ -25,6 +42,10 @@ ERROR_CATALOG = {
         "error_title": "WinRM not configured",
         "recommendation": "Run 'Enable-PSRemoting -Force' on the target server and verify WinRM service is running.",
     },
+    "WINRM_CERT_UNTRUSTED": {
+        "error_title": "WinRM HTTPS certificate not trusted",
+        "recommendation": "The server only accepts WinRM over HTTPS (5986) and its certificate failed validation. Install a certificate with the server IP in its SAN, or set WINRM_CERT_VALIDATION to a CA bundle path or 'ignore'.",
+    },
     "DNS_RESOLUTION_FAILED": {
         "error_title": "Hostname could not be resolved",
         "recommendation": "Use the numeric server IP from WHMCS instead of a hostname.",
@@ -37,6 +58,22 @@ ERROR_CATALOG = {
         "error_title": "Proxy not active",
         "recommendation": "WinRM connected but traffic still exits via the server IP. Verify proxy IP:Port and that the proxy service is running.",
     },
+    "PROXY_UNREACHABLE": {
+        "error_title": "Proxy not reachable",
+        "recommendation": "The proxy failed a check from the API server, so the server was left untouched. Verify the proxy IP:Port and that the proxy service is running and accepts CONNECT.",
+    },
+    "TIMEOUT": {
+        "error_title": "Operation timed out",
+        "recommendation": "The server did not finish within the request deadline, so its session was closed. Retry, or pass a longer \"deadline\" (seconds, up to the API server's maximum).",
+    },
+    "SERVER_BUSY": {
+        "error_title": "API server busy",
+        "recommendation": "Too many servers are being configured at once. Retry after the indicated delay.",
+    },
+    "TARGET_BUSY": {
+        "error_title": "Server already being configured",
+        "recommendation": "Another configuration of this server is still running. Wait for it to finish, then retry.",
+    },
     "UNKNOWN_ERROR": {
         "error_title": "Unexpected error",
         "recommendation": "Retry the operation. If it persists, check API server logs.",
@@ -61,16 +98,36 @@ def build_error_response(error_code: str, error_detail: str, target_ip: Optional
 
 
 def classify_connection_error(exc: Exception, target_ip: Optional[str] = None) -> dict[str, Any]:
+    if isinstance(exc, CircuitOpenError):
+        return dict(exc.error_info)
+    if isinstance(exc, AdmissionRejected):
+        return {**build_error_response(exc.error_code, exc.detail, target_ip), "retry_after": exc.retry_after}
+    if isinstance(exc, (ProxyUnreachable, DeadlineExceeded)):
+        return build_error_response(exc.error_code, exc.detail, target_ip)
+
     message = str(exc)
     lowered = message.lower()
 
-    if any(token in lowered for token in ("401", "unauthorized", "access is denied", "logon failure", "bad password", "unknown user name")):
+    if any(token in lowered for token in (
+        "401", "unauthorized", "access is denied", "logon failure", "bad password", "unknown user name",
+        "failed to authenticate",
+    )):
         return build_error_response(
             "INVALID_CREDENTIALS",
             "WinRM rejected the Administrator password.",
             target_ip,
         )
 
+    if any(token in lowered for token in (
+        "certificate verify failed", "certificate_verify_failed", "self-signed certificate", "self signed certificate",
+        "hostname mismatch", "doesn't match",
+    )):
+        return build_error_response(
+            "WINRM_CERT_UNTRUSTED",
+            f"WinRM HTTPS certificate validation failed: {message}",
+            target_ip,
+        )
+
     if any(token in lowered for token in ("name or service not known", "nodename nor servname", "getaddrinfo failed")):
         return build_error_response(
             "DNS_RESOLUTION_FAILED",
@@ -79,6 +136,9 @@ def classify_connection_error(exc: Exception, target_ip: Optional[str] = None) -
         )
 
     if any(token in lowered for token in ("timed out", "timeout", "no route to host", "network is unreachable", "host is down")):
+        if deadline_expired():
+            # Cut short by the request deadline (the WS-Man timeouts were fitted to it)
+            return build_error_response(TIMEOUT, f"Request deadline reached: {message}", target_ip)
         return build_error_response(
             "SERVER_UNREACHABLE",
             "Could not reach the server — connection timed out or host is offline.",
@@ -102,51 +162,159 @@ def classify_connection_error(exc: Exception, target_ip: Optional[str] = None) -
     return build_error_response("UNKNOWN_ERROR", message, target_ip)
 
 
-def check_tcp_port(host: str, port: int, timeout: int = TCP_TIMEOUT_SECONDS) -> tuple[bool, str]:
+def describe_port_error(port: int, exc: OSError, timeout: float) -> str:
+    if isinstance(exc, (socket.timeout, asyncio.TimeoutError)):
+        return f"Port {port} timed out after {timeout}s"
+    if isinstance(exc, ConnectionRefusedError):
+        return f"Port {port} refused the connection"
+    lowered = str(exc).lower()
+    if "timed out" in lowered:
+        return f"Port {port} timed out — server may be offline"
+    if "unreachable" in lowered or "no route" in lowered:
+        return "Server is unreachable on the network"
+    return str(exc)
+
+
+def port_error_code(exc: OSError) -> str:
+    if isinstance(exc, (socket.timeout, asyncio.TimeoutError)):
+        return "SERVER_UNREACHABLE"
+    if isinstance(exc, ConnectionRefusedError):
+        return "WINRM_PORT_CLOSED"
+    return classify_connection_error(exc)["error_code"]
+
+
+async def check_tcp_port_async(host: str, port: int, timeout: float = TCP_TIMEOUT_SECONDS) -> tuple[bool, str]:
+    started = time.perf_counter()
     try:
-        with socket.create_connection((host, port), timeout=timeout):
-            return True, f"Port {port} is open"
-    except socket.timeout:
-        return False, f"Port {port} timed out after {timeout}s"
-    except ConnectionRefusedError:
-        return False, f"Port {port} refused the connection"
-    except OSError as exc:
-        lowered = str(exc).lower()
-        if "timed out" in lowered:
-            return False, f"Port {port} timed out — server may be offline"
-        if "unreachable" in lowered or "no route" in lowered:
-            return False, "Server is unreachable on the network"
-        return False, str(exc)
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError) as exc:
+        observe_phase("tcp_probe", time.perf_counter() - started, port_error_code(exc))
+        return False, describe_port_error(port, exc, timeout)
+    observe_phase("tcp_probe", time.perf_counter() - started)
+    writer.close()
+    return True, f"Port {port} is open"
+
+
+async def probe_winrm_ports_async(host: str, timeout: float = TCP_TIMEOUT_SECONDS,
+                                  short_circuit: bool = True) -> dict[int, tuple[bool, str]]:
+    """
+    Probe the WinRM HTTP and HTTPS ports concurrently. With short_circuit, the
+    first decisive answer ends the probe and the other one is cancelled: an open
+    HTTP port (HTTPS is left out of the result), or an open HTTPS port while HTTP
+    is still pending after HTTP_PREFERENCE_GRACE_SECONDS (HTTP is reported closed).
+    """
+    probes = {
+        asyncio.ensure_future(check_tcp_port_async(host, WINRM_HTTP_PORT, timeout)): WINRM_HTTP_PORT,
+        asyncio.ensure_future(check_tcp_port_async(host, WINRM_HTTPS_PORT, timeout)): WINRM_HTTPS_PORT,
+    }
+    results: dict[int, tuple[bool, str]] = {}
+    pending = set(probes)
+
+    async def collect(wait_timeout: Optional[float] = None) -> None:
+        nonlocal pending
+        done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+        for probe in done:
+            results[probes[probe]] = probe.result()
+
+    try:
+        while pending:
+            await collect()
+            if not short_circuit:
+                continue
+            if results.get(WINRM_HTTP_PORT, (False, ""))[0]:
+                break
+            if results.get(WINRM_HTTPS_PORT, (False, ""))[0] and WINRM_HTTP_PORT not in results:
+                await collect(HTTP_PREFERENCE_GRACE_SECONDS)
+                results.setdefault(WINRM_HTTP_PORT, (
+                    False, f"Port {WINRM_HTTP_PORT} did not answer before port {WINRM_HTTPS_PORT} was chosen"))
+                break
+    finally:
+        for probe in pending:
+            probe.cancel()
+    return results
+
+
+def probe_winrm_ports(host: str, timeout: float = TCP_TIMEOUT_SECONDS) -> dict[int, tuple[bool, str]]:
+    return asyncio.run(probe_winrm_ports_async(host, timeout))
+
+
+async def scan_winrm_ports_async(hosts: list, concurrency: int = SCAN_CONCURRENCY,
+                                 timeout: float = TCP_TIMEOUT_SECONDS) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scan_host(host: str) -> dict[str, Any]:
+        async with semaphore:
+            results = await probe_winrm_ports_async(host, timeout, short_circuit=False)
+        http_open, http_message = results[WINRM_HTTP_PORT]
+        https_open, https_message = results[WINRM_HTTPS_PORT]
+        row = {
+            "serverIp": host,
+            "reachable": http_open or https_open,
+            "winrm_port": {"port": WINRM_HTTP_PORT, "ok": http_open, "message": http_message},
+            "winrm_ssl_port": {"port": WINRM_HTTPS_PORT, "ok": https_open, "message": https_message},
+        }
+        if not row["reachable"]:
+            row["error_code"] = "WINRM_PORT_CLOSED"
+        return row
+
+    return await asyncio.gather(*(scan_host(host) for host in hosts))
+
+
+def scan_winrm_ports(hosts: list, concurrency: int = SCAN_CONCURRENCY,
+                     timeout: float = TCP_TIMEOUT_SECONDS) -> list:
+    return asyncio.run(scan_winrm_ports_async(hosts, concurrency, timeout))
 
 
 def test_winrm_credentials(target_ip: str, password: str, use_ssl: bool = False) -> tuple[bool, str]:
     port = WINRM_HTTPS_PORT if use_ssl else WINRM_HTTP_PORT
     try:
-        wsman = WSMan(
-            target_ip,
-            username="Administrator",
-            password=password,
-            ssl=use_ssl,
-            port=port,
-            auth="basic",
-            encryption="never",
-        )
-        pool = RunspacePool(wsman)
-        pool.open()
-        ps = PowerShell(pool)
-        ps.add_script("$env:COMPUTERNAME")
-        output = ps.invoke()
-        pool.close()
+        with timed_phase("wsman_auth"), POOL_CACHE.lease(target_ip, password, port, use_ssl=use_ssl) as pool:
+            ps = PowerShell(pool)
+            ps.add_cmdlet(HOSTNAME)
+            with timed_phase("invoke_hostname"):
+                output = invoke_pipeline(ps, "invoke_hostname")
         hostname = output[0].strip() if output else "unknown"
-        return True, f"Authenticated successfully (hostname: {hostname})"
+        transport = "HTTPS" if use_ssl else "HTTP"
+        return True, f"Authenticated successfully over {transport} (hostname: {hostname})"
     except Exception as exc:
+        if isinstance(exc, DeadlineExceeded) or deadline_expired():
+            # Out of time says nothing about the credentials
+            raise
         return False, str(exc)
 
 
 def run_preflight_check(target_ip: str, password: str) -> dict[str, Any]:
+    cached_error = CIRCUIT_BREAKER.check(target_ip)
+    if cached_error is not None:
+        return {"success": False, "checks": [], **cached_error}
+
+    try:
+        result = run_preflight_stages(target_ip, password)
+    except AdmissionRejected:
+        # Says nothing about the host, so leave the circuit as it is (but free a claimed probe)
+        CIRCUIT_BREAKER.release(target_ip)
+        raise
+    except Exception as exc:
+        CIRCUIT_BREAKER.record(target_ip, classify_connection_error(exc, target_ip))
+        raise
+    CIRCUIT_BREAKER.record(target_ip, None if result["success"] else result)
+    return result
+
+
+def run_port_stage(target_ip: str) -> tuple[list, Optional[dict[str, Any]]]:
+    """
+    TCP stage of the preflight. Returns the checks so far and an error payload
+    if neither WinRM port is reachable. Remembers the transport to use for the
+    target: HTTP if 5985 answered, else HTTPS.
+    """
     checks: list = []
 
-    port_open, port_message = check_tcp_port(target_ip, WINRM_HTTP_PORT)
+    prefetched = prefetched_port_results.get()
+    if prefetched is not None and prefetched[0] == target_ip:
+        port_results = prefetched[1]
+    else:
+        port_results = probe_winrm_ports(target_ip, phase_timeout("tcp_probe", TCP_TIMEOUT_SECONDS))
+    port_open, port_message = port_results[WINRM_HTTP_PORT]
     checks.append({
         "name": "winrm_port",
         "label": f"WinRM port {WINRM_HTTP_PORT}",
@@ -155,7 +323,7 @@ def run_preflight_check(target_ip: str, password: str) -> dict[str, Any]:
     })
 
     if not port_open:
-        ssl_open, ssl_message = check_tcp_port(target_ip, WINRM_HTTPS_PORT)
+        ssl_open, ssl_message = port_results[WINRM_HTTPS_PORT]
         checks.append({
             "name": "winrm_ssl_port",
             "label": f"WinRM SSL port {WINRM_HTTPS_PORT}",
@@ -163,24 +331,38 @@ def run_preflight_check(target_ip: str, password: str) -> dict[str, Any]:
             "message": ssl_message,
         })
         if not ssl_open:
-            error = build_error_response(
+            return checks, build_error_response(
                 "WINRM_PORT_CLOSED",
                 f"Neither WinRM port {WINRM_HTTP_PORT} nor {WINRM_HTTPS_PORT} is reachable.",
                 target_ip,
             )
-            return {
-                "success": False,
-                "checks": checks,
-                **error,
-            }
 
-    auth_ok, auth_message = test_winrm_credentials(target_ip, password, use_ssl=False)
-    checks.append({
+    TRANSPORTS.remember(target_ip, use_ssl=not port_open)
+    return checks, None
+
+
+def auth_check(auth_ok: bool, auth_message: str) -> dict[str, Any]:
+    return {
         "name": "winrm_auth",
         "label": "Administrator credentials",
         "ok": auth_ok,
         "message": auth_message if auth_ok else "Authentication failed",
-    })
+    }
+
+
+def run_preflight_stages(target_ip: str, password: str) -> dict[str, Any]:
+    checks, error = run_port_stage(target_ip)
+    if error is not None:
+        return {
+            "success": False,
+            "checks": checks,
+            **error,
+        }
+
+    # Read-only, so it only counts against the global session cap
+    with ADMISSION.admit(target_ip, mutate=False):
+        auth_ok, auth_message = test_winrm_credentials(target_ip, password, use_ssl=TRANSPORTS.use_ssl(target_ip))
+    checks.append(auth_check(auth_ok, auth_message))
 
     if not auth_ok:
         error = classify_connection_error(Exception(auth_message), target_ip)
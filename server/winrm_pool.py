@@ -0,0 +1,428 @@
+import atexit
+import hashlib
+import hmac
+import logging
+import math
+import os
+import secrets
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional, Union
+
+from pypsrp.complex_objects import PSInvocationState, RunspacePoolState
+from pypsrp.powershell import PowerShell, RunspacePool
+from pypsrp.wsman import WSMan
+from requests.adapters import HTTPAdapter
+
+from deadline import current_deadline, remaining_budget
+from metrics import WINRM_TLS_HANDSHAKES, timed_phase
+from remote_scripts import SCRIPT_LIBRARY, ScriptLibrary
+
+logger = logging.getLogger(__name__)
+
+WINRM_USERNAME = "Administrator"
+WINRM_HTTP_PORT = 5985
+WINRM_HTTPS_PORT = 5986
+# "auto": HTTP on 5985 unless the last preflight found only 5986 open; "http" or "https" forces one.
+WINRM_TRANSPORT = os.environ.get("WINRM_TRANSPORT", "auto")
+# HTTPS certificate checks: "ignore" (WinRM listeners mostly use self-signed certificates),
+# "validate" (system CA store) or the path of a CA bundle to validate against.
+WINRM_CERT_VALIDATION = os.environ.get("WINRM_CERT_VALIDATION", "ignore")
+WINRM_TRANSPORT_MEMO_SIZE = int(os.environ.get("WINRM_TRANSPORT_MEMO_SIZE", "10000"))
+TLS_SESSION_CACHE_SIZE = int(os.environ.get("WINRM_TLS_SESSION_CACHE_SIZE", "10000"))
+POOL_IDLE_TTL_SECONDS = float(os.environ.get("WINRM_POOL_IDLE_TTL", "120"))
+POOL_MAX_SIZE = int(os.environ.get("WINRM_POOL_MAX_SIZE", "32"))
+# Pools idle for longer than this get a cheap round trip before being reused.
+POOL_HEALTH_CHECK_AFTER_SECONDS = float(os.environ.get("WINRM_POOL_HEALTH_CHECK_AFTER", "15"))
+# Caps for one WS-Man exchange; a request deadline (deadline.py) shortens them further.
+WINRM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("WINRM_CONNECT_TIMEOUT_SECONDS", "10"))
+WINRM_OPERATION_TIMEOUT_SECONDS = int(os.environ.get("WINRM_OPERATION_TIMEOUT_SECONDS", "20"))
+# How much longer than the WS-Man OperationTimeout the HTTP read waits for the answer.
+WINRM_READ_TIMEOUT_MARGIN_SECONDS = 5
+# Budget for closing a pool that is being discarded (e.g. after its deadline ran out).
+POOL_CLOSE_TIMEOUT_SECONDS = float(os.environ.get("WINRM_POOL_CLOSE_TIMEOUT_SECONDS", "5"))
+
+# Per-process key so credential fingerprints are never comparable across restarts.
+_FINGERPRINT_KEY = secrets.token_bytes(32)
+
+PoolKey = tuple[str, int, bool, str]
+
+
+def credential_fingerprint(username: str, password: str) -> str:
+    message = f"{username}\0{password}".encode("utf-8")
+    return hmac.new(_FINGERPRINT_KEY, message, hashlib.sha256).hexdigest()
+
+
+def cert_validation_setting(mode: str = WINRM_CERT_VALIDATION) -> Union[bool, str]:
+    # In the form pypsrp and requests take it: a bool or a CA bundle path
+    if mode == "ignore":
+        return False
+    if mode == "validate":
+        return True
+    return mode
+
+
+def apply_timeouts(wsman: WSMan, budget: Optional[float] = None) -> None:
+    """
+    Fit the timeouts of a WSMan (and of pools already opened on it) into budget
+    seconds, or reset them to the caps. The HTTP read always outlasts the WS-Man
+    OperationTimeout, so the listener's own timeout fault arrives first.
+    """
+    if budget is None:
+        read = WINRM_OPERATION_TIMEOUT_SECONDS + WINRM_READ_TIMEOUT_MARGIN_SECONDS
+    else:
+        read = max(2.0, min(WINRM_OPERATION_TIMEOUT_SECONDS + WINRM_READ_TIMEOUT_MARGIN_SECONDS, budget))
+    wsman.operation_timeout = max(1, min(WINRM_OPERATION_TIMEOUT_SECONDS, math.floor(read - 1)))
+    wsman.transport.read_timeout = read
+    wsman.transport.connection_timeout = min(WINRM_CONNECT_TIMEOUT_SECONDS, read)
+
+
+def stop_pipeline(ps: PowerShell) -> None:
+    """
+    Stop a pipeline still running on the host, without letting a failure to do so
+    hide the exception that got us here.
+    """
+    if ps.state != PSInvocationState.RUNNING:
+        return
+    try:
+        apply_timeouts(ps.runspace_pool.connection, POOL_CLOSE_TIMEOUT_SECONDS)
+        ps.stop()
+    except Exception as exc:
+        logger.warning("Stopping remote pipeline failed: %s", exc)
+
+
+def invoke_pipeline(ps: PowerShell, phase: str) -> list:
+    """
+    ps.invoke(), bounded by the current deadline: every poll gets WS-Man timeouts
+    fitted into what is left of it, and once it runs out the pipeline is stopped
+    and DeadlineExceeded raised (the lease then closes the pool). pypsrp's own
+    invoke() keeps polling a hung pipeline forever.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return ps.invoke()
+    wsman = ps.runspace_pool.connection
+    ps.begin_invoke()
+    try:
+        while ps.state == PSInvocationState.RUNNING:
+            apply_timeouts(wsman, deadline.check(phase))
+            ps.poll_invoke(timeout=wsman.operation_timeout)
+    except BaseException:
+        stop_pipeline(ps)
+        raise
+    return ps.output
+
+
+class TransportMemo:
+    """
+    WinRM transport per target, learned from the preflight port stage: HTTPS for
+    hosts where only 5986 answered, HTTP otherwise. Bounded, least recently
+    remembered first out.
+    """
+
+    def __init__(self, mode: str = WINRM_TRANSPORT, max_size: int = WINRM_TRANSPORT_MEMO_SIZE):
+        self.mode = mode
+        self.max_size = max_size
+        self._use_ssl: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, target_ip: str, use_ssl: bool) -> None:
+        with self._lock:
+            self._use_ssl.pop(target_ip, None)
+            self._use_ssl[target_ip] = use_ssl
+            while len(self._use_ssl) > self.max_size:
+                self._use_ssl.popitem(last=False)
+
+    def use_ssl(self, target_ip: str) -> bool:
+        if self.mode != "auto":
+            return self.mode == "https"
+        with self._lock:
+            return self._use_ssl.get(target_ip, False)
+
+    def port_and_ssl(self, target_ip: str) -> tuple[int, bool]:
+        use_ssl = self.use_ssl(target_ip)
+        return (WINRM_HTTPS_PORT if use_ssl else WINRM_HTTP_PORT), use_ssl
+
+
+TRANSPORTS = TransportMemo()
+
+
+class SessionKeepingSSLSocket(ssl.SSLSocket):
+    def _real_close(self):
+        # A TLS 1.3 ticket arrives after the handshake, so the session worth keeping
+        # is the one the connection holds when it is closed.
+        if isinstance(self.context, ResumingSSLContext) and hasattr(self, "peer"):
+            self.context.keep_session(self)
+        super()._real_close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    Client context that offers the last TLS session negotiated with a peer when
+    connecting to it again, so a new connection (a new pool, or a reconnect after
+    the listener dropped an idle keep-alive) resumes instead of doing a full
+    handshake. Sessions are keyed by peer address and collected from each
+    connection after the handshake (TLS 1.2) or when it closes (TLS 1.3 tickets).
+    """
+
+    sslsocket_class = SessionKeepingSSLSocket
+
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._sessions: "OrderedDict[tuple, ssl.SSLSession]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def wrap_socket(self, sock, *args, session=None, **kwargs):
+        peer = sock.getpeername()[:2]
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(peer)
+        try:
+            tls_sock = super().wrap_socket(sock, *args, session=session, **kwargs)
+        except ssl.SSLError:
+            with self._sessions_lock:
+                self._sessions.pop(peer, None)
+            raise
+        WINRM_TLS_HANDSHAKES.labels("resumed" if tls_sock.session_reused else "full").inc()
+        tls_sock.peer = peer
+        self.keep_session(tls_sock)
+        return tls_sock
+
+    def keep_session(self, tls_sock: ssl.SSLSocket) -> None:
+        session = tls_sock.session
+        # A TLS 1.3 session is only resumable once its ticket has arrived
+        if session is None or (tls_sock.version() == "TLSv1.3" and not session.has_ticket):
+            return
+        with self._sessions_lock:
+            self._sessions.pop(tls_sock.peer, None)
+            self._sessions[tls_sock.peer] = session
+            while len(self._sessions) > TLS_SESSION_CACHE_SIZE:
+                self._sessions.popitem(last=False)
+
+
+def build_tls_context(validation: Union[bool, str] = cert_validation_setting()) -> ResumingSSLContext:
+    context = ResumingSSLContext()
+    if validation is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        # WinRM hosts are addressed by IP, so the certificate needs a matching IP SAN
+        context.load_default_certs()
+    return context
+
+
+# One context for the process: TLS sessions can only be resumed through the context that made them.
+TLS_CONTEXT = build_tls_context()
+
+
+class ResumingHTTPAdapter(HTTPAdapter):
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+
+@dataclass
+class PooledRunspace:
+    key: PoolKey
+    wsman: WSMan
+    pool: RunspacePool
+    # Version of the script library defined in the pool's runspace, if any
+    library_version: Optional[str] = None
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+    def idle_seconds(self, now: float) -> float:
+        return now - self.last_used
+
+
+class RunspacePoolCache:
+    """
+    Process-wide cache of opened WinRM RunspacePools.
+
+    Pools are leased exclusively: a pool checked out by one request is not
+    visible to others until it is returned, so concurrent requests to the same
+    host simply open a second pool. Pools that raise while leased are closed
+    rather than returned. The script library is defined in a pool's runspace
+    before its first lease (pools keep pypsrp's single runspace), so callers
+    only invoke its functions.
+    """
+
+    def __init__(self, idle_ttl: float = POOL_IDLE_TTL_SECONDS, max_size: int = POOL_MAX_SIZE,
+                 health_check_after: float = POOL_HEALTH_CHECK_AFTER_SECONDS,
+                 library: ScriptLibrary = SCRIPT_LIBRARY):
+        self.idle_ttl = idle_ttl
+        self.max_size = max_size
+        self.health_check_after = health_check_after
+        self.library = library
+        self._idle: "OrderedDict[PoolKey, PooledRunspace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lease_target(self, target_ip: str, password: str):
+        """
+        lease() on the transport TRANSPORTS picked for target_ip.
+        """
+        port, use_ssl = TRANSPORTS.port_and_ssl(target_ip)
+        return self.lease(target_ip, password, port, use_ssl)
+
+    @staticmethod
+    def make_key(target_ip: str, password: str, port: int, use_ssl: bool = False) -> PoolKey:
+        return (target_ip, port, use_ssl, credential_fingerprint(WINRM_USERNAME, password))
+
+    @contextmanager
+    def lease(self, target_ip: str, password: str, port: int, use_ssl: bool = False) -> Iterator[RunspacePool]:
+        """
+        Check out a cached pool or open one, with WS-Man timeouts fitted into the
+        current deadline (pool defaults without one).
+        """
+        key = self.make_key(target_ip, password, port, use_ssl)
+        with timed_phase("connect"):
+            budget = remaining_budget("connect")
+            entry = self._checkout(key, budget)
+            if entry is None:
+                entry = self._open(key, target_ip, password, port, use_ssl, budget)
+
+        try:
+            if entry.library_version != self.library.version:
+                self._define_library(entry)
+            yield entry.pool
+        except BaseException:
+            self._close(entry)
+            raise
+        else:
+            self._checkin(entry)
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries = list(self._idle.values())
+            self._idle.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def _checkout(self, key: PoolKey, budget: Optional[float] = None) -> Optional[PooledRunspace]:
+        now = time.monotonic()
+        with self._lock:
+            expired = self._pop_expired(now)
+            entry = self._idle.pop(key, None)
+        for stale in expired:
+            self._close(stale)
+
+        if entry is None:
+            return None
+        apply_timeouts(entry.wsman, budget)
+        if entry.idle_seconds(now) > self.health_check_after and not self._is_healthy(entry):
+            logger.info("Discarding unhealthy WinRM pool for %s", key[0])
+            self._close(entry)
+            return None
+        return entry
+
+    def _checkin(self, entry: PooledRunspace) -> None:
+        if entry.pool.state != RunspacePoolState.OPENED:
+            self._close(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        evicted: list = []
+        with self._lock:
+            displaced = self._idle.pop(entry.key, None)
+            if displaced is not None:
+                evicted.append(displaced)
+            self._idle[entry.key] = entry
+            while len(self._idle) > self.max_size:
+                evicted.append(self._idle.popitem(last=False)[1])
+        for old in evicted:
+            self._close(old)
+
+    def _pop_expired(self, now: float) -> list:
+        # Caller holds the lock. Entries are kept in last-used order.
+        expired: list = []
+        while self._idle:
+            oldest = next(iter(self._idle.values()))
+            if oldest.idle_seconds(now) <= self.idle_ttl:
+                break
+            expired.append(self._idle.popitem(last=False)[1])
+        return expired
+
+    def _define_library(self, entry: PooledRunspace) -> None:
+        ps = PowerShell(entry.pool)
+        ps.add_script(self.library.text)
+        with timed_phase("define_library"):
+            invoke_pipeline(ps, "define_library")
+        if ps.had_errors:
+            raise RuntimeError(f"Defining the script library failed: {'; '.join(map(str, ps.streams.error))}")
+        entry.library_version = self.library.version
+
+    @staticmethod
+    def _is_healthy(entry: PooledRunspace) -> bool:
+        if entry.pool.state != RunspacePoolState.OPENED:
+            return False
+        try:
+            entry.pool.get_available_runspaces()
+            return True
+        except Exception as exc:
+            logger.debug("WinRM pool health check failed for %s: %s", entry.key[0], exc)
+            return False
+
+    @staticmethod
+    def _open(key: PoolKey, target_ip: str, password: str, port: int, use_ssl: bool,
+              budget: Optional[float] = None) -> PooledRunspace:
+        wsman = WSMan(
+            target_ip,
+            username=WINRM_USERNAME,
+            password=password,
+            ssl=use_ssl,
+            port=port,
+            auth="basic",
+            encryption="never",
+            cert_validation=cert_validation_setting(),
+        )
+        apply_timeouts(wsman, budget)
+        if use_ssl:
+            # pypsrp builds its requests session lazily; build it now to swap in the
+            # adapter that resumes TLS sessions (the connection itself is kept alive
+            # by the session for as long as the pool stays cached).
+            transport = wsman.transport
+            transport.session = transport._build_session()
+            retries = transport.session.get_adapter("https://").max_retries
+            transport.session.mount("https://", ResumingHTTPAdapter(TLS_CONTEXT, max_retries=retries))
+        pool = RunspacePool(wsman)
+        try:
+            with timed_phase("pool_open"):
+                pool.open()
+        except BaseException:
+            wsman.close()
+            raise
+        return PooledRunspace(key=key, wsman=wsman, pool=pool)
+
+    @staticmethod
+    def _close(entry: PooledRunspace) -> None:
+        try:
+            apply_timeouts(entry.wsman, POOL_CLOSE_TIMEOUT_SECONDS)
+            if entry.pool.state == RunspacePoolState.OPENED:
+                with timed_phase("pool_close"):
+                    entry.pool.close()
+        except Exception as exc:
+            logger.debug("Error closing WinRM pool for %s: %s", entry.key[0], exc)
+        finally:
+            try:
+                entry.wsman.close()
+            except Exception:
+                pass
+
+
+POOL_CACHE = RunspacePoolCache()
+atexit.register(POOL_CACHE.close_all)